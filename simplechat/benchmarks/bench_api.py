@@ -0,0 +1,162 @@
+"""Load generator for the main chat API endpoints.
+
+Seeds users, threads and messages with a Zipf-like skew, then drives each
+scenario concurrently in-process through ``simplechat.asgi`` or
+``simplechat.wsgi`` and prints latency percentiles, throughput and queries
+per request as JSON:
+
+    python benchmarks/bench_api.py --transport asgi --output before.json
+    python benchmarks/bench_api.py --transport asgi --compare before.json
+"""
+import argparse
+import asyncio
+import json
+import random
+
+from common import (
+    AsgiClient, QueryCounter, WsgiClient, access_token, environment, run_concurrently, seed,
+    setup_django, summarize,
+)
+
+SCENARIOS = ('thread_create', 'message_list', 'send', 'mark_read', 'unread')
+
+
+class Workload:
+    """Picks skewed users and builds the request of each scenario."""
+
+    def __init__(self, users, skew, seed_value):
+        from chat.models import Message, Thread
+
+        self.rng = random.Random(seed_value)
+        self.users = users
+        self.weights = [1 / (rank ** skew) for rank in range(1, len(users) + 1)]
+        self.tokens = {user.pk: access_token(user) for user in users}
+        self.threads = {user.pk: [] for user in users}
+        for thread in Thread.objects.exclude(user_low=None):
+            self.threads[thread.user_low_id].append(thread.pk)
+            self.threads[thread.user_high_id].append(thread.pk)
+        self.unread = {user.pk: [] for user in users}
+        participants = Thread.participants.through.objects.values_list('thread_id', 'user_id')
+        members = {}
+        for thread_id, user_id in participants:
+            members.setdefault(thread_id, []).append(user_id)
+        for message_id, thread_id, sender_id in Message.objects.filter(is_read=False).values_list(
+            'id', 'thread_id', 'sender_id'
+        ):
+            for user_id in members.get(thread_id, []):
+                if user_id != sender_id:
+                    self.unread[user_id].append(message_id)
+
+    def user(self, with_threads=True):
+        while True:
+            user = self.rng.choices(self.users, self.weights)[0]
+            if self.threads[user.pk] or not with_threads:
+                return user.pk
+
+    def request(self, scenario):
+        """Return ``(method, path, user_id, body)`` for one request."""
+        if scenario == 'thread_create':
+            first = self.user(with_threads=False)
+            second = self.rng.choice(self.users).pk
+            while second == first:
+                second = self.rng.choice(self.users).pk
+            return 'POST', '/chat/threads/', first, {'participants': [first, second]}
+        user_id = self.user()
+        thread_id = self.rng.choice(self.threads[user_id])
+        if scenario == 'message_list':
+            return 'GET', f'/chat/messages/?thread={thread_id}', user_id, None
+        if scenario == 'send':
+            return 'POST', '/chat/messages/', user_id, {'thread': thread_id, 'text': 'x' * self.rng.randint(5, 200)}
+        if scenario == 'mark_read':
+            pending = self.unread[user_id]
+            message_id = pending.pop() if pending else None
+            if message_id is None:
+                return 'GET', '/chat/messages/unread/', user_id, None
+            return 'POST', f'/chat/messages/{message_id}/mark_as_read/', user_id, None
+        return 'GET', '/chat/messages/unread/', user_id, None
+
+
+def compare(results, baseline):
+    """Relative change of each metric against a previous run (negative is faster)."""
+    changes = {}
+    for name, result in results.items():
+        before = baseline.get('results', {}).get(name)
+        if not before:
+            continue
+        changes[name] = {
+            metric: round((result[metric] - before[metric]) / before[metric], 3) if before.get(metric) else None
+            for metric in ('p50_ms', 'p95_ms', 'p99_ms', 'throughput_rps', 'queries_per_request')
+        }
+    return changes
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--transport', choices=('asgi', 'wsgi'), default='asgi')
+    parser.add_argument('--scenario', action='append', choices=SCENARIOS,
+                        help='Scenario to run; repeat for several (default: all).')
+    parser.add_argument('--users', type=int, default=50)
+    parser.add_argument('--threads', type=int, default=200)
+    parser.add_argument('--messages-per-thread', type=int, default=20)
+    parser.add_argument('--skew', type=float, default=1.2)
+    parser.add_argument('--requests', type=int, default=500)
+    parser.add_argument('--concurrency', type=int, default=20)
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--output', help='Also write the result to this file.')
+    parser.add_argument('--compare', help='A previous result file to compare against.')
+    args = parser.parse_args()
+
+    teardown = setup_django()
+    try:
+        users = seed(users=args.users, threads=args.threads, messages_per_thread=args.messages_per_thread,
+                     skew=args.skew, seed_value=args.seed)
+        workload = Workload(users, args.skew, args.seed)
+        if args.transport == 'asgi':
+            from simplechat.asgi import application
+            client = AsgiClient(application)
+        else:
+            from simplechat.wsgi import application
+            client = WsgiClient(application, workers=args.concurrency)
+        counter = QueryCounter()
+        counter.install()
+
+        results = {}
+        for scenario in args.scenario or SCENARIOS:
+            errors = 0
+
+            async def request(index, scenario=scenario):
+                nonlocal errors
+                method, path, user_id, body = workload.request(scenario)
+                response = await client.request(method, path, token=workload.tokens[user_id], body=body)
+                if response['status'] >= 400:
+                    errors += 1
+
+            counter.reset()
+            latencies, elapsed = asyncio.run(run_concurrently(request, args.requests, args.concurrency))
+            results[scenario] = summarize(latencies, elapsed, {
+                'concurrency': args.concurrency,
+                'errors': errors,
+                'queries_per_request': round(counter.reset() / args.requests, 2),
+            })
+        if isinstance(client, WsgiClient):
+            client.close()
+
+        report = {
+            'environment': environment(),
+            'parameters': {key: value for key, value in vars(args).items() if key not in ('output', 'compare')},
+            'results': results,
+        }
+        if args.compare:
+            with open(args.compare) as handle:
+                report['comparison'] = compare(results, json.load(handle))
+        output = json.dumps(report, indent=2)
+        print(output)
+        if args.output:
+            with open(args.output, 'w') as handle:
+                handle.write(output + '\n')
+    finally:
+        teardown()
+
+
+if __name__ == '__main__':
+    main()
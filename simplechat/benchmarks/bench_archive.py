@@ -0,0 +1,92 @@
+"""Listing latency with the full history in the hot table versus after archiving.
+
+Seeds messages spread over two years, times the first page of the message
+list, a thread's messages and the inbox through ``simplechat.asgi``, moves
+everything older than ``--days`` to the archive and times them again:
+
+    python benchmarks/bench_archive.py --messages 1000000 --days 30
+"""
+import argparse
+import asyncio
+import json
+import time
+
+from common import AsgiClient, access_token, run_concurrently, seed, setup_django, summarize
+
+ENDPOINTS = {
+    'messages': '/chat/messages/?nocache={index}',
+    'thread_messages': '/chat/messages/?thread={thread}&nocache={index}',
+    'inbox': '/chat/threads/?view=inbox&nocache={index}',
+}
+
+
+def spread_history(days):
+    """Backdate every message to a random time in the last ``days`` days."""
+    from django.db import connection
+    from django.db.models import F, OuterRef, Subquery
+
+    from chat.models import Message, Thread
+
+    with connection.cursor() as cursor:
+        cursor.execute(
+            "UPDATE chat_message SET created = datetime('now', '-' || (abs(random()) % %s) || ' minutes')",
+            [days * 24 * 60],
+        )
+    latest = Message.objects.filter(thread=OuterRef('pk')).order_by('-created', '-id')
+    Thread.objects.update(last_message=Subquery(latest.values('pk')[:1]), updated=F('created'))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--messages', type=int, default=500000)
+    parser.add_argument('--threads', type=int, default=2000)
+    parser.add_argument('--days', type=int, default=30, help='Keep this many days of messages hot.')
+    parser.add_argument('--requests', type=int, default=300)
+    parser.add_argument('--concurrency', type=int, default=10)
+    args = parser.parse_args()
+
+    teardown = setup_django()
+    try:
+        users = seed(users=200, threads=args.threads, messages_per_thread=args.messages // args.threads)
+        spread_history(730)
+
+        from chat.archive import archive_batches
+        from chat.models import ArchivedMessage, Message, Thread
+        from django.utils import timezone
+        from simplechat.asgi import application
+
+        client = AsgiClient(application)
+        tokens = {user.pk: access_token(user) for user in users}
+        threads = list(Thread.objects.values_list('id', 'user_low_id'))
+
+        def run(label, results):
+            for name, path in ENDPOINTS.items():
+                async def request(index, path=path):
+                    thread_id, user_id = threads[index % len(threads)]
+                    url = path.format(index=f'{label}{index}', thread=thread_id)
+                    response = await client.request('GET', url, token=tokens[user_id])
+                    assert response['status'] == 200, response
+
+                latencies, elapsed = asyncio.run(run_concurrently(request, args.requests, args.concurrency))
+                results[f'{name}.{label}'] = summarize(latencies, elapsed, {'concurrency': args.concurrency})
+
+        results = {}
+        run('hot', results)
+        started = time.perf_counter()
+        moved = sum(archive_batches(timezone.now() - timezone.timedelta(days=args.days), batch_size=5000))
+        archived = time.perf_counter() - started
+        run('archived', results)
+        print(json.dumps({
+            'messages': args.messages,
+            'archived': moved,
+            'archive_seconds': round(archived, 1),
+            'hot_rows': Message.objects.count(),
+            'archive_rows': ArchivedMessage.objects.count(),
+            'results': results,
+        }, indent=2))
+    finally:
+        teardown()
+
+
+if __name__ == '__main__':
+    main()
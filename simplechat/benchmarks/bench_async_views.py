@@ -0,0 +1,51 @@
+"""Requests/second of the sync DRF list endpoints versus their async variants.
+
+Both sets are served through ``simplechat.asgi`` in one process with the same
+number of concurrent in-flight requests:
+
+    python benchmarks/bench_async_views.py --requests 500 --concurrency 50
+"""
+import argparse
+import asyncio
+import json
+
+from common import AsgiClient, access_token, run_concurrently, seed, setup_django, summarize
+
+ENDPOINTS = [
+    ('threads', '/chat/threads/', '/chat/async/threads/'),
+    ('inbox', '/chat/threads/?view=inbox', '/chat/async/threads/?view=inbox'),
+    ('messages', '/chat/messages/', '/chat/async/messages/'),
+    ('unread', '/chat/messages/unread/', '/chat/async/messages/unread/'),
+]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--requests', type=int, default=500)
+    parser.add_argument('--concurrency', type=int, default=50)
+    args = parser.parse_args()
+
+    teardown = setup_django()
+    try:
+        users = seed(users=50, threads=200, messages_per_thread=20)
+        tokens = [access_token(user) for user in users]
+
+        from simplechat.asgi import application
+        client = AsgiClient(application)
+
+        results = {}
+        for name, sync_path, async_path in ENDPOINTS:
+            for variant, path in (('sync', sync_path), ('async', async_path)):
+                async def request(index, path=path):
+                    response = await client.request('GET', path, token=tokens[index % len(tokens)])
+                    assert response['status'] == 200, response
+
+                latencies, elapsed = asyncio.run(run_concurrently(request, args.requests, args.concurrency))
+                results[f'{name}.{variant}'] = summarize(latencies, elapsed, {'concurrency': args.concurrency})
+        print(json.dumps(results, indent=2))
+    finally:
+        teardown()
+
+
+if __name__ == '__main__':
+    main()
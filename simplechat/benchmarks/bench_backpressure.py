@@ -0,0 +1,80 @@
+"""Load shedding by the concurrency limit, and the cost of a throttle check.
+
+Floods the uncached message list through ``simplechat.asgi`` with far more
+requests in flight than the server can work on, once without a limit and
+once with ``CHAT_MAX_CONCURRENT_REQUESTS``, and reports the latency of the
+requests that were served and the share that got a 503. Then times token
+bucket checks against the in-process and the cache store:
+
+    python benchmarks/bench_backpressure.py --concurrency 200 --limit 16
+"""
+import argparse
+import asyncio
+import json
+import time
+
+from common import AsgiClient, access_token, environment, run_concurrently, seed, setup_django, summarize
+
+
+def flood(client, tokens, args, label):
+    statuses = {}
+    served = []
+
+    async def request(index):
+        started = time.perf_counter()
+        response = await client.request('GET', f'/chat/messages/?nocache={label}{index}', token=tokens[index % len(tokens)])
+        statuses[response['status']] = statuses.get(response['status'], 0) + 1
+        if response['status'] == 200:
+            served.append(time.perf_counter() - started)
+
+    _, elapsed = asyncio.run(run_concurrently(request, args.requests, args.concurrency))
+    result = summarize(served, elapsed, {'concurrency': args.concurrency})
+    result['statuses'] = statuses
+    result['shed_ratio'] = round(statuses.get(503, 0) / args.requests, 3)
+    return result
+
+
+def time_checks(store, keys, checks):
+    started = time.perf_counter()
+    for index in range(checks):
+        store.consume(f'chat:throttle:read:user:{index % keys}', 10.0, 600)
+    elapsed = time.perf_counter() - started
+    return {'checks': checks, 'keys': keys, 'us_per_check': round(elapsed / checks * 1e6, 3)}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--requests', type=int, default=2000)
+    parser.add_argument('--concurrency', type=int, default=200)
+    parser.add_argument('--limit', type=int, default=16, help='CHAT_MAX_CONCURRENT_REQUESTS for the limited run.')
+    parser.add_argument('--checks', type=int, default=200000)
+    args = parser.parse_args()
+
+    teardown = setup_django()
+    try:
+        users = seed(users=50, threads=500, messages_per_thread=40)
+
+        from django.test import override_settings
+
+        from chat.throttling import CacheBucketStore, LocalBucketStore
+        from simplechat.asgi import application
+
+        client = AsgiClient(application)
+        tokens = [access_token(user) for user in users]
+        results = {}
+        for name, limit in (('unlimited', 0), ('limited', args.limit)):
+            with override_settings(CHAT_MAX_CONCURRENT_REQUESTS=limit):
+                results[name] = flood(client, tokens, args, name)
+            results[name]['limit'] = limit
+
+        checks = {
+            'local': time_checks(LocalBucketStore(), 10000, args.checks),
+            'cache': time_checks(CacheBucketStore(), 10000, args.checks),
+        }
+        print(json.dumps({'environment': environment(), 'results': results, 'throttle_checks': checks}, indent=2))
+    finally:
+        teardown()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,49 @@
+"""Concurrent send throughput with the default SQLite settings versus the tuned profile.
+
+Runs ``bench_api.py`` once per profile in a fresh process, since the
+profile is read from environment variables at startup, and prints the
+results side by side:
+
+    python benchmarks/bench_db_profile.py --requests 1000 --concurrency 20
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+
+PROFILES = {
+    # What a plain SQLite setup does: rollback journal, full fsync, deferred
+    # transactions and a new connection per request.
+    'baseline': {
+        'SQLITE_JOURNAL_MODE': 'delete', 'SQLITE_SYNCHRONOUS': 'full', 'SQLITE_TRANSACTION_MODE': 'deferred',
+        'DB_CONN_MAX_AGE': '0',
+    },
+    'tuned': {},
+}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--transport', choices=('asgi', 'wsgi'), default='wsgi')
+    parser.add_argument('--requests', type=int, default=1000)
+    parser.add_argument('--concurrency', type=int, default=20)
+    args = parser.parse_args()
+
+    script = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'bench_api.py')
+    results = {}
+    for name, overrides in PROFILES.items():
+        env = {key: value for key, value in os.environ.items() if key not in PROFILES['baseline']}
+        env.update(overrides)
+        output = subprocess.run(
+            [sys.executable, script, '--transport', args.transport, '--scenario', 'send',
+             '--scenario', 'message_list', '--requests', str(args.requests),
+             '--concurrency', str(args.concurrency)],
+            env=env, capture_output=True, text=True, check=True,
+        ).stdout
+        results[name] = json.loads(output)['results']
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == '__main__':
+    main()
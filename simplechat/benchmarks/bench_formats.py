@@ -0,0 +1,73 @@
+"""Bytes and CPU per page for each response format of the list endpoints.
+
+Serializes full pages of the message list and the inbox once, then renders
+them with the default JSON renderer, compact JSON and MessagePack, with and
+without gzip, and reports the body size and the CPU time to render and to
+compress a page:
+
+    python benchmarks/bench_formats.py --page-size 100 --rounds 200
+"""
+import argparse
+import json
+import time
+
+from common import environment, seed, setup_django
+
+
+def cpu_per_call(function, rounds):
+    started = time.process_time()
+    for _ in range(rounds):
+        function()
+    return (time.process_time() - started) / rounds
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--page-size', type=int, default=100)
+    parser.add_argument('--rounds', type=int, default=200)
+    args = parser.parse_args()
+
+    teardown = setup_django()
+    try:
+        users = seed(users=20, threads=200, messages_per_thread=50)
+
+        from django.utils.text import compress_string
+        from rest_framework.renderers import JSONRenderer
+
+        from chat.renderers import CompactJSONRenderer, MessagePackRenderer
+        from chat.serializers import InboxThreadSerializer, MessageSerializer
+        from chat.views import message_queryset, thread_queryset
+
+        user = users[0]
+        pages = {
+            'messages': lambda: MessageSerializer(
+                message_queryset(user).order_by('-created', '-id')[:args.page_size], many=True,
+            ).data,
+            'inbox': lambda: InboxThreadSerializer(
+                thread_queryset(user, inbox=True).order_by('-updated', '-id')[:args.page_size], many=True,
+            ).data,
+        }
+        renderers = {'json': JSONRenderer(), 'compact': CompactJSONRenderer(), 'msgpack': MessagePackRenderer()}
+
+        results = {}
+        for page_name, build in pages.items():
+            serialize_ms = cpu_per_call(build, max(args.rounds // 10, 1)) * 1000
+            data = {'next': 'https://example.com/chat/?cursor=x', 'previous': None, 'results': build()}
+            for name, renderer in renderers.items():
+                body = renderer.render(data)
+                compressed = compress_string(body)
+                results[f'{page_name}.{name}'] = {
+                    'rows': len(data['results']),
+                    'bytes': len(body),
+                    'gzip_bytes': len(compressed),
+                    'serialize_ms': round(serialize_ms, 3),
+                    'render_ms': round(cpu_per_call(lambda: renderer.render(data), args.rounds) * 1000, 3),
+                    'gzip_ms': round(cpu_per_call(lambda: compress_string(body), args.rounds) * 1000, 3),
+                }
+        print(json.dumps({'environment': environment(), 'page_size': args.page_size, 'results': results}, indent=2))
+    finally:
+        teardown()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,93 @@
+"""Send and unread latency in group threads as the group grows.
+
+For each group size, creates a group thread holding a backlog of messages
+that no member has read yet, then sends messages into it and asks a member
+for their unread total through ``simplechat.asgi``, reporting latency and
+queries per request. A two-person direct thread is measured the same way
+for comparison:
+
+    python benchmarks/bench_groups.py --sizes 10 100 500 --requests 200
+"""
+import argparse
+import asyncio
+import json
+import time
+
+from common import AsgiClient, QueryCounter, access_token, environment, seed, setup_django, summarize
+
+
+def measure(client, counter, method, path, token, body, requests):
+    async def run():
+        latencies = []
+        counter.reset()
+        started = time.perf_counter()
+        for _ in range(requests):
+            begun = time.perf_counter()
+            response = await client.request(method, path, token=token, body=body)
+            assert response['status'] in (200, 201), response
+            latencies.append(time.perf_counter() - begun)
+        return latencies, time.perf_counter() - started
+
+    latencies, elapsed = asyncio.run(run())
+    result = summarize(latencies, elapsed)
+    result['queries_per_request'] = round(counter.reset() / requests, 2)
+    return result
+
+
+def build_thread(members, backlog, is_group):
+    from django.db import transaction
+
+    from chat.models import Message, Thread
+
+    with transaction.atomic():
+        thread = Thread.objects.create(is_group=is_group, name=f'group of {len(members)}' if is_group else '')
+        Message.objects.bulk_create(
+            Message(thread=thread, sender=members[index % (len(members) - 1) + 1], text=f'backlog {index}')
+            for index in range(backlog)
+        )
+        thread.last_message_id = Message.objects.filter(thread=thread).latest('id').id
+        thread.save(update_fields=['last_message_id'])
+        # Adding the members last sets the pair key and counts the direct thread's unread.
+        thread.participants.add(*members)
+    return thread
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--sizes', type=int, nargs='+', default=[10, 100, 500])
+    parser.add_argument('--backlog', type=int, default=2000, help='Unread messages in each thread before the run.')
+    parser.add_argument('--requests', type=int, default=200)
+    args = parser.parse_args()
+
+    teardown = setup_django()
+    try:
+        users = seed(users=max(args.sizes) + 1, threads=200, messages_per_thread=20)
+
+        from django.contrib.auth import get_user_model
+        from django.contrib.auth.hashers import make_password
+
+        from simplechat.asgi import application
+
+        counter = QueryCounter()
+        counter.install()
+        client = AsgiClient(application)
+        results = {}
+        for size in [2, *args.sizes]:
+            # The reader belongs to this thread only, so its total is this thread's unread.
+            reader = get_user_model().objects.create(username=f'reader{size}', password=make_password('bench1234'))
+            thread = build_thread([reader, *users[:size - 1]], args.backlog, is_group=size > 2)
+            sender = access_token(users[0])
+            results['direct' if size == 2 else f'group_{size}'] = {
+                'members': size,
+                'send': measure(client, counter, 'POST', '/chat/messages/', sender,
+                                {'thread': thread.pk, 'text': 'hello'}, args.requests),
+                'unread': measure(client, counter, 'GET', '/chat/messages/unread/', access_token(reader),
+                                  None, args.requests),
+            }
+        print(json.dumps({'environment': environment(), 'backlog': args.backlog, 'results': results}, indent=2))
+    finally:
+        teardown()
+
+
+if __name__ == '__main__':
+    main()
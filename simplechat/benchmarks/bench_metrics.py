@@ -0,0 +1,43 @@
+"""Overhead of the metrics middleware on the main chat API endpoints.
+
+Runs ``bench_api.py`` in a fresh process with ``METRICS=0`` and with
+``METRICS=1`` and prints both results with the relative change:
+
+    python benchmarks/bench_metrics.py --requests 2000 --concurrency 20
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--transport', choices=('asgi', 'wsgi'), default='asgi')
+    parser.add_argument('--requests', type=int, default=1000)
+    parser.add_argument('--concurrency', type=int, default=20)
+    args = parser.parse_args()
+
+    script = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'bench_api.py')
+    results = {}
+    for name, enabled in (('off', '0'), ('on', '1')):
+        output = subprocess.run(
+            [sys.executable, script, '--transport', args.transport, '--requests', str(args.requests),
+             '--concurrency', str(args.concurrency)],
+            env={**os.environ, 'METRICS': enabled}, capture_output=True, text=True, check=True,
+        ).stdout
+        results[name] = json.loads(output)['results']
+
+    change = {
+        scenario: {
+            metric: round(results['on'][scenario][metric] / results['off'][scenario][metric] - 1, 3)
+            for metric in ('p50_ms', 'p99_ms', 'throughput_rps')
+        }
+        for scenario in results['off']
+    }
+    print(json.dumps({'results': results, 'change': change}, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,99 @@
+"""Latency of GET /chat/messages/search/ with the full-text index versus a scan.
+
+Seeds messages made of Zipf-distributed words, so there are common, medium
+and rare terms, then times searches for each class of term through
+``simplechat.asgi``:
+
+    python benchmarks/bench_search.py --messages 2000000
+"""
+import argparse
+import asyncio
+import json
+import random
+import time
+from contextlib import nullcontext
+from unittest import mock
+
+from common import AsgiClient, access_token, run_concurrently, seed, setup_django, summarize
+
+VOCABULARY = 20000
+
+
+def word(rank):
+    letters = 'abcdefghijklmnopqrstuvwxyz'
+    name = ''
+    rank += 1
+    while rank:
+        rank, remainder = divmod(rank - 1, len(letters))
+        name = letters[remainder] + name
+    return 'w' + name
+
+
+def seed_messages(total, users, rng, batch_size=10000):
+    from django.db import transaction
+
+    from chat.models import Message, Thread, UnreadCounter
+
+    threads = list(Thread.objects.exclude(user_low=None).values_list('id', 'user_low_id', 'user_high_id'))
+    weights = [1 / rank for rank in range(1, VOCABULARY + 1)]
+    words = [word(rank) for rank in range(VOCABULARY)]
+    with transaction.atomic():
+        for start in range(0, total, batch_size):
+            batch = []
+            for _ in range(min(batch_size, total - start)):
+                thread_id, low, high = rng.choice(threads)
+                text = ' '.join(rng.choices(words, weights, k=rng.randint(3, 25)))
+                batch.append(Message(thread_id=thread_id, sender_id=rng.choice((low, high)), text=text))
+            Message.objects.bulk_create(batch)
+        UnreadCounter.objects.rebuild()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--messages', type=int, default=1000000)
+    parser.add_argument('--users', type=int, default=200)
+    parser.add_argument('--threads', type=int, default=2000)
+    parser.add_argument('--requests', type=int, default=50, help='Searches per term class and backend.')
+    parser.add_argument('--concurrency', type=int, default=1)
+    parser.add_argument('--skip-scan', action='store_true', help='Only time the indexed backend.')
+    args = parser.parse_args()
+
+    teardown = setup_django()
+    try:
+        rng = random.Random(42)
+        users = seed(users=args.users, threads=args.threads, messages_per_thread=0)
+        started = time.perf_counter()
+        seed_messages(args.messages, users, rng)
+        seeded = time.perf_counter() - started
+
+        from chat.search import ScanSearchBackend
+        from simplechat.asgi import application
+        client = AsgiClient(application)
+        tokens = [access_token(user) for user in users[:20]]
+        terms = {
+            'common': [word(rank) for rank in range(0, 5)],
+            'medium': [word(rank) for rank in range(200, 205)],
+            'rare': [word(rank) for rank in range(15000, 15005)],
+            'two_terms': [f'{word(3)}+{word(250)}'],
+            'prefix': [word(300)[:-1]],
+        }
+
+        results = {}
+        backends = [('index', None)] + ([] if args.skip_scan else [('scan', ScanSearchBackend)])
+        for backend_name, backend in backends:
+            for kind, queries in terms.items():
+                async def request(index, queries=queries):
+                    path = f'/chat/messages/search/?q={queries[index % len(queries)]}'
+                    response = await client.request('GET', path, token=tokens[index % len(tokens)])
+                    assert response['status'] == 200, response
+
+                with mock.patch('chat.views.get_backend', backend) if backend else nullcontext():
+                    latencies, elapsed = asyncio.run(run_concurrently(request, args.requests, args.concurrency))
+                results[f'{kind}.{backend_name}'] = summarize(latencies, elapsed, {'concurrency': args.concurrency})
+        print(json.dumps({'messages': args.messages, 'seed_seconds': round(seeded, 1), 'results': results}, indent=2))
+    finally:
+        teardown()
+
+
+if __name__ == '__main__':
+    main()
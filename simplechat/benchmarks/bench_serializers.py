@@ -0,0 +1,71 @@
+"""Rows per second of the ModelSerializers versus the ``values()`` row serializers.
+
+For message, thread and inbox pages, times fetching and serializing a page
+both ways, and serializing alone from rows that are already loaded (the
+thread and inbox row serializers still query the participants there, which
+the ModelSerializers get from the prefetched instances):
+
+    python benchmarks/bench_serializers.py --page-size 100 --rounds 200
+"""
+import argparse
+import json
+import time
+
+from common import environment, seed, setup_django
+
+
+def rows_per_second(function, rows, rounds):
+    started = time.perf_counter()
+    for _ in range(rounds):
+        function()
+    return round(rows * rounds / (time.perf_counter() - started))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--page-size', type=int, default=100)
+    parser.add_argument('--rounds', type=int, default=200)
+    args = parser.parse_args()
+
+    teardown = setup_django()
+    try:
+        users = seed(users=20, threads=400, messages_per_thread=50)
+
+        from chat.serializers import (
+            InboxRowSerializer, InboxThreadSerializer, MessageRowSerializer, MessageSerializer,
+            ThreadRowSerializer, ThreadSerializer,
+        )
+        from chat.views import message_queryset, thread_queryset
+
+        user = users[0]
+        pages = {
+            'messages': (MessageSerializer, MessageRowSerializer, message_queryset(user).order_by('-created', '-id')),
+            'threads': (ThreadSerializer, ThreadRowSerializer, thread_queryset(user).order_by('-created', '-id')),
+            'inbox': (InboxThreadSerializer, InboxRowSerializer, thread_queryset(user, inbox=True).order_by('-updated', '-id')),
+        }
+        results = {}
+        for name, (model_serializer, row_serializer, queryset) in pages.items():
+            page = queryset[:args.page_size]
+            rows = len(page)
+            instances = list(page)
+            values = list(row_serializer.rows(page))
+            result = {
+                'rows': rows,
+                'model.fetch_and_serialize': rows_per_second(
+                    lambda: model_serializer(page.all(), many=True).data, rows, args.rounds),
+                'values.fetch_and_serialize': rows_per_second(
+                    lambda: row_serializer(row_serializer.rows(page), many=True).data, rows, args.rounds),
+                'model.serialize': rows_per_second(
+                    lambda: model_serializer(instances, many=True).data, rows, args.rounds),
+                'values.serialize': rows_per_second(
+                    lambda: row_serializer(values, many=True).data, rows, args.rounds),
+            }
+            result['speedup'] = round(result['values.fetch_and_serialize'] / result['model.fetch_and_serialize'], 2)
+            results[name] = result
+        print(json.dumps({'environment': environment(), 'page_size': args.page_size, 'results': results}, indent=2))
+    finally:
+        teardown()
+
+
+if __name__ == '__main__':
+    main()
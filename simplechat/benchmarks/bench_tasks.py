@@ -0,0 +1,80 @@
+"""Send latency with side effects run inline versus queued for ``chat_worker``.
+
+Drives ``POST /chat/messages/`` through ``simplechat.asgi`` with
+``CHAT_TASKS_MODE`` set to ``inline`` and then ``queue``, prints the latency
+percentiles of each, and how fast a worker drains the queued tasks:
+
+    python benchmarks/bench_tasks.py --requests 2000 --concurrency 20
+"""
+import argparse
+import asyncio
+import json
+import random
+import time
+
+from common import AsgiClient, access_token, run_concurrently, seed, setup_django, summarize
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--requests', type=int, default=1000)
+    parser.add_argument('--concurrency', type=int, default=20)
+    parser.add_argument('--batch-size', type=int, default=100)
+    parser.add_argument('--rounds', type=int, default=2, help='Alternate the modes this many times.')
+    args = parser.parse_args()
+
+    teardown = setup_django()
+    try:
+        users = seed(users=50, threads=200, messages_per_thread=5)
+
+        from django.test.utils import override_settings
+
+        from chat.models import Task, Thread
+        from chat.tasks import run_batch
+        from simplechat.asgi import application
+
+        client = AsgiClient(application)
+        tokens = {user.pk: access_token(user) for user in users}
+        threads = list(Thread.objects.values_list('id', 'user_low_id'))
+        rng = random.Random(42)
+
+        async def request(index):
+            thread_id, user_id = rng.choice(threads)
+            response = await client.request('POST', '/chat/messages/', token=tokens[user_id],
+                                            body={'thread': thread_id, 'text': f'message {index}'})
+            assert response['status'] == 201, response
+
+        # Alternate the modes so that the growing tables and warm-up affect both alike.
+        latencies = {'inline': [], 'queue': []}
+        elapsed = dict.fromkeys(latencies, 0.0)
+        for _ in range(args.rounds):
+            for mode in latencies:
+                with override_settings(CHAT_TASKS_MODE=mode):
+                    round_latencies, round_elapsed = asyncio.run(
+                        run_concurrently(request, args.requests, args.concurrency)
+                    )
+                latencies[mode] += round_latencies
+                elapsed[mode] += round_elapsed
+        results = {
+            f'send.{mode}': summarize(latencies[mode], elapsed[mode], {'concurrency': args.concurrency})
+            for mode in latencies
+        }
+
+        queued = Task.objects.filter(status=Task.PENDING).count()
+        started = time.perf_counter()
+        while run_batch(args.batch_size):
+            pass
+        drained = time.perf_counter() - started
+        results['worker'] = {
+            'tasks': queued,
+            'seconds': round(drained, 3),
+            'tasks_per_second': round(queued / drained, 1) if drained else None,
+            'batch_size': args.batch_size,
+        }
+        print(json.dumps(results, indent=2))
+    finally:
+        teardown()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,281 @@
+"""Shared helpers for the benchmark scripts in this directory.
+
+The scripts run the project in-process against a throw-away SQLite file, so
+they need no running server and never touch ``db.sqlite3``. Per-user
+throttles and the concurrency limit are off unless a script turns them on,
+since a handful of seeded users drive all of the load.
+"""
+import asyncio
+import io
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BASE_DIR)
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'simplechat.settings')
+os.environ.setdefault('THROTTLE', '0')
+os.environ.setdefault('MAX_CONCURRENT_REQUESTS', '0')
+
+
+def setup_django(database_name=None):
+    """Configure Django against a fresh, migrated benchmark database.
+
+    Returns a callable that drops the database again.
+    """
+    import django
+    from django.conf import settings
+
+    django.setup()
+    from django.db import connection
+
+    if database_name is None:
+        handle, database_name = tempfile.mkstemp(prefix='simplechat-bench-', suffix='.sqlite3')
+        os.close(handle)
+        os.unlink(database_name)
+    settings.DATABASES['default'].setdefault('TEST', {})['NAME'] = database_name
+    connection.creation.create_test_db(verbosity=0, autoclobber=True, serialize=False)
+
+    def teardown():
+        connection.creation.destroy_test_db(database_name, verbosity=0)
+
+    return teardown
+
+
+def seed(users=20, threads=50, messages_per_thread=20, skew=1.2, seed_value=42):
+    """Create users, two-person threads and messages with a Zipf-like skew.
+
+    A handful of users take part in most threads and a few threads hold most
+    messages, like real chat traffic. Returns the list of users.
+    """
+    import random
+
+    from django.contrib.auth import get_user_model
+    from django.contrib.auth.hashers import make_password
+    from django.db import transaction
+
+    from chat.models import Message, Thread, UnreadCounter
+
+    User = get_user_model()
+    rng = random.Random(seed_value)
+    weights = [1 / (rank ** skew) for rank in range(1, users + 1)]
+    password = make_password('bench1234')
+
+    with transaction.atomic():
+        people = User.objects.bulk_create(
+            User(username=f'bench{i}', password=password) for i in range(users)
+        )
+        pairs = set()
+        while len(pairs) < min(threads, users * (users - 1) // 2):
+            first, second = rng.choices(people, weights, k=2)
+            if first.pk != second.pk:
+                pairs.add(tuple(sorted((first.pk, second.pk))))
+        rows = Thread.objects.bulk_create(Thread(user_low_id=low, user_high_id=high) for low, high in pairs)
+        Thread.participants.through.objects.bulk_create(
+            Thread.participants.through(thread_id=thread.pk, user_id=user_id)
+            for thread in rows for user_id in (thread.user_low_id, thread.user_high_id)
+        )
+
+        thread_weights = [1 / (rank ** skew) for rank in range(1, len(rows) + 1)]
+        total = messages_per_thread * len(rows)
+        messages = []
+        for thread in rng.choices(rows, thread_weights, k=total):
+            sender = rng.choice((thread.user_low_id, thread.user_high_id))
+            messages.append(Message(thread=thread, sender_id=sender, text='x' * rng.randint(5, 200),
+                                    is_read=rng.random() < 0.7))
+        Message.objects.bulk_create(messages, batch_size=1000)
+        UnreadCounter.objects.rebuild()
+    return people
+
+
+def access_token(user):
+    from rest_framework_simplejwt.tokens import RefreshToken
+
+    return str(RefreshToken.for_user(user).access_token)
+
+
+class AsgiClient:
+    """Minimal in-process HTTP client for an ASGI application."""
+
+    def __init__(self, application):
+        self.application = application
+
+    async def request(self, method, path, token=None, body=None, headers=()):
+        path, _, query = path.partition('?')
+        payload = json.dumps(body).encode() if body is not None else b''
+        header_list = [
+            (b'host', b'localhost'), (b'content-type', b'application/json'),
+            (b'content-length', str(len(payload)).encode()),
+        ]
+        if token:
+            header_list.append((b'authorization', f'Bearer {token}'.encode()))
+        header_list.extend(headers)
+        scope = {
+            'type': 'http', 'asgi': {'version': '3.0'}, 'http_version': '1.1',
+            'method': method, 'scheme': 'http', 'path': path, 'raw_path': path.encode(),
+            'query_string': query.encode(), 'headers': header_list,
+            'client': ('127.0.0.1', 0), 'server': ('localhost', 80),
+        }
+        sent = False
+
+        async def receive():
+            nonlocal sent
+            if not sent:
+                sent = True
+                return {'type': 'http.request', 'body': payload, 'more_body': False}
+            # Never disconnect while the response is being produced.
+            await asyncio.Future()
+
+        response = {'status': None, 'headers': [], 'body': b''}
+
+        async def send(message):
+            if message['type'] == 'http.response.start':
+                response['status'] = message['status']
+                response['headers'] = message.get('headers', [])
+            elif message['type'] == 'http.response.body':
+                response['body'] += message.get('body', b'')
+
+        await self.application(scope, receive, send)
+        return response
+
+
+class WsgiClient:
+    """In-process HTTP client for a WSGI application.
+
+    Requests run on a thread pool, the way a threaded WSGI server serves
+    them, so the interface matches ``AsgiClient``.
+    """
+
+    def __init__(self, application, workers=50):
+        self.application = application
+        self.executor = ThreadPoolExecutor(max_workers=workers)
+
+    async def request(self, method, path, token=None, body=None, headers=()):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.executor, self.call, method, path, token, body, headers)
+
+    def call(self, method, path, token, body, headers):
+        path, _, query = path.partition('?')
+        payload = json.dumps(body).encode() if body is not None else b''
+        environ = {
+            'REQUEST_METHOD': method, 'PATH_INFO': path, 'QUERY_STRING': query,
+            'SERVER_NAME': 'localhost', 'SERVER_PORT': '80', 'SERVER_PROTOCOL': 'HTTP/1.1',
+            'CONTENT_TYPE': 'application/json', 'CONTENT_LENGTH': str(len(payload)),
+            'REMOTE_ADDR': '127.0.0.1', 'wsgi.input': io.BytesIO(payload), 'wsgi.url_scheme': 'http',
+            'wsgi.errors': sys.stderr, 'wsgi.multithread': True, 'wsgi.multiprocess': False,
+            'wsgi.run_once': False, 'wsgi.version': (1, 0),
+        }
+        if token:
+            environ['HTTP_AUTHORIZATION'] = f'Bearer {token}'
+        for name, value in headers:
+            environ['HTTP_' + name.decode().upper().replace('-', '_')] = value.decode()
+
+        response = {'status': None, 'headers': [], 'body': b''}
+
+        def start_response(status, response_headers, exc_info=None):
+            response['status'] = int(status.split()[0])
+            response['headers'] = [(name.lower().encode(), value.encode()) for name, value in response_headers]
+
+        result = self.application(environ, start_response)
+        try:
+            response['body'] = b''.join(result)
+        finally:
+            if hasattr(result, 'close'):
+                result.close()
+        return response
+
+    def close(self):
+        self.executor.shutdown()
+
+
+class QueryCounter:
+    """Count SQL statements run on every database connection, in any thread."""
+
+    def __init__(self):
+        self.count = 0
+        self.lock = threading.Lock()
+
+    def __call__(self, execute, sql, params, many, context):
+        with self.lock:
+            self.count += 1
+        return execute(sql, params, many, context)
+
+    def install(self):
+        from django.db import connections
+        from django.db.backends.signals import connection_created
+
+        def wrap(sender, connection, **kwargs):
+            if self not in connection.execute_wrappers:
+                connection.execute_wrappers.append(self)
+
+        connection_created.connect(wrap, weak=False)
+        for connection in connections.all():
+            wrap(None, connection)
+
+    def reset(self):
+        with self.lock:
+            count, self.count = self.count, 0
+        return count
+
+
+def environment():
+    """Describe the code and interpreter a result was produced with."""
+    import django
+
+    try:
+        revision = subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'], cwd=BASE_DIR, capture_output=True, text=True, check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        revision = None
+    return {
+        'revision': revision,
+        'python': sys.version.split()[0],
+        'django': django.get_version(),
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime()),
+    }
+
+
+def summarize(latencies, elapsed, extra=None):
+    """Return latency percentiles (ms) and throughput for a run."""
+    ordered = sorted(latencies)
+
+    def percentile(fraction):
+        if not ordered:
+            return 0.0
+        index = min(len(ordered) - 1, round(fraction * (len(ordered) - 1)))
+        return ordered[index] * 1000
+
+    result = {
+        'requests': len(ordered),
+        'seconds': round(elapsed, 3),
+        'throughput_rps': round(len(ordered) / elapsed, 1) if elapsed else 0.0,
+        'mean_ms': round(statistics.fmean(ordered) * 1000, 3) if ordered else 0.0,
+        'p50_ms': round(percentile(0.50), 3),
+        'p95_ms': round(percentile(0.95), 3),
+        'p99_ms': round(percentile(0.99), 3),
+    }
+    result.update(extra or {})
+    return result
+
+
+async def run_concurrently(make_request, total, concurrency):
+    """Issue ``total`` requests with at most ``concurrency`` in flight."""
+    latencies = []
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def one(index):
+        async with semaphore:
+            started = time.perf_counter()
+            await make_request(index)
+            latencies.append(time.perf_counter() - started)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(one(index) for index in range(total)))
+    return latencies, time.perf_counter() - started
@@ -1,11 +1,71 @@
 from django.contrib import admin
-from .models import Thread, Message
+from django.core.exceptions import ValidationError
+from django.db import transaction
+from django.db.models import OuterRef, Subquery
+from django.forms.models import BaseInlineFormSet
+
+from . import caching
+from .models import Membership, Thread, Message, UnreadCounter
+from .signals import resync_threads
+
+
+class MembershipFormSet(BaseInlineFormSet):
+
+    def clean(self):
+        super().clean()
+        members = [
+            form for form in self.forms
+            if form.cleaned_data.get('user') and not form.cleaned_data.get('DELETE')
+        ]
+        if not self.instance.is_group and len(members) > 2:
+            raise ValidationError("A direct thread cannot have more than 2 participants.")
+
+
+class MembershipInline(admin.TabularInline):
+    model = Membership
+    formset = MembershipFormSet
+    extra = 0
+    raw_id_fields = ('user',)
+
 
 @admin.register(Thread)
 class ThreadAdmin(admin.ModelAdmin):
-    list_display = ('id', 'created', 'updated')
-    filter_horizontal = ('participants',)
+    list_display = ('id', 'name', 'is_group', 'created', 'updated')
+    # Derived from the members and messages; kept in sync by the models.
+    readonly_fields = ('user_low', 'user_high', 'last_message')
+    inlines = [MembershipInline]
+
+    def get_queryset(self, request):
+        # Thread.__str__ lists participant usernames.
+        return super().get_queryset(request).prefetch_related('participants')
+
+    def save_related(self, request, form, formsets, change):
+        # The inline writes Membership rows directly, so m2m_changed never fires.
+        super().save_related(request, form, formsets, change)
+        removed = [
+            membership.user_id for formset in formsets
+            if formset.model is Membership for membership in formset.deleted_objects
+        ]
+        resync_threads([form.instance], removed_user_ids=removed)
 
 @admin.register(Message)
 class MessageAdmin(admin.ModelAdmin):
     list_display = ('id', 'thread', 'sender', 'created', 'is_read')
+    list_select_related = ('sender',)
+
+    def get_queryset(self, request):
+        # The thread column renders Thread.__str__, which lists participants.
+        return super().get_queryset(request).prefetch_related('thread__participants')
+
+    def delete_queryset(self, request, queryset):
+        # QuerySet.delete() skips Message.delete(); recompute what it maintains
+        # once per affected thread instead.
+        with transaction.atomic():
+            thread_ids = set(queryset.values_list('thread_id', flat=True))
+            queryset.delete()
+            latest = Message.objects.filter(thread=OuterRef('pk')).order_by('-created', '-id')
+            Thread.objects.filter(pk__in=thread_ids, last_message__isnull=True).update(
+                last_message=Subquery(latest.values('pk')[:1])
+            )
+            UnreadCounter.objects.rebuild(thread_ids=thread_ids)
+        caching.invalidate_threads(thread_ids)
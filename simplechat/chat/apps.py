@@ -4,3 +4,14 @@ from django.apps import AppConfig
 class ChatConfig(AppConfig):
     default_auto_field = "django.db.models.BigAutoField"
     name = "chat"
+
+    def ready(self):
+        from django.db.backends.signals import connection_created
+        from django.db.models.signals import post_migrate
+
+        from . import checks, signals  # noqa: F401
+        from .database import configure_sqlite
+        from .metrics import install_query_recorder
+        post_migrate.connect(signals.ensure_search_index, sender=self)
+        connection_created.connect(configure_sqlite)
+        connection_created.connect(install_query_recorder)
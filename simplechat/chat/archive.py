@@ -0,0 +1,75 @@
+from django.db import router, transaction
+from django.db.models import Max
+
+from . import caching
+from .models import ArchivedMessage, Message, Thread, UnreadCounter
+
+HORIZON_KEY = 'chat:archive:horizon'
+ARCHIVED_FIELDS = ('id', 'thread_id', 'sender_id', 'text', 'created', 'is_read')
+
+_missing = object()
+
+
+def user_thread_ids(user):
+    """Ids of the user's threads, for filtering archive rows that may live in another database."""
+    return list(Thread.objects.filter(participants=user).values_list('id', flat=True))
+
+
+def archive_horizon():
+    """Return the newest ``created`` in the archive, or None when it is empty.
+
+    Every archived message was created at or before the horizon, so readers
+    only need to look at the archive once they reach it. The value is cached
+    and advanced by ``archive_messages`` after each batch.
+    """
+    cache = caching.get_cache()
+    horizon = cache.get(HORIZON_KEY, _missing)
+    if horizon is _missing:
+        horizon = refresh_horizon()
+    return horizon
+
+
+def refresh_horizon():
+    """Recompute the horizon; ``MAX(created)`` is read from the end of its index."""
+    horizon = ArchivedMessage.objects.aggregate(newest=Max('created'))['newest']
+    caching.get_cache().set(HORIZON_KEY, horizon, timeout=None)
+    return horizon
+
+
+def advance_horizon(created):
+    """Move the cached horizon up to ``created`` without querying the archive."""
+    horizon = archive_horizon()
+    if horizon is None or created > horizon:
+        caching.get_cache().set(HORIZON_KEY, created, timeout=None)
+
+
+def archive_batches(cutoff, batch_size=1000):
+    """Move messages created before ``cutoff`` to the archive, oldest first.
+
+    Yields the number of messages moved by each batch. A batch is copied and
+    then deleted inside transactions on both databases, and the copy ignores
+    rows already archived, so an interrupted run can simply be repeated. The
+    newest message of a thread stays hot so the inbox can still show it;
+    archived unread messages no longer count as unread.
+    """
+    keep = Thread.objects.filter(last_message__isnull=False).values('last_message_id')
+    candidates = Message.objects.filter(created__lt=cutoff).exclude(pk__in=keep).order_by('created', 'id')
+    archive_db = router.db_for_write(ArchivedMessage)
+    while True:
+        with transaction.atomic(using=archive_db), transaction.atomic(using=router.db_for_write(Message)):
+            rows = list(candidates.values(*ARCHIVED_FIELDS)[:batch_size])
+            if not rows:
+                return
+            ArchivedMessage.objects.bulk_create(
+                [ArchivedMessage(**row) for row in rows], batch_size=500, ignore_conflicts=True
+            )
+            Message.objects.filter(pk__in=[row['id'] for row in rows]).delete()
+
+            unread_threads = {row['thread_id'] for row in rows if not row['is_read']}
+            if unread_threads:
+                UnreadCounter.objects.rebuild(thread_ids=unread_threads)
+            caching.invalidate_threads({row['thread_id'] for row in rows})
+        # Batches are taken oldest first, so the last row is the batch's newest.
+        advance_horizon(rows[-1]['created'])
+        yield len(rows)
+
@@ -0,0 +1,248 @@
+import asyncio
+import base64
+import binascii
+import json
+import math
+import time
+
+from asgiref.sync import sync_to_async
+from django.db import connection
+from django.http import JsonResponse, StreamingHttpResponse
+from django.views import View
+from rest_framework import exceptions
+from rest_framework.request import Request
+
+from .authentication import CachedJWTAuthentication
+from .broker import get_broker
+from .models import Message, UnreadCounter
+from .pagination import KeysetPagination
+from .routers import choose_replica, reading_from
+from .serializers import InboxRowSerializer, MessageRowSerializer, MessageSerializer, ThreadRowSerializer
+from .throttling import TokenBucketThrottle
+from .views import archived_message_queryset, message_queryset, thread_queryset
+
+
+def encode_since(message_id):
+    return base64.urlsafe_b64encode(str(message_id).encode('ascii')).decode('ascii')
+
+
+def decode_since(cursor):
+    try:
+        return int(base64.urlsafe_b64decode(cursor.encode('ascii')))
+    except (ValueError, binascii.Error):
+        return None
+
+
+def release_connection():
+    """Give the DB connection back while a request idles on the broker."""
+    if not connection.in_atomic_block:
+        connection.close()
+
+
+class AsyncAPIView(View):
+    """Base for async views that authenticate and throttle like the DRF API."""
+
+    authentication = CachedJWTAuthentication()
+    throttle_scope = 'read'
+
+    async def dispatch(self, request, *args, **kwargs):
+        try:
+            result, wait = await sync_to_async(self.authenticate)(request)
+        except exceptions.AuthenticationFailed as exc:
+            return self.unauthorized(request, exc.detail)
+        if result is None:
+            return self.unauthorized(request, 'Authentication credentials were not provided.')
+        if wait is not None:
+            return self.throttled(wait)
+        request.user, request.auth = result
+        return await super().dispatch(request, *args, **kwargs)
+
+    def authenticate(self, request):
+        """Return ``((user, token), seconds to wait or None)`` in one thread hop."""
+        result = self.authentication.authenticate(request)
+        if result is None:
+            return None, None
+        return result, TokenBucketThrottle.check(f'user:{result[0].pk}', self.throttle_scope)
+
+    def throttled(self, wait):
+        response = JsonResponse({'detail': exceptions.Throttled(wait).detail}, status=429)
+        response['Retry-After'] = '%d' % math.ceil(wait)
+        return response
+
+    def unauthorized(self, request, detail):
+        response = JsonResponse({'detail': detail}, status=401)
+        response['WWW-Authenticate'] = self.authentication.authenticate_header(request)
+        return response
+
+
+class AsyncListView(AsyncAPIView):
+    """Keyset-paginated listing evaluated with the async queryset API."""
+
+    serializer_class = None
+    keyset_ordering = None
+
+    def get_queryset(self):
+        raise NotImplementedError
+
+    async def get(self, request):
+        try:
+            return await self.list(request)
+        except exceptions.APIException as exc:
+            # Such as NotFound for a bad cursor, answered as DRF's handler would.
+            detail = exc.detail if isinstance(exc.detail, (dict, list)) else {'detail': exc.detail}
+            return JsonResponse(detail, status=exc.status_code, safe=False)
+
+    async def list(self, request):
+        paginator = KeysetPagination()
+        drf_request = Request(request)
+        page = paginator.get_page_queryset(self.get_queryset(), drf_request, self)
+        with reading_from(await sync_to_async(choose_replica)(request.user.id)):
+            if paginator.offset_paginator is not None:
+                # LimitOffsetPagination needs a COUNT and has no async path.
+                def load_page():
+                    return paginator.offset_paginator.paginate_queryset(page, drf_request, self)
+            else:
+                rows = [obj async for obj in page]
+
+                def load_page():
+                    return paginator.set_page(paginator.add_archived(rows, self))
+
+            # Row serializers may query related tables, so they run in the same thread hop.
+            def serialize():
+                return self.serializer_class(load_page(), many=True, context={'request': drf_request}).data
+
+            data = await sync_to_async(serialize)()
+        return JsonResponse(paginator.get_paginated_data(data), json_dumps_params={'ensure_ascii': False})
+
+
+class AsyncThreadListView(AsyncListView):
+    """Async variant of ``GET /chat/threads/``, including ``?view=inbox``."""
+
+    def setup(self, request, *args, **kwargs):
+        super().setup(request, *args, **kwargs)
+        self.inbox = request.GET.get('view') == 'inbox'
+        self.serializer_class = InboxRowSerializer if self.inbox else ThreadRowSerializer
+        self.keyset_ordering = ('-updated', '-id') if self.inbox else None
+
+    def get_queryset(self):
+        return self.serializer_class.rows(thread_queryset(self.request.user, inbox=self.inbox))
+
+
+class AsyncMessageListView(AsyncListView):
+    """Async variant of ``GET /chat/messages/``."""
+
+    serializer_class = MessageRowSerializer
+
+    def get_queryset(self):
+        return MessageRowSerializer.rows(message_queryset(self.request.user, self.request.GET.get('thread')))
+
+    def get_archive_queryset(self):
+        return MessageRowSerializer.rows(archived_message_queryset(self.request.user, self.request.GET.get('thread')))
+
+
+class AsyncUnreadCountView(AsyncAPIView):
+    """Async variant of ``GET /chat/messages/unread/``."""
+
+    throttle_scope = 'unread'
+
+    async def get(self, request):
+        with reading_from(await sync_to_async(choose_replica)(request.user.id)):
+            return JsonResponse({'unread_count': await UnreadCounter.objects.atotal_for(request.user)})
+
+
+class MessageStreamView(AsyncAPIView):
+    """Long-poll (or Server-Sent Events) feed of new messages in the user's threads.
+
+    ``GET ?since=<cursor>`` answers at once if newer messages exist, otherwise
+    waits on the event broker for up to ``timeout`` seconds. While waiting the
+    request holds neither a worker thread nor a database connection. The
+    response carries ``next``, the cursor for the following call. Without
+    ``since`` the current position is returned immediately.
+
+    With ``Accept: text/event-stream`` batches are streamed as SSE events until
+    ``max_stream_seconds`` elapse; the client resumes with ``Last-Event-ID``.
+    """
+
+    batch_size = 100
+    default_timeout = 25
+    max_timeout = 60
+    max_stream_seconds = 300
+
+    async def get(self, request):
+        since = request.headers.get('Last-Event-ID') or request.GET.get('since')
+        if since is not None:
+            since = decode_since(since)
+            if since is None:
+                return JsonResponse({'detail': 'Invalid cursor'}, status=404)
+        try:
+            timeout = float(request.GET.get('timeout', self.default_timeout))
+        except ValueError:
+            timeout = self.default_timeout
+        # NaN passes min/max unchanged and would make the wait endless.
+        timeout = min(max(timeout, 0), self.max_timeout) if math.isfinite(timeout) else self.default_timeout
+
+        if since is None:
+            since = await sync_to_async(self.latest_id)(request.user)
+
+        if 'text/event-stream' in request.headers.get('Accept', ''):
+            response = StreamingHttpResponse(
+                self.event_stream(request.user, since, timeout), content_type='text/event-stream'
+            )
+            response['Cache-Control'] = 'no-cache'
+            response['X-Accel-Buffering'] = 'no'
+            return response
+
+        results, since = await self.wait_for_messages(request.user, since, timeout)
+        return JsonResponse({'results': results, 'next': encode_since(since)})
+
+    async def event_stream(self, user, since, timeout):
+        deadline = time.monotonic() + self.max_stream_seconds
+        while True:
+            wait = min(timeout or self.default_timeout, max(deadline - time.monotonic(), 0))
+            results, since = await self.wait_for_messages(user, since, wait)
+            if results:
+                payload = json.dumps(results)
+                yield f'id: {encode_since(since)}\nevent: messages\ndata: {payload}\n\n'
+            else:
+                # Keeps proxies from closing an idle connection.
+                yield ': keep-alive\n\n'
+            if time.monotonic() >= deadline:
+                return
+
+    async def wait_for_messages(self, user, since, timeout):
+        """Return ``(messages, next_since)`` once messages arrive or ``timeout`` passes."""
+        # Subscribe before reading so nothing committed in between is missed.
+        subscription = get_broker().subscribe(user.id)
+        try:
+            results = await sync_to_async(self.fetch)(user, since)
+            if results or not timeout:
+                return results, results[-1]['id'] if results else since
+
+            loop = asyncio.get_running_loop()
+            deadline = loop.time() + timeout
+            while not results:
+                remaining = deadline - loop.time()
+                if remaining <= 0:
+                    break
+                event = await subscription.get(timeout=remaining)
+                if event is None:
+                    break
+                # The event carries the serialized message, so no query is needed.
+                for event in [event, *subscription.drain()]:
+                    if event['type'] == 'message.created' and event['message']['id'] > since:
+                        results.append(event['message'])
+        finally:
+            subscription.close()
+        results.sort(key=lambda message: message['id'])
+        return results, results[-1]['id'] if results else since
+
+    def fetch(self, user, since):
+        messages = Message.objects.filter(thread__participants=user, id__gt=since).order_by('id')
+        results = MessageSerializer(messages[:self.batch_size], many=True).data
+        release_connection()
+        return list(results)
+
+    def latest_id(self, user):
+        latest = Message.objects.filter(thread__participants=user).order_by('-id').values_list('id', flat=True).first()
+        release_connection()
+        return latest or 0
@@ -0,0 +1,100 @@
+import hashlib
+import uuid
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import connection, transaction
+from django.utils.cache import patch_vary_headers
+from rest_framework import status
+from rest_framework.response import Response
+
+from .models import Thread
+
+
+def get_cache():
+    return caches[settings.CHAT_PAGE_CACHE]
+
+
+def generation_key(user_id):
+    return f'chat:generation:{user_id}'
+
+
+def get_generation(user_id):
+    """Return the token that changes whenever data visible to the user changes."""
+    return get_cache().get_or_set(generation_key(user_id), lambda: uuid.uuid4().hex, timeout=None)
+
+
+def invalidate_users(user_ids):
+    """Start a new generation for the users, orphaning their cached pages."""
+    user_ids = set(user_ids)
+    if not user_ids:
+        return
+
+    def bump():
+        get_cache().set_many({generation_key(user_id): uuid.uuid4().hex for user_id in user_ids}, timeout=None)
+
+    bump()
+    if connection.in_atomic_block:
+        # Bump again once committed so a page cached from a concurrent read
+        # of the pre-commit state is not served afterwards.
+        transaction.on_commit(bump)
+
+
+def invalidate_thread(thread):
+    """Invalidate a thread's participants, using its pair key when it has one."""
+    if thread.user_low_id and thread.user_high_id:
+        invalidate_users([thread.user_low_id, thread.user_high_id])
+    else:
+        invalidate_threads([thread.pk])
+
+
+def invalidate_threads(thread_ids):
+    """Invalidate every participant of the given threads."""
+    participants = Thread.participants.through.objects.filter(thread_id__in=thread_ids)
+    invalidate_users(participants.values_list('user_id', flat=True))
+
+
+class CachedListMixin:
+    """Serve ``list`` from a per-user page cache with ETag revalidation.
+
+    Pages are keyed by user, generation and full URL (so each cursor is its
+    own entry). The ETag is derived from the same values and the response
+    format, so a matching ``If-None-Match`` is answered with 304 without
+    touching the database.
+
+    Pages read from a replica may predate the current generation, so they
+    get no ETag and are cached per alias for at most the replica lag window
+    (``CHAT_REPLICA_STICKY_SECONDS``).
+    """
+
+    def get_read_alias(self):
+        """The database alias this request reads from; None for the primary."""
+        return None
+
+    def list(self, request, *args, **kwargs):
+        url = request.build_absolute_uri()
+        alias = self.get_read_alias()
+        source = url if alias is None else f'{alias}:{url}'
+        digest = hashlib.md5(f'{get_generation(request.user.id)}:{source}'.encode()).hexdigest()
+        if alias is None:
+            etag = f'"{digest}-{request.accepted_renderer.format}"'
+            headers = {'ETag': etag, 'Cache-Control': 'private, no-cache'}
+            timeout = settings.CHAT_PAGE_CACHE_TTL
+            if etag in request.headers.get('If-None-Match', ''):
+                return Response(status=status.HTTP_304_NOT_MODIFIED, headers=headers)
+        else:
+            headers = {'Cache-Control': 'private, no-cache'}
+            timeout = min(settings.CHAT_PAGE_CACHE_TTL, settings.CHAT_REPLICA_STICKY_SECONDS)
+
+        cache = get_cache()
+        key = f'chat:page:{request.user.id}:{digest}'
+        data = cache.get(key)
+        if data is None:
+            response = super().list(request, *args, **kwargs)
+            cache.set(key, response.data, timeout)
+        else:
+            response = Response(data)
+        for name, value in headers.items():
+            response[name] = value
+        patch_vary_headers(response, ['Accept'])
+        return response
@@ -0,0 +1,26 @@
+from django.conf import settings
+from django.core.checks import Error, register
+from django.utils.module_loading import import_string
+
+from .broker import InProcessBroker
+
+
+@register()
+def check_task_broker(app_configs, **kwargs):
+    """Queue mode publishes from the worker process, which in-process sockets never hear."""
+    if settings.CHAT_TASKS_MODE != 'queue':
+        return []
+    try:
+        broker_class = import_string(settings.CHAT_BROKER)
+    except ImportError as exc:
+        return [Error(f"CHAT_BROKER cannot be imported: {exc}", id='chat.E002')]
+    if isinstance(broker_class, type) and issubclass(broker_class, InProcessBroker):
+        return [Error(
+            "CHAT_TASKS_MODE='queue' needs a CHAT_BROKER shared between processes.",
+            hint="chat_worker publishes the events, and the in-process broker only reaches "
+                 "sockets of the process that publishes. Use TASKS_MODE=inline, or point "
+                 "CHAT_BROKER at a BaseBroker backed by a shared pub/sub service.",
+            obj=settings.CHAT_BROKER,
+            id='chat.E001',
+        )]
+    return []
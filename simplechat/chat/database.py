@@ -0,0 +1,32 @@
+import re
+
+from django.conf import settings
+
+PRAGMA_VALUE = re.compile(r'^[\w-]+$')
+TRANSACTION_MODES = ('DEFERRED', 'IMMEDIATE', 'EXCLUSIVE')
+
+
+def configure_sqlite(sender, connection, **kwargs):
+    """Connected to connection_created: apply the SQLite profile from settings.
+
+    Runs ``CHAT_SQLITE_PRAGMAS`` and makes atomic blocks open with
+    ``BEGIN <CHAT_SQLITE_TRANSACTION_MODE>``. With IMMEDIATE a writer takes
+    the write lock up front and waits for it under busy_timeout; a deferred
+    transaction that has to upgrade its lock fails at once with "database is
+    locked" when another connection wrote in between.
+    """
+    if connection.vendor != 'sqlite':
+        return
+    with connection.cursor() as cursor:
+        for name, value in getattr(settings, 'CHAT_SQLITE_PRAGMAS', {}).items():
+            if not PRAGMA_VALUE.match(name) or not PRAGMA_VALUE.match(str(value)):
+                raise ValueError(f"Invalid SQLite pragma {name}={value!r}.")
+            cursor.execute(f'PRAGMA {name} = {value}')
+
+    mode = getattr(settings, 'CHAT_SQLITE_TRANSACTION_MODE', 'DEFERRED').upper()
+    if mode not in TRANSACTION_MODES:
+        raise ValueError(f"Invalid SQLite transaction mode {mode!r}.")
+    if mode != 'DEFERRED':
+        def start_transaction():
+            connection.cursor().execute(f'BEGIN {mode}')
+        connection._start_transaction_under_autocommit = start_transaction
@@ -0,0 +1,81 @@
+from . import tasks
+from .broker import get_broker
+from .models import Membership, Message, Thread, UnreadCounter
+from .serializers import MessageSerializer
+
+
+def _participant_ids(thread_ids):
+    participants = {}
+    rows = Membership.objects.filter(thread_id__in=thread_ids).values_list('thread_id', 'user_id')
+    for thread_id, user_id in rows:
+        participants.setdefault(thread_id, []).append(user_id)
+    return participants
+
+
+def _group_ids(thread_ids):
+    return set(Thread.objects.filter(pk__in=thread_ids, is_group=True).values_list('pk', flat=True))
+
+
+def _publish_unread(broker, user_ids):
+    for user_id, total in UnreadCounter.objects.totals(user_ids).items():
+        broker.publish([user_id], {'type': 'unread.changed', 'unread_count': total})
+
+
+def messages_created(messages):
+    """Push new messages and the recipients' unread totals once committed."""
+    if messages:
+        tasks.dispatch(
+            'message.created',
+            {'message_ids': [message.pk for message in messages]},
+            key=f'message.created:{messages[0].pk}',
+        )
+
+
+def messages_read(thread_id, message_ids=None, up_to_id=None, reader_id=None):
+    """Push a read receipt for a thread and the participants' unread totals."""
+    tasks.dispatch('thread.read', {
+        'thread': thread_id,
+        'reader': reader_id,
+        'message_ids': message_ids,
+        'up_to_id': up_to_id,
+    })
+
+
+@tasks.handler('message.created')
+def publish_messages_created(payloads):
+    """Push each message to its thread's members, and new unread totals in direct threads.
+
+    Group members get no ``unread.changed`` per message; their clients count
+    the ``message.created`` events, which keeps a send O(1) in queries.
+    """
+    broker = get_broker()
+    message_ids = [message_id for payload in payloads for message_id in payload['message_ids']]
+    messages = Message.objects.filter(pk__in=message_ids).order_by('pk')
+    thread_ids = {message.thread_id for message in messages}
+    participants = _participant_ids(thread_ids)
+    groups = _group_ids(thread_ids)
+    recipients = set()
+    for message in messages:
+        user_ids = participants.get(message.thread_id, [])
+        broker.publish(user_ids, {'type': 'message.created', 'message': MessageSerializer(message).data})
+        if message.thread_id not in groups:
+            recipients.update(user_id for user_id in user_ids if user_id != message.sender_id)
+    _publish_unread(broker, recipients)
+
+
+@tasks.handler('thread.read')
+def publish_thread_read(payloads):
+    """Push read receipts; in groups only the reader's unread total changes."""
+    broker = get_broker()
+    thread_ids = {payload['thread'] for payload in payloads}
+    participants = _participant_ids(thread_ids)
+    groups = _group_ids(thread_ids)
+    readers = set()
+    for payload in payloads:
+        user_ids = participants.get(payload['thread'], [])
+        broker.publish(user_ids, {'type': 'message.read', **payload})
+        if payload['thread'] in groups:
+            readers.add(payload['reader'])
+        else:
+            readers.update(user_ids)
+    _publish_unread(broker, readers)
@@ -0,0 +1,118 @@
+import base64
+import binascii
+import heapq
+import json
+import zlib
+from operator import itemgetter
+
+from asgiref.sync import sync_to_async
+from django.db.models import Q
+from django.utils.dateparse import parse_datetime
+
+from .archive import archive_horizon
+from .models import ArchivedMessage, Message
+
+EXPORT_ORDERING = ('thread_id', 'created', 'id')
+EXPORT_FIELDS = ('id', 'thread_id', 'sender_id', 'text', 'created', 'is_read')
+
+
+def format_datetime(value):
+    value = value.isoformat()
+    return value[:-6] + 'Z' if value.endswith('+00:00') else value
+
+
+def encode_cursor(row):
+    payload = json.dumps([row['thread_id'], row['created'].isoformat(), row['id']], separators=(',', ':'))
+    return base64.urlsafe_b64encode(payload.encode('ascii')).decode('ascii')
+
+
+def decode_cursor(cursor):
+    """Return the ``(thread_id, created, id)`` position of a cursor; raise ValueError if invalid."""
+    try:
+        thread_id, created, message_id = json.loads(base64.urlsafe_b64decode(cursor.encode('ascii')))
+        created = parse_datetime(created)
+    except (TypeError, ValueError, binascii.Error) as exc:
+        raise ValueError('Invalid cursor') from exc
+    if created is None or not isinstance(thread_id, int) or not isinstance(message_id, int):
+        raise ValueError('Invalid cursor')
+    return thread_id, created, message_id
+
+
+def export_lines(thread_ids=None, after=None, chunk_size=2000):
+    """Yield one JSON document per message, in thread then creation order.
+
+    Rows are streamed with server-side iterators over the
+    ``(thread, created, id)`` indexes of the hot and archive tables and
+    merged, so memory use does not grow with the export. Every line carries
+    a ``cursor``; pass the last one received as ``after`` to resume.
+    """
+    models = [Message] if archive_horizon() is None else [Message, ArchivedMessage]
+    sources = []
+    for model in models:
+        queryset = model.objects.order_by(*EXPORT_ORDERING)
+        if thread_ids is not None:
+            queryset = queryset.filter(thread_id__in=thread_ids)
+        if after is not None:
+            thread_id, created, message_id = after
+            queryset = queryset.filter(
+                Q(thread_id__gte=thread_id),
+                Q(thread_id__gt=thread_id)
+                | Q(thread_id=thread_id, created__gt=created)
+                | Q(thread_id=thread_id, created=created, id__gt=message_id),
+            )
+        sources.append(queryset.values(*EXPORT_FIELDS).iterator(chunk_size=chunk_size))
+
+    for row in heapq.merge(*sources, key=itemgetter(*EXPORT_ORDERING)):
+        yield json.dumps({
+            'id': row['id'],
+            'thread': row['thread_id'],
+            'sender': row['sender_id'],
+            'text': row['text'],
+            'created': format_datetime(row['created']),
+            'is_read': row['is_read'],
+            'cursor': encode_cursor(row),
+        }, ensure_ascii=False) + '\n'
+
+
+def encode_lines(lines, compress=False, buffer_size=64 * 1024):
+    """Join lines into byte chunks of about ``buffer_size``, gzip-compressed if asked."""
+    compressor = zlib.compressobj(wbits=31) if compress else None
+    buffer, size = [], 0
+    for line in lines:
+        data = line.encode('utf-8')
+        buffer.append(data)
+        size += len(data)
+        if size >= buffer_size:
+            chunk = b''.join(buffer)
+            buffer, size = [], 0
+            if compressor is not None:
+                chunk = compressor.compress(chunk)
+            if chunk:
+                yield chunk
+    chunk = b''.join(buffer)
+    if compressor is not None:
+        chunk = compressor.compress(chunk) + compressor.flush()
+    if chunk:
+        yield chunk
+
+
+async def aiterate(iterable):
+    """Consume a sync iterator one item per thread hop.
+
+    Under ASGI, Django buffers a sync streaming body whole before sending
+    it; this keeps an export streaming. The steps are thread-sensitive, so
+    the server-side cursors stay on the connection that opened them.
+    """
+    iterator = iter(iterable)
+    step = sync_to_async(next)
+    done = object()
+    try:
+        while True:
+            item = await step(iterator, done)
+            if item is done:
+                return
+            yield item
+    finally:
+        close = getattr(iterator, 'close', None)
+        if close is not None:
+            await sync_to_async(close)()
@@ -0,0 +1,195 @@
+import csv
+import json
+from collections import Counter
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.exceptions import FieldDoesNotExist, ValidationError
+from django.core.management.color import no_style
+from django.db import connection
+from django.db.models import Count, F, OuterRef, Subquery
+from django.db.models.functions import Coalesce, Greatest
+from django.utils import timezone
+
+from . import caching
+from .models import Membership, Message, Thread, UnreadCounter
+
+User = get_user_model()
+
+# CSV dumps carry one model per file, named after the file.
+CSV_MODELS = {
+    'users': 'auth.user', 'threads': 'chat.thread', 'memberships': 'chat.membership', 'messages': 'chat.message',
+}
+
+
+def read_jsonl(stream):
+    """Yield ``(model, pk, fields)`` from ``dumpdata --format jsonl`` style lines."""
+    for number, line in enumerate(stream, 1):
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            item = json.loads(line)
+            yield item['model'], item.get('pk'), item.get('fields', {})
+        except (ValueError, KeyError, TypeError) as exc:
+            raise ValueError(f"line {number}: {exc}") from exc
+
+
+def read_json(stream):
+    """Yield the objects of a regular (non-streaming) JSON fixture."""
+    for item in json.load(stream):
+        yield item['model'], item.get('pk'), item.get('fields', {})
+
+
+def read_csv(stream, model):
+    """Yield rows of a CSV file with a header; ``participants`` are space-separated ids."""
+    for row in csv.DictReader(stream):
+        pk = row.pop('id', None) or row.pop('pk', None)
+        fields = {name: value for name, value in row.items() if value != ''}
+        if 'participants' in fields:
+            fields['participants'] = fields['participants'].split()
+        yield model, pk, fields
+
+
+@contextmanager
+def keep_timestamps(*models):
+    """Let bulk_create write the dumped ``auto_now``/``auto_now_add`` values.
+
+    The flags live on the shared field instances, so this is only meant for
+    single-purpose processes such as management commands.
+    """
+    fields = [
+        field for model in models for field in model._meta.concrete_fields
+        if getattr(field, 'auto_now', False) or getattr(field, 'auto_now_add', False)
+    ]
+    flags = [(field, field.auto_now, field.auto_now_add) for field in fields]
+    for field in fields:
+        field.auto_now = field.auto_now_add = False
+    try:
+        yield
+    finally:
+        for field, auto_now, auto_now_add in flags:
+            field.auto_now, field.auto_now_add = auto_now, auto_now_add
+
+
+class ChatImporter:
+    """Bulk loader for users, threads, memberships and messages.
+
+    Rows are buffered per model and written with ``bulk_create``; thread
+    participants go straight into the membership table, as do the
+    ``chat.membership`` rows of a dump. Nothing is validated or derived per
+    row: finish() checks the participant count of every imported direct
+    thread in one query, then fills in last messages and unread counters.
+    Call it inside a transaction so a failed check rolls the import back.
+    """
+
+    def __init__(self, batch_size=5000):
+        self.batch_size = batch_size
+        self.models = {
+            settings.AUTH_USER_MODEL.lower(): User,
+            'chat.thread': Thread,
+            'chat.membership': Membership,
+            'chat.message': Message,
+        }
+        self.buffers = {model: [] for model in (User, Thread, Membership, Message)}
+        self.counts = Counter()
+        self.user_ids = set()
+        self.thread_ids = set()
+        self.touched_thread_ids = set()
+
+    def add(self, label, pk, fields):
+        model = self.models.get(label.lower())
+        if model is None:
+            raise ValueError(f"Unsupported model {label!r}.")
+        try:
+            obj = model(pk=model._meta.pk.to_python(pk))
+            participants = []
+            for name, value in fields.items():
+                field = model._meta.get_field(name)
+                if field.many_to_many:
+                    # User groups and permissions are not part of chat dumps.
+                    if name == 'participants':
+                        participants = [User._meta.pk.to_python(user_id) for user_id in value]
+                    continue
+                setattr(obj, field.attname, field.to_python(value))
+        except (FieldDoesNotExist, ValidationError) as exc:
+            raise ValueError(f"{label} {pk}: {exc}") from exc
+
+        for field in model._meta.concrete_fields:
+            if (getattr(field, 'auto_now', False) or getattr(field, 'auto_now_add', False)) \
+                    and getattr(obj, field.attname) is None:
+                setattr(obj, field.attname, timezone.now())
+
+        if model not in (Membership, Message) and obj.pk is None:
+            raise ValueError(f"{label} objects need a pk so other rows can refer to them.")
+        if model is User:
+            self.user_ids.add(obj.pk)
+        elif model is Thread:
+            participants = sorted(set(participants))
+            if len(participants) == 2 and not obj.is_group:
+                obj.user_low_id, obj.user_high_id = participants
+            self.thread_ids.add(obj.pk)
+            self.touched_thread_ids.add(obj.pk)
+            for user_id in participants:
+                self.buffer(Membership, Membership(thread_id=obj.pk, user_id=user_id))
+        elif model is Membership:
+            self.touched_thread_ids.add(obj.thread_id)
+        else:
+            self.touched_thread_ids.add(obj.thread_id)
+        self.buffer(model, obj)
+        self.counts[model._meta.model_name] += 1
+
+    def buffer(self, model, obj):
+        rows = self.buffers[model]
+        rows.append(obj)
+        if len(rows) >= self.batch_size:
+            self.flush(model)
+
+    def flush(self, model):
+        rows = self.buffers[model]
+        if rows:
+            with keep_timestamps(model):
+                model.objects.bulk_create(rows, batch_size=self.batch_size)
+            rows.clear()
+
+    def reset_sequences(self):
+        """Move the pk sequences past the imported ids, as loaddata does (a no-op on SQLite)."""
+        models = [model for model in self.buffers if self.counts[model._meta.model_name]]
+        statements = connection.ops.sequence_reset_sql(no_style(), models)
+        if statements:
+            with connection.cursor() as cursor:
+                for sql in statements:
+                    cursor.execute(sql)
+
+    def finish(self):
+        """Write what is buffered, run the deferred checks and derive thread state."""
+        for model in self.buffers:
+            self.flush(model)
+        self.reset_sequences()
+        if not self.touched_thread_ids:
+            return
+
+        if self.thread_ids:
+            invalid = (
+                Thread.objects.filter(pk__range=(min(self.thread_ids), max(self.thread_ids)), is_group=False)
+                .annotate(participant_count=Count('participants'))
+                .exclude(participant_count=2)
+                .values_list('pk', flat=True)
+            )
+            invalid = sorted(set(invalid) & self.thread_ids)
+            if invalid:
+                listed = ', '.join(map(str, invalid[:10]))
+                raise ValueError(f"{len(invalid)} direct thread(s) do not have exactly 2 participants: {listed}")
+
+        latest = Message.objects.filter(thread=OuterRef('pk')).order_by('-created', '-id')
+        thread_ids = sorted(self.touched_thread_ids)
+        for start in range(0, len(thread_ids), self.batch_size):
+            batch = thread_ids[start:start + self.batch_size]
+            Thread.objects.filter(pk__in=batch).update(
+                last_message=Subquery(latest.values('pk')[:1]),
+                updated=Greatest(F('updated'), Coalesce(Subquery(latest.values('created')[:1]), F('updated'))),
+            )
+            UnreadCounter.objects.rebuild(thread_ids=batch)
+            caching.invalidate_threads(batch)
+        caching.invalidate_users(self.user_ids)
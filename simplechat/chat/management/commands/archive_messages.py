@@ -0,0 +1,40 @@
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from chat.archive import archive_batches
+
+
+class Command(BaseCommand):
+    help = (
+        "Move messages older than CHAT_ARCHIVE_AFTER_DAYS from the hot message table "
+        "to the archive, in batches. Safe to interrupt and rerun."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--days', type=int, default=settings.CHAT_ARCHIVE_AFTER_DAYS,
+            help=f"Archive messages older than this many days (default: {settings.CHAT_ARCHIVE_AFTER_DAYS}).",
+        )
+        parser.add_argument(
+            '--batch-size', type=int, default=1000,
+            help="Number of messages moved per transaction (default: 1000).",
+        )
+        parser.add_argument(
+            '--pause', type=float, default=0,
+            help="Seconds to sleep between batches, to leave room for live traffic (default: 0).",
+        )
+
+    def handle(self, *args, **options):
+        cutoff = timezone.now() - timedelta(days=options['days'])
+        moved = 0
+        for count in archive_batches(cutoff, batch_size=options['batch_size']):
+            moved += count
+            if options['verbosity'] > 1:
+                self.stdout.write(f"Archived {moved} message(s)...")
+            if options['pause']:
+                time.sleep(options['pause'])
+        self.stdout.write(self.style.SUCCESS(f"Archived {moved} message(s) created before {cutoff:%Y-%m-%d %H:%M}."))
@@ -0,0 +1,93 @@
+import multiprocessing
+import signal
+import time
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections, connections
+
+from chat.tasks import prune, run_batch
+
+
+def work(batch_size, poll_interval, once, prune_after):
+    """Run batches until stopped; with ``once``, until no task is due."""
+    stopping = False
+
+    def stop(signum, frame):
+        nonlocal stopping
+        stopping = True
+
+    signal.signal(signal.SIGTERM, stop)
+    processed = 0
+    last_prune = time.monotonic()
+    while not stopping:
+        close_old_connections()
+        claimed = run_batch(batch_size)
+        processed += claimed
+        if prune_after and time.monotonic() - last_prune > 60:
+            prune(timedelta(seconds=prune_after))
+            last_prune = time.monotonic()
+        if not claimed:
+            if once:
+                break
+            time.sleep(poll_interval)
+    return processed
+
+
+def child(*args):
+    import django
+    django.setup()
+    signal.signal(signal.SIGINT, signal.SIG_IGN)  # the parent handles Ctrl-C
+    work(*args)
+
+
+class Command(BaseCommand):
+    help = "Run queued chat tasks (CHAT_TASKS_MODE = 'queue') in a pool of worker processes."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--processes', type=int, default=1,
+            help="Number of worker processes (default: 1, run in this process).",
+        )
+        parser.add_argument(
+            '--batch-size', type=int, default=100,
+            help="Number of tasks claimed at a time (default: 100).",
+        )
+        parser.add_argument(
+            '--poll-interval', type=float, default=1.0,
+            help="Seconds to wait when no task is due (default: 1).",
+        )
+        parser.add_argument(
+            '--once', action='store_true',
+            help="Exit once no task is due instead of polling.",
+        )
+        parser.add_argument(
+            '--prune-after', type=int, default=86400,
+            help="Delete finished tasks older than this many seconds; 0 keeps them (default: 86400).",
+        )
+
+    def handle(self, *args, **options):
+        work_args = (options['batch_size'], options['poll_interval'], options['once'], options['prune_after'])
+        if options['processes'] <= 1:
+            processed = work(*work_args)
+            self.stdout.write(f"Processed {processed} task(s).")
+            return
+
+        # Children open their own connections.
+        connections.close_all()
+        workers = [
+            multiprocessing.Process(target=child, args=work_args, daemon=True)
+            for _ in range(options['processes'])
+        ]
+        for worker in workers:
+            worker.start()
+        # Workers stop after their current batch on SIGTERM.
+        signal.signal(signal.SIGTERM, lambda signum, frame: [worker.terminate() for worker in workers])
+        try:
+            for worker in workers:
+                worker.join()
+        except KeyboardInterrupt:
+            for worker in workers:
+                worker.terminate()
+            for worker in workers:
+                worker.join()
@@ -0,0 +1,62 @@
+import sys
+
+from django.core.management.base import BaseCommand, CommandError
+
+from chat.export import decode_cursor, encode_lines, export_lines
+
+
+class Command(BaseCommand):
+    help = "Stream chat messages as JSON Lines, ordered by thread and creation time."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            'threads', nargs='*', type=int,
+            help="Ids of the threads to export (default: all threads).",
+        )
+        parser.add_argument(
+            '--output', '-o', default='-',
+            help="File to write to (default: standard output).",
+        )
+        parser.add_argument(
+            '--gzip', action='store_true',
+            help="Compress the output with gzip.",
+        )
+        parser.add_argument(
+            '--after',
+            help="Resume after this cursor (the 'cursor' of the last exported line).",
+        )
+        parser.add_argument(
+            '--chunk-size', type=int, default=2000,
+            help="Number of rows fetched from the database at a time (default: 2000).",
+        )
+
+    def handle(self, *args, **options):
+        after = None
+        if options['after']:
+            try:
+                after = decode_cursor(options['after'])
+            except ValueError:
+                raise CommandError("Invalid cursor.")
+
+        lines = export_lines(options['threads'] or None, after=after, chunk_size=options['chunk_size'])
+        exported = 0
+
+        def counted():
+            nonlocal exported
+            for line in lines:
+                exported += 1
+                yield line
+
+        if options['output'] == '-' and not options['gzip']:
+            for line in counted():
+                self.stdout.write(line, ending='')
+        else:
+            chunks = encode_lines(counted(), compress=options['gzip'])
+            if options['output'] == '-':
+                sys.stdout.buffer.writelines(chunks)
+                sys.stdout.buffer.flush()
+            else:
+                with open(options['output'], 'wb') as output:
+                    output.writelines(chunks)
+
+        self.stderr.write(f"Exported {exported} message(s).")
@@ -0,0 +1,31 @@
+from django.core.management.base import BaseCommand
+
+from chat.models import Thread, UnreadCounter
+
+
+class Command(BaseCommand):
+    help = "Recompute the per-user unread counters from Message.is_read and repair drift."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size', type=int, default=1000,
+            help="Number of threads recomputed per query (default: 1000).",
+        )
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        thread_ids = Thread.objects.order_by('pk').values_list('pk', flat=True)
+
+        repaired = 0
+        batch = []
+        for thread_id in thread_ids.iterator(chunk_size=batch_size):
+            batch.append(thread_id)
+            if len(batch) == batch_size:
+                repaired += UnreadCounter.objects.rebuild(thread_ids=batch)
+                batch = []
+        if batch:
+            repaired += UnreadCounter.objects.rebuild(thread_ids=batch)
+
+        # Counters whose thread no longer exists are removed by the FK cascade,
+        # so only per-thread drift needs repairing here.
+        self.stdout.write(self.style.SUCCESS(f"Repaired {repaired} unread counter(s)."))
@@ -0,0 +1,262 @@
+import logging
+import threading
+import time
+from bisect import bisect_left
+from contextvars import ContextVar
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.http import HttpResponse
+from django.utils.crypto import constant_time_compare
+from rest_framework import serializers
+
+logger = logging.getLogger('chat.slow_requests')
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+QUERY_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100)
+# Statements kept per request for the slow-request log.
+MAX_LOGGED_QUERIES = 100
+
+# Measurements of the request being served, or None outside of one.
+_current = ContextVar('chat_request_metrics', default=None)
+
+
+def format_labels(names, values, extra=''):
+    pairs = [
+        '{}="{}"'.format(name, str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n'))
+        for name, value in zip(names, values)
+    ]
+    if extra:
+        pairs.append(extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+class Counter:
+    kind = 'counter'
+
+    def __init__(self, registry, name, help, labels):
+        self.registry, self.name, self.help, self.labels = registry, name, help, labels
+        self.series = {}
+
+    def inc(self, labels, amount=1):
+        with self.registry.lock:
+            self.series[labels] = self.series.get(labels, 0) + amount
+
+    def samples(self):
+        for labels, value in sorted(self.series.items()):
+            yield f'{self.name}{format_labels(self.labels, labels)} {value}'
+
+
+class Histogram:
+    """Observations counted into fixed buckets, exposed cumulatively as Prometheus expects."""
+
+    kind = 'histogram'
+
+    def __init__(self, registry, name, help, labels, buckets):
+        self.registry, self.name, self.help, self.labels = registry, name, help, labels
+        self.buckets = tuple(buckets)
+        # labels -> [count per bucket..., count above the last bucket, sum]
+        self.series = {}
+
+    def observe(self, labels, value):
+        index = bisect_left(self.buckets, value)
+        with self.registry.lock:
+            series = self.series.get(labels)
+            if series is None:
+                series = self.series[labels] = [0] * (len(self.buckets) + 1) + [0.0]
+            series[index] += 1
+            series[-1] += value
+
+    def samples(self):
+        for labels, series in sorted(self.series.items()):
+            total = 0
+            for bound, count in zip(self.buckets + ('+Inf',), series):
+                total += count
+                bucket = format_labels(self.labels, labels, 'le="%s"' % bound)
+                yield f'{self.name}_bucket{bucket} {total}'
+            yield f'{self.name}_sum{format_labels(self.labels, labels)} {series[-1]}'
+            yield f'{self.name}_count{format_labels(self.labels, labels)} {total}'
+
+
+class Registry:
+    """In-process metrics in the Prometheus text format.
+
+    Each worker process keeps its own values; Prometheus scrapes every
+    process (or instance) and sums them.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.metrics = []
+
+    def counter(self, name, help, labels=()):
+        metric = Counter(self, name, help, labels)
+        self.metrics.append(metric)
+        return metric
+
+    def histogram(self, name, help, labels=(), buckets=LATENCY_BUCKETS):
+        metric = Histogram(self, name, help, labels, buckets)
+        self.metrics.append(metric)
+        return metric
+
+    def render(self):
+        lines = []
+        with self.lock:
+            for metric in self.metrics:
+                lines.append(f'# HELP {metric.name} {metric.help}')
+                lines.append(f'# TYPE {metric.name} {metric.kind}')
+                lines.extend(metric.samples())
+        return '\n'.join(lines) + '\n'
+
+    def clear(self):
+        with self.lock:
+            for metric in self.metrics:
+                metric.series.clear()
+
+
+REGISTRY = Registry()
+REQUESTS = REGISTRY.counter(
+    'chat_http_requests_total', 'Requests served, by route and status.', ('method', 'route', 'status'),
+)
+REQUEST_DURATION = REGISTRY.histogram(
+    'chat_http_request_duration_seconds', 'Time to produce the response.', ('method', 'route'),
+)
+DB_QUERIES = REGISTRY.histogram(
+    'chat_db_queries_per_request', 'Database queries run by a request.', ('method', 'route'), QUERY_BUCKETS,
+)
+DB_DURATION = REGISTRY.histogram(
+    'chat_db_duration_seconds', 'Time a request spent in database queries.', ('method', 'route'),
+)
+SERIALIZER_DURATION = REGISTRY.histogram(
+    'chat_serializer_duration_seconds', 'Time a request spent serializing data.', ('method', 'route'),
+)
+
+
+class RequestMetrics:
+    __slots__ = ('queries', 'db_time', 'serializer_time', 'statements')
+
+    def __init__(self, log_statements=False):
+        self.queries = 0
+        self.db_time = 0.0
+        self.serializer_time = 0.0
+        self.statements = [] if log_statements else None
+
+
+def record_query(execute, sql, params, many, context):
+    """Database execute wrapper counting the queries of the current request."""
+    metrics = _current.get()
+    if metrics is None:
+        return execute(sql, params, many, context)
+    started = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        elapsed = time.perf_counter() - started
+        metrics.queries += 1
+        metrics.db_time += elapsed
+        if metrics.statements is not None and len(metrics.statements) < MAX_LOGGED_QUERIES:
+            metrics.statements.append((elapsed, sql))
+
+
+def install_query_recorder(sender, connection, **kwargs):
+    """Connected to connection_created; the wrapper outlives reconnects, so add it once."""
+    if record_query not in connection.execute_wrappers:
+        connection.execute_wrappers.append(record_query)
+
+
+class TimedSerializerMixin:
+    """Adds the time spent building ``.data`` to the current request's metrics."""
+
+    @property
+    def data(self):
+        metrics = _current.get()
+        if metrics is None:
+            return super().data
+        started = time.perf_counter()
+        try:
+            return super().data
+        finally:
+            metrics.serializer_time += time.perf_counter() - started
+
+
+class TimedListSerializer(TimedSerializerMixin, serializers.ListSerializer):
+    pass
+
+
+class MetricsMiddleware:
+    """Record latency, query count and time, and serializer time per route.
+
+    Routes are labelled by URL name (``message-list``, ``thread-read``...),
+    so the number of series stays bounded. With ``CHAT_SLOW_REQUEST_MS``
+    set, requests slower than that are logged to ``chat.slow_requests``
+    along with their SQL. Streaming responses are timed until the response
+    starts.
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.slow_seconds = (getattr(settings, 'CHAT_SLOW_REQUEST_MS', 0) or 0) / 1000
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        metrics = RequestMetrics(log_statements=bool(self.slow_seconds))
+        token = _current.set(metrics)
+        started = time.perf_counter()
+        try:
+            response = self.get_response(request)
+        finally:
+            _current.reset(token)
+        self.record(request, response, metrics, time.perf_counter() - started)
+        return response
+
+    async def __acall__(self, request):
+        metrics = RequestMetrics(log_statements=bool(self.slow_seconds))
+        token = _current.set(metrics)
+        started = time.perf_counter()
+        try:
+            response = await self.get_response(request)
+        finally:
+            _current.reset(token)
+        self.record(request, response, metrics, time.perf_counter() - started)
+        return response
+
+    def record(self, request, response, metrics, elapsed):
+        match = getattr(request, 'resolver_match', None)
+        route = match.view_name if match is not None and match.view_name else 'unmatched'
+        labels = (request.method, route)
+        REQUESTS.inc(labels + (str(response.status_code),))
+        REQUEST_DURATION.observe(labels, elapsed)
+        DB_QUERIES.observe(labels, metrics.queries)
+        DB_DURATION.observe(labels, metrics.db_time)
+        SERIALIZER_DURATION.observe(labels, metrics.serializer_time)
+
+        if self.slow_seconds and elapsed >= self.slow_seconds:
+            statements = '\n'.join(f'  {duration * 1000:8.1f} ms  {sql}' for duration, sql in metrics.statements)
+            logger.warning(
+                "Slow request %s %s (%s): %.0f ms, %d queries in %.0f ms, serializers %.0f ms\n%s",
+                request.method, request.get_full_path(), route, elapsed * 1000, metrics.queries,
+                metrics.db_time * 1000, metrics.serializer_time * 1000, statements,
+            )
+
+
+def metrics_view(request):
+    """Expose the metrics of this process in the Prometheus text format.
+
+    Scrapers send ``CHAT_METRICS_TOKEN`` as a bearer token. Without one,
+    only staff sessions, or anyone when ``DEBUG`` is on, may read them.
+    """
+    token = getattr(settings, 'CHAT_METRICS_TOKEN', '')
+    if token:
+        allowed = constant_time_compare(request.headers.get('Authorization', ''), f'Bearer {token}')
+    else:
+        user = getattr(request, 'user', None)
+        allowed = settings.DEBUG or (user is not None and user.is_staff)
+    if not allowed:
+        return HttpResponse('Forbidden\n', status=403, content_type='text/plain')
+    return HttpResponse(REGISTRY.render(), content_type='text/plain; version=0.0.4; charset=utf-8')
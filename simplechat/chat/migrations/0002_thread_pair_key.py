@@ -0,0 +1,58 @@
+# Generated by Django 4.2.23 on 2026-10-18 11:38
+
+from django.conf import settings
+from django.db import migrations, models, router
+import django.db.models.deletion
+
+
+def backfill_pair_keys(apps, schema_editor):
+    """Fill the canonical pair for existing two-participant threads."""
+    Thread = apps.get_model('chat', 'Thread')
+    if not router.allow_migrate_model(schema_editor.connection.alias, Thread):
+        return
+    Participants = Thread.participants.through
+
+    members = {}
+    rows = Participants.objects.order_by('thread_id', 'user_id').values_list('thread_id', 'user_id')
+    for thread_id, user_id in rows.iterator(chunk_size=2000):
+        members.setdefault(thread_id, []).append(user_id)
+
+    seen = set()
+    threads = []
+    for thread_id, user_ids in members.items():
+        if len(user_ids) != 2:
+            continue
+        pair = tuple(user_ids)
+        if pair in seen:
+            # Duplicate created before the constraint existed; the oldest
+            # thread keeps the key so the unique index can be built.
+            continue
+        seen.add(pair)
+        threads.append(Thread(pk=thread_id, user_low_id=pair[0], user_high_id=pair[1]))
+    Thread.objects.bulk_update(threads, ['user_low', 'user_high'], batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('chat', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='thread',
+            name='user_high',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.AddField(
+            model_name='thread',
+            name='user_low',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.RunPython(backfill_pair_keys, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='thread',
+            constraint=models.UniqueConstraint(fields=('user_low', 'user_high'), name='chat_thread_unique_pair'),
+        ),
+    ]
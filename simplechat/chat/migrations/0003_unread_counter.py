@@ -0,0 +1,50 @@
+# Generated by Django 4.2.23 on 2026-10-18 11:39
+
+from django.conf import settings
+from django.db import migrations, models, router
+from django.db.models import Count, F, Q
+import django.db.models.deletion
+
+
+def backfill_counters(apps, schema_editor):
+    """Create a counter for every participant from the current ``is_read`` flags."""
+    Thread = apps.get_model('chat', 'Thread')
+    if not router.allow_migrate_model(schema_editor.connection.alias, Thread):
+        return
+    UnreadCounter = apps.get_model('chat', 'UnreadCounter')
+    rows = Thread.participants.through.objects.values('user_id', 'thread_id').annotate(
+        unread=Count(
+            'thread__messages',
+            filter=Q(thread__messages__is_read=False) & ~Q(thread__messages__sender=F('user')),
+        )
+    )
+    UnreadCounter.objects.bulk_create(
+        (UnreadCounter(user_id=row['user_id'], thread_id=row['thread_id'], count=row['unread'])
+         for row in rows.iterator(chunk_size=2000)),
+        batch_size=500,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('chat', '0002_thread_pair_key'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='UnreadCounter',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('count', models.PositiveIntegerField(default=0)),
+                ('thread', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='unread_counters', to='chat.thread')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='unread_counters', to=settings.AUTH_USER_MODEL)),
+            ],
+        ),
+        migrations.AddConstraint(
+            model_name='unreadcounter',
+            constraint=models.UniqueConstraint(fields=('user', 'thread'), name='chat_unreadcounter_unique'),
+        ),
+        migrations.RunPython(backfill_counters, migrations.RunPython.noop),
+    ]
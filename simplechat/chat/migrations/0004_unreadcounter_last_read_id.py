@@ -0,0 +1,18 @@
+# Generated by Django 4.2.23 on 2026-10-18 11:40
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chat', '0003_unread_counter'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='unreadcounter',
+            name='last_read_id',
+            field=models.BigIntegerField(default=0),
+        ),
+    ]
@@ -0,0 +1,35 @@
+# Generated by Django 4.2.23 on 2026-10-18 11:42
+
+from django.db import migrations, models, router
+from django.db.models import F, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+import django.db.models.deletion
+
+
+def backfill_last_message(apps, schema_editor):
+    """Point every thread at its newest message and use it as last activity."""
+    Thread = apps.get_model('chat', 'Thread')
+    if not router.allow_migrate_model(schema_editor.connection.alias, Thread):
+        return
+    Message = apps.get_model('chat', 'Message')
+    latest = Message.objects.filter(thread=OuterRef('pk')).order_by('-created', '-id')
+    Thread.objects.update(
+        last_message=Subquery(latest.values('pk')[:1]),
+        updated=Coalesce(Subquery(latest.values('created')[:1]), F('updated')),
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chat', '0005_message_thread_created_index'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='thread',
+            name='last_message',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='chat.message'),
+        ),
+        migrations.RunPython(backfill_last_message, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,22 @@
+from django.db import migrations
+
+
+def install_index(apps, schema_editor):
+    from chat.search import install_index
+    install_index(schema_editor.connection)
+
+
+def uninstall_index(apps, schema_editor):
+    from chat.search import uninstall_index
+    uninstall_index(schema_editor.connection)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chat', '0006_thread_last_message'),
+    ]
+
+    operations = [
+        migrations.RunPython(install_index, uninstall_index),
+    ]
@@ -0,0 +1,41 @@
+# Generated by Django 4.2.23 on 2026-10-18 12:21
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def install_index(apps, schema_editor):
+    from chat.search import install_index
+    install_index(schema_editor.connection)
+
+
+def uninstall_index(apps, schema_editor):
+    from chat.search import uninstall_index
+    uninstall_index(schema_editor.connection, tables=['chat_archivedmessage'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('chat', '0007_message_search_index'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ArchivedMessage',
+            fields=[
+                ('id', models.BigIntegerField(primary_key=True, serialize=False)),
+                ('text', models.TextField()),
+                ('created', models.DateTimeField()),
+                ('is_read', models.BooleanField(default=False)),
+                ('sender', models.ForeignKey(db_constraint=False, on_delete=django.db.models.deletion.DO_NOTHING, related_name='+', to=settings.AUTH_USER_MODEL)),
+                ('thread', models.ForeignKey(db_constraint=False, on_delete=django.db.models.deletion.DO_NOTHING, related_name='+', to='chat.thread')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['thread', 'created', 'id'], name='chat_archive_thread_idx')],
+            },
+        ),
+        migrations.RunPython(install_index, uninstall_index),
+    ]
@@ -0,0 +1,80 @@
+# Generated by Django 4.2.23 on 2026-10-18 12:51
+
+from django.conf import settings
+from django.db import migrations, models, router
+from django.db.models import OuterRef, Subquery
+import django.db.models.deletion
+import django.utils.timezone
+
+
+def backfill_joined_at(apps, schema_editor):
+    """Existing participants joined when their thread was created."""
+    Membership = apps.get_model('chat', 'Membership')
+    if not router.allow_migrate_model(schema_editor.connection.alias, Membership):
+        return
+    Thread = apps.get_model('chat', 'Thread')
+    created = Thread.objects.filter(pk=OuterRef('thread_id')).values('created')[:1]
+    Membership.objects.update(joined_at=Subquery(created))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('chat', '0009_task'),
+    ]
+
+    operations = [
+        # Adopt the auto-created participants table as the Membership model.
+        migrations.SeparateDatabaseAndState(
+            state_operations=[
+                migrations.CreateModel(
+                    name='Membership',
+                    fields=[
+                        ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                        ('thread', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='memberships', to='chat.thread')),
+                        ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='memberships', to=settings.AUTH_USER_MODEL)),
+                    ],
+                    options={
+                        'db_table': 'chat_thread_participants',
+                        'unique_together': {('thread', 'user')},
+                    },
+                ),
+                migrations.AlterField(
+                    model_name='thread',
+                    name='participants',
+                    field=models.ManyToManyField(related_name='threads', through='chat.Membership', to=settings.AUTH_USER_MODEL),
+                ),
+            ],
+        ),
+        migrations.AddField(
+            model_name='membership',
+            name='joined_at',
+            field=models.DateTimeField(default=django.utils.timezone.now),
+        ),
+        migrations.AddField(
+            model_name='membership',
+            name='last_read_id',
+            field=models.BigIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='membership',
+            name='muted',
+            field=models.BooleanField(default=False),
+        ),
+        migrations.AddField(
+            model_name='thread',
+            name='is_group',
+            field=models.BooleanField(default=False),
+        ),
+        migrations.AddField(
+            model_name='thread',
+            name='name',
+            field=models.CharField(blank=True, max_length=200),
+        ),
+        migrations.AddIndex(
+            model_name='message',
+            index=models.Index(fields=['thread', 'id', 'sender'], name='chat_msg_thread_id_idx'),
+        ),
+        migrations.RunPython(backfill_joined_at, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 4.2.23 on 2026-10-18 13:35
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chat', '0010_membership_group_threads'),
+    ]
+
+    operations = [
+        migrations.RemoveField(
+            model_name='unreadcounter',
+            name='last_read_id',
+        ),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 4.2.23 on 2026-10-18 13:36
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chat', '0011_remove_unreadcounter_last_read_id'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='archivedmessage',
+            index=models.Index(fields=['created'], name='chat_archive_created_idx'),
+        ),
+    ]
@@ -1,22 +1,148 @@
 from django.contrib.auth import get_user_model
-from django.db import models
+from django.db import models, transaction
+from django.db.models import Case, Count, F, Max, OuterRef, Q, Subquery, Sum, When
+from django.db.models.functions import Coalesce, Greatest
+from django.utils import timezone
 
 User = get_user_model()
 
 class Thread(models.Model):
-    participants = models.ManyToManyField(User, related_name='threads')
+    participants = models.ManyToManyField(User, through='Membership', related_name='threads')
+    # Group threads have any number of members and a name; direct threads
+    # have exactly two participants and a pair key.
+    is_group = models.BooleanField(default=False)
+    name = models.CharField(max_length=200, blank=True)
+    # Canonical participant pair (lowest id first), kept in sync with
+    # ``participants`` so a duplicate lookup is a single indexed query.
+    user_low = models.ForeignKey(
+        User, null=True, blank=True, on_delete=models.SET_NULL, related_name='+'
+    )
+    user_high = models.ForeignKey(
+        User, null=True, blank=True, on_delete=models.SET_NULL, related_name='+'
+    )
+    # Denormalized pointer to the newest message, kept current by Message.save.
+    last_message = models.ForeignKey(
+        'Message', null=True, blank=True, on_delete=models.SET_NULL, related_name='+'
+    )
     created = models.DateTimeField(auto_now_add=True)
     updated = models.DateTimeField(auto_now=True)
 
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['user_low', 'user_high'], name='chat_thread_unique_pair'),
+        ]
+
+    @staticmethod
+    def pair_key(first, second):
+        """Return the order-independent (low, high) key for two user ids."""
+        return (first, second) if first < second else (second, first)
+
+    def sync_pair_key(self):
+        """Recompute the canonical pair from the current participants; groups have none."""
+        user_ids = [] if self.is_group else sorted(self.participants.values_list('id', flat=True))
+        low, high = user_ids if len(user_ids) == 2 else (None, None)
+        if (self.user_low_id, self.user_high_id) != (low, high):
+            Thread.objects.filter(pk=self.pk).update(user_low_id=low, user_high_id=high)
+            self.user_low_id, self.user_high_id = low, high
+
     def save(self, *args, **kwargs):
+        adding = self._state.adding
         super().save(*args, **kwargs)
-        if self.participants.count() > 2:
+        # A new row cannot have participants yet, so skip the count query.
+        if not adding and not self.is_group and self.participants.count() > 2:
             raise ValueError("A thread cannot have more than 2 participants.")
 
     def __str__(self):
+        if self.is_group:
+            return f"Group: {self.name or self.pk}"
         return f"Thread: {[user.username for user in self.participants.all()]}"
 
 
+def group_unread_count():
+    """Unread messages of a group Membership row, for use in its queryset.
+
+    A member has read everything up to their ``last_read_id``, and never
+    has their own messages unread. The count is a range scan of the
+    ``(thread, id, sender)`` index, so its cost follows the member's unread
+    backlog, not the group size, and sending writes nothing per member.
+    """
+    unread = (
+        Message.objects.filter(thread=OuterRef('thread_id'), id__gt=OuterRef('last_read_id'))
+        .exclude(sender=OuterRef('user_id'))
+        .order_by().values('thread').annotate(count=Count('*')).values('count')
+    )
+    return Coalesce(Subquery(unread), 0, output_field=models.IntegerField())
+
+
+class MembershipManager(models.Manager):
+
+    def mark_read(self, user_id, thread_id, up_to_id=None, up_to=None):
+        """Advance a group member's watermark to the newest message up to ``up_to_id``/``up_to``.
+
+        The watermark only moves forward and never past the thread's own
+        messages. Returns ``(messages newly read, watermark)``.
+        """
+        messages = Message.objects.filter(thread_id=thread_id)
+        if up_to_id is not None:
+            messages = messages.filter(id__lte=up_to_id)
+        if up_to is not None:
+            messages = messages.filter(created__lte=up_to)
+        newest = messages.aggregate(newest=Max('id'))['newest']
+        membership = self.filter(user_id=user_id, thread_id=thread_id)
+        last_read_id = membership.values_list('last_read_id', flat=True).first()
+        if newest is None or last_read_id is None or last_read_id >= newest:
+            return 0, last_read_id
+        read = (
+            Message.objects.filter(thread_id=thread_id, id__gt=last_read_id, id__lte=newest)
+            .exclude(sender_id=user_id).count()
+        )
+        membership.update(last_read_id=Greatest(F('last_read_id'), newest))
+        return read, newest
+
+
+class Membership(models.Model):
+    """A user's membership of a thread, with their read position in groups."""
+
+    thread = models.ForeignKey(Thread, on_delete=models.CASCADE, related_name='memberships')
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='memberships')
+    joined_at = models.DateTimeField(default=timezone.now)
+    # Highest message id read in a group thread; direct threads use UnreadCounter.
+    last_read_id = models.BigIntegerField(default=0)
+    # Muted threads do not count towards the user's unread total.
+    muted = models.BooleanField(default=False)
+
+    objects = MembershipManager()
+
+    class Meta:
+        # The table and unique index of the former auto-created M2M.
+        db_table = 'chat_thread_participants'
+        unique_together = [('thread', 'user')]
+
+    def __str__(self):
+        return f"User {self.user_id} in Thread {self.thread_id}"
+
+
+class MessageManager(models.Manager):
+
+    def bulk_send(self, sender_id, items):
+        """Insert ``(thread_id, text)`` pairs in one transaction and return the messages.
+
+        Each thread's last message, activity time and unread counters are
+        updated once, however many of the messages it receives.
+        """
+        messages = [Message(thread_id=thread_id, sender_id=sender_id, text=text) for thread_id, text in items]
+        per_thread = {}
+        with transaction.atomic():
+            self.bulk_create(messages, batch_size=500)
+            for message in messages:
+                per_thread.setdefault(message.thread_id, []).append(message)
+            for thread_id, thread_messages in per_thread.items():
+                newest = thread_messages[-1]
+                Thread.objects.filter(pk=thread_id).update(last_message=newest, updated=newest.created)
+                UnreadCounter.objects.add_unread(thread_id, sender_id, len(thread_messages))
+        return messages
+
+
 class Message(models.Model):
     thread = models.ForeignKey(Thread, on_delete=models.CASCADE, related_name='messages')
     sender = models.ForeignKey(User, on_delete=models.CASCADE)
@@ -24,5 +150,222 @@ class Message(models.Model):
     created = models.DateTimeField(auto_now_add=True)
     is_read = models.BooleanField(default=False)
 
+    objects = MessageManager()
+
+    class Meta:
+        indexes = [
+            # Serves keyset pagination over (created, id) within a thread.
+            models.Index(fields=['thread', 'created', 'id'], name='chat_msg_thread_created_idx'),
+            # Covers group unread counts: messages after a watermark, by sender.
+            models.Index(fields=['thread', 'id', 'sender'], name='chat_msg_thread_id_idx'),
+        ]
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # Remember the stored read state and thread so save() can adjust unread counters.
+        instance._loaded_is_read = instance.__dict__.get('is_read')
+        instance._loaded_thread_id = instance.__dict__.get('thread_id')
+        return instance
+
+    def save(self, *args, **kwargs):
+        adding = self._state.adding
+        was_read = getattr(self, '_loaded_is_read', None)
+        old_thread_id = getattr(self, '_loaded_thread_id', None) or self.thread_id
+        with transaction.atomic():
+            super().save(*args, **kwargs)
+            if adding:
+                # Bumping ``updated`` orders the inbox by last activity.
+                Thread.objects.filter(pk=self.thread_id).update(last_message=self, updated=self.created)
+                if not self.is_read:
+                    UnreadCounter.objects.add_unread(self.thread_id, self.sender_id, 1)
+            elif old_thread_id != self.thread_id:
+                # A moved message leaves the old thread's counters and joins the new one's.
+                if was_read is not None and not was_read:
+                    UnreadCounter.objects.add_unread(old_thread_id, self.sender_id, -1)
+                if not self.is_read:
+                    UnreadCounter.objects.add_unread(self.thread_id, self.sender_id, 1)
+                self._moved_from_thread_id = old_thread_id
+                latest = Message.objects.filter(thread=OuterRef('pk')).order_by('-created', '-id')
+                Thread.objects.filter(pk__in=[old_thread_id, self.thread_id]).update(
+                    last_message=Subquery(latest.values('pk')[:1])
+                )
+            elif was_read is not None and was_read != self.is_read:
+                UnreadCounter.objects.add_unread(self.thread_id, self.sender_id, -1 if self.is_read else 1)
+        self._loaded_is_read = self.is_read
+        self._loaded_thread_id = self.thread_id
+
+    def delete(self, *args, **kwargs):
+        with transaction.atomic():
+            if not self.is_read:
+                UnreadCounter.objects.add_unread(self.thread_id, self.sender_id, -1)
+            result = super().delete(*args, **kwargs)
+            # The FK was nulled if this was the newest message; point it at the next one.
+            latest = Message.objects.filter(thread=OuterRef('pk')).order_by('-created', '-id')
+            Thread.objects.filter(pk=self.thread_id, last_message__isnull=True).update(
+                last_message=Subquery(latest.values('pk')[:1])
+            )
+            return result
+
+    def __str__(self):
+        return f"Message from {self.sender.username} in Thread {self.thread_id}"
+
+
+
+class ArchivedMessage(models.Model):
+    """A message moved out of the hot table by ``archive_messages``.
+
+    Rows keep their original id and are read-only. The foreign keys have no
+    database constraint so the table can live on ``CHAT_ARCHIVE_DATABASE``.
+    """
+
+    id = models.BigIntegerField(primary_key=True)
+    thread = models.ForeignKey(Thread, on_delete=models.DO_NOTHING, db_constraint=False, related_name='+')
+    sender = models.ForeignKey(User, on_delete=models.DO_NOTHING, db_constraint=False, related_name='+')
+    text = models.TextField()
+    created = models.DateTimeField()
+    is_read = models.BooleanField(default=False)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['thread', 'created', 'id'], name='chat_archive_thread_idx'),
+            # Serves MAX(created) when the archive horizon has to be recomputed.
+            models.Index(fields=['created'], name='chat_archive_created_idx'),
+        ]
+
+    def __str__(self):
+        return f"Archived message {self.pk} in Thread {self.thread_id}"
+
+
+def membership_unread_count():
+    """Unread messages of a Membership row: its counter in direct threads, its watermark in groups."""
+    counter = UnreadCounter.objects.filter(thread_id=OuterRef('thread_id'), user_id=OuterRef('user_id'))
+    return Case(
+        When(thread__is_group=True, then=group_unread_count()),
+        default=Coalesce(Subquery(counter.values('count')[:1]), 0),
+        output_field=models.IntegerField(),
+    )
+
+
+class UnreadCounterManager(models.Manager):
+
+    def total_for(self, user):
+        """Return the number of unread messages across all unmuted threads of a user."""
+        memberships = Membership.objects.filter(user=user, muted=False)
+        return memberships.aggregate(total=Sum(membership_unread_count()))['total'] or 0
+
+    async def atotal_for(self, user):
+        memberships = Membership.objects.filter(user=user, muted=False)
+        result = await memberships.aaggregate(total=Sum(membership_unread_count()))
+        return result['total'] or 0
+
+    def totals(self, user_ids):
+        """Return ``{user_id: unread total}`` for several users in one query."""
+        totals = dict.fromkeys(user_ids, 0)
+        rows = (
+            Membership.objects.filter(user_id__in=user_ids, muted=False)
+            .values('user_id').annotate(total=Sum(membership_unread_count()))
+        )
+        totals.update((row['user_id'], row['total']) for row in rows)
+        return totals
+
+    def add_unread(self, thread_id, sender_id, delta):
+        """Shift the counters of every participant except the sender by ``delta``.
+
+        Group threads have no counters, so this writes nothing for them.
+        """
+        self.filter(thread_id=thread_id).exclude(user_id=sender_id).update(
+            count=Greatest(F('count') + delta, 0)
+        )
+
+    def mark_read(self, user_id, thread_id, count):
+        """Subtract ``count`` newly read messages."""
+        self.filter(user_id=user_id, thread_id=thread_id).update(count=Greatest(F('count') - count, 0))
+
+    def rebuild(self, thread_ids=None):
+        """Recompute direct threads' counters from ``Message.is_read``; return the number of rows fixed."""
+        participants = Membership.objects.filter(thread__is_group=False)
+        counters = self.all()
+        if thread_ids is not None:
+            participants = participants.filter(thread_id__in=thread_ids)
+            counters = counters.filter(thread_id__in=thread_ids)
+
+        expected = {
+            (row['user_id'], row['thread_id']): row['unread']
+            for row in participants.values('user_id', 'thread_id').annotate(
+                unread=Count(
+                    'thread__messages',
+                    filter=Q(thread__messages__is_read=False) & ~Q(thread__messages__sender=F('user')),
+                )
+            )
+        }
+
+        stale, changed = [], []
+        for counter in counters:
+            key = (counter.user_id, counter.thread_id)
+            if key not in expected:
+                stale.append(counter.pk)
+                continue
+            count = expected.pop(key)
+            if count != counter.count:
+                counter.count = count
+                changed.append(counter)
+        missing = [
+            UnreadCounter(user_id=user_id, thread_id=thread_id, count=count)
+            for (user_id, thread_id), count in expected.items()
+        ]
+
+        with transaction.atomic():
+            self.filter(pk__in=stale).delete()
+            self.bulk_update(changed, ['count'], batch_size=500)
+            self.bulk_create(missing, batch_size=500)
+        return len(stale) + len(changed) + len(missing)
+
+
+class UnreadCounter(models.Model):
+    """Denormalized number of unread messages a participant has in a direct thread."""
+
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='unread_counters')
+    thread = models.ForeignKey(Thread, on_delete=models.CASCADE, related_name='unread_counters')
+    count = models.PositiveIntegerField(default=0)
+
+    objects = UnreadCounterManager()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'thread'], name='chat_unreadcounter_unique'),
+        ]
+
+    def __str__(self):
+        return f"{self.count} unread for user {self.user_id} in Thread {self.thread_id}"
+
+
+class Task(models.Model):
+    """A queued side effect, run by ``manage.py chat_worker`` (see chat.tasks)."""
+
+    PENDING = 'pending'
+    RUNNING = 'running'
+    DONE = 'done'
+    FAILED = 'failed'
+    STATUS_CHOICES = [(PENDING, 'Pending'), (RUNNING, 'Running'), (DONE, 'Done'), (FAILED, 'Failed')]
+
+    event = models.CharField(max_length=64)
+    payload = models.JSONField(default=dict)
+    # Enqueueing the same key twice creates a single task.
+    key = models.CharField(max_length=128, null=True, blank=True, unique=True)
+    status = models.CharField(max_length=16, choices=STATUS_CHOICES, default=PENDING)
+    attempts = models.PositiveSmallIntegerField(default=0)
+    run_after = models.DateTimeField(default=timezone.now)
+    # A running task whose lease expired is claimed again.
+    locked_until = models.DateTimeField(null=True, blank=True)
+    last_error = models.TextField(blank=True)
+    created = models.DateTimeField(auto_now_add=True)
+    finished = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['status', 'run_after'], name='chat_task_due_idx'),
+        ]
+
     def __str__(self):
-        return f"Message from {self.sender.username} in Thread {self.thread.id}"
\ No newline at end of file
+        return f"Task {self.pk} {self.event} ({self.status})"
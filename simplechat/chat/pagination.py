@@ -0,0 +1,208 @@
+import base64
+import binascii
+import json
+from datetime import datetime
+
+from django.core.exceptions import FieldDoesNotExist, ValidationError
+from django.db.models import Q
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination, LimitOffsetPagination
+from rest_framework.response import Response
+from rest_framework.settings import api_settings
+from rest_framework.utils.urls import remove_query_param, replace_query_param
+
+from .archive import archive_horizon
+
+
+class KeysetPagination(BasePagination):
+    """Opaque-cursor pagination over a unique ordering such as ``(created, id)``.
+
+    Pages are selected with a range condition on the ordering columns, so
+    there is no COUNT query and no OFFSET scan. Requests that pass
+    ``offset`` fall back to ``LimitOffsetPagination`` for older clients.
+    """
+
+    page_size = api_settings.PAGE_SIZE
+    max_page_size = 100
+    ordering = ('-created', '-id')
+    cursor_query_param = 'cursor'
+    page_size_query_param = 'limit'
+    offset_query_param = 'offset'
+    invalid_cursor_message = 'Invalid cursor'
+
+    def paginate_queryset(self, queryset, request, view=None):
+        page = self.get_page_queryset(queryset, request, view)
+        if self.offset_paginator is not None:
+            return self.offset_paginator.paginate_queryset(page, request, view)
+        return self.set_page(self.add_archived(list(page), view))
+
+    def get_page_queryset(self, queryset, request, view=None):
+        """Return the queryset holding one page plus a look-ahead row.
+
+        Async callers evaluate it themselves and pass the rows to set_page().
+        In offset mode the ordered queryset is returned for ``offset_paginator``.
+        """
+        self.request = request
+        self.ordering = getattr(view, 'keyset_ordering', None) or self.ordering
+        self.fields = [(name.lstrip('-'), name.startswith('-')) for name in self.ordering]
+        queryset = queryset.order_by(*self.ordering)
+
+        self.offset_paginator = None
+        if self.offset_query_param in request.query_params:
+            self.offset_paginator = LimitOffsetPagination()
+            return queryset
+
+        self.page_size = self.get_page_size(request)
+        self.position, self.reverse = self.decode_cursor(request, queryset.model)
+        return self.filter_page(queryset)
+
+    def filter_page(self, queryset):
+        """Limit an ordered queryset to the rows of the current page plus one."""
+        if self.position is not None:
+            queryset = queryset.filter(self.get_position_filter(self.position, self.reverse))
+        if self.reverse:
+            queryset = queryset.reverse()
+        return queryset[:self.page_size + 1]
+
+    def add_archived(self, rows, view):
+        """Merge archived rows into a page that reaches past the hot table.
+
+        Views ordered by ``(-created, -id)`` opt in with
+        ``get_archive_queryset()``. Every archived row was
+        created at or before the archive horizon, so the archive is only
+        queried when the hot rows run out or reach the horizon.
+        """
+        get_archive_queryset = getattr(view, 'get_archive_queryset', None)
+        if get_archive_queryset is None:
+            return rows
+        horizon = archive_horizon()
+        if horizon is None:
+            return rows
+        if self.reverse:
+            reaches = self.position['created'] <= horizon
+        else:
+            reaches = len(rows) <= self.page_size or self.get_position(rows[-1])['created'] <= horizon
+        if not reaches:
+            return rows
+        archived = self.filter_page(get_archive_queryset().order_by(*self.ordering))
+        rows = sorted(
+            rows + list(archived),
+            key=lambda row: tuple(self.get_position(row).values()),
+            reverse=self.fields[0][1] != self.reverse,
+        )
+        return rows[:self.page_size + 1]
+
+    def set_page(self, results):
+        has_more = len(results) > self.page_size
+        results = results[:self.page_size]
+        if self.reverse:
+            results.reverse()
+            self.has_next, self.has_previous = self.position is not None, has_more
+        else:
+            self.has_next, self.has_previous = has_more, self.position is not None
+
+        self.page = results
+        return results
+
+    def get_paginated_data(self, data):
+        if self.offset_paginator is not None:
+            paginator = self.offset_paginator
+            return {
+                'count': paginator.count,
+                'next': paginator.get_next_link(),
+                'previous': paginator.get_previous_link(),
+                'results': data,
+            }
+        return {
+            'next': self.get_next_link(),
+            'previous': self.get_previous_link(),
+            'results': data,
+        }
+
+    def get_paginated_response(self, data):
+        return Response(self.get_paginated_data(data))
+
+    def get_paginated_response_schema(self, schema):
+        return {
+            'type': 'object',
+            'required': ['results'],
+            'properties': {
+                'next': {'type': 'string', 'nullable': True, 'format': 'uri'},
+                'previous': {'type': 'string', 'nullable': True, 'format': 'uri'},
+                'results': schema,
+            },
+        }
+
+    def get_page_size(self, request):
+        try:
+            size = int(request.query_params[self.page_size_query_param])
+        except (KeyError, ValueError):
+            return self.page_size
+        return min(max(size, 1), self.max_page_size)
+
+    def get_position_filter(self, position, reverse):
+        """Build the condition selecting rows strictly after ``position``."""
+        condition = Q()
+        for index, (name, descending) in enumerate(self.fields):
+            lookup = 'lt' if descending != reverse else 'gt'
+            equal = {prev: position[prev] for prev, _ in self.fields[:index]}
+            condition |= Q(**equal, **{f'{name}__{lookup}': position[name]})
+        # A non-strict bound on the leading column lets the index drive a range scan.
+        name, descending = self.fields[0]
+        lookup = 'lte' if descending != reverse else 'gte'
+        return Q(**{f'{name}__{lookup}': position[name]}) & condition
+
+    def get_position(self, item):
+        return {
+            name: item[name] if isinstance(item, dict) else getattr(item, name)
+            for name, _ in self.fields
+        }
+
+    def get_next_link(self):
+        if not self.has_next or not self.page:
+            return None
+        return self.encode_cursor(self.get_position(self.page[-1]), reverse=False)
+
+    def get_previous_link(self):
+        if not self.has_previous or not self.page:
+            return None
+        return self.encode_cursor(self.get_position(self.page[0]), reverse=True)
+
+    def encode_cursor(self, position, reverse):
+        values = [
+            value.isoformat() if isinstance(value, datetime) else value
+            for value in position.values()
+        ]
+        payload = json.dumps({'p': values, 'r': int(reverse)}, separators=(',', ':'))
+        cursor = base64.urlsafe_b64encode(payload.encode('ascii')).decode('ascii')
+        url = self.request.build_absolute_uri()
+        url = remove_query_param(url, self.offset_query_param)
+        return replace_query_param(url, self.cursor_query_param, cursor)
+
+    def decode_cursor(self, request, model):
+        encoded = request.query_params.get(self.cursor_query_param)
+        if not encoded:
+            return None, False
+        try:
+            payload = json.loads(base64.urlsafe_b64decode(encoded.encode('ascii')))
+            values = payload['p']
+            if len(values) != len(self.fields):
+                raise ValueError
+            position = {
+                name: self.to_python(model, name, value)
+                for (name, _), value in zip(self.fields, values)
+            }
+            return position, bool(payload.get('r'))
+        except (TypeError, ValueError, KeyError, binascii.Error, ValidationError):
+            raise NotFound(self.invalid_cursor_message)
+
+    @staticmethod
+    def to_python(model, name, value):
+        try:
+            field = model._meta.get_field(name)
+        except FieldDoesNotExist:
+            # Annotations such as a search rank are plain JSON values.
+            if not isinstance(value, (int, float)):
+                raise ValueError(name)
+            return value
+        return field.to_python(value)
@@ -0,0 +1,96 @@
+from datetime import datetime, timedelta, timezone
+
+import msgpack
+from django.middleware.gzip import GZipMiddleware
+from django.utils.dateparse import parse_datetime
+from django.utils.decorators import decorator_from_middleware
+from rest_framework.renderers import BaseRenderer, JSONRenderer
+from rest_framework.settings import api_settings
+
+# Fields rendered as epoch milliseconds in the compact formats.
+TIMESTAMP_FIELDS = frozenset(('created', 'updated'))
+EPOCH = datetime(1970, 1, 1, tzinfo=timezone.utc)
+MILLISECOND = timedelta(milliseconds=1)
+
+
+def epoch_ms(value):
+    # parse_datetime, unlike datetime.fromisoformat before Python 3.11, takes DRF's trailing 'Z'.
+    moment = parse_datetime(value)
+    if moment.tzinfo is None:
+        moment = moment.replace(tzinfo=timezone.utc)
+    return (moment - EPOCH) // MILLISECOND
+
+
+def compact_value(name, value):
+    if name in TIMESTAMP_FIELDS and isinstance(value, str):
+        return epoch_ms(value)
+    if isinstance(value, dict):
+        return {key: compact_value(key, item) for key, item in value.items()}
+    if isinstance(value, list):
+        return [compact_value(None, item) for item in value]
+    return value
+
+
+def columns(rows):
+    """``[{'id': 1, ...}, ...]`` -> ``{'fields': ['id', ...], 'rows': [[1, ...], ...]}``."""
+    fields = list(rows[0]) if rows else []
+    return {'fields': fields, 'rows': [[compact_value(field, row[field]) for field in fields] for row in rows]}
+
+
+def compact(data):
+    """Lay out a page (or list) of objects as columns, with epoch timestamps.
+
+    Field names are sent once per page instead of once per row. Nested
+    objects such as an inbox row's ``last_message`` stay objects. Anything
+    else, like a single object or an error, only has its timestamps converted.
+    """
+    if isinstance(data, dict) and isinstance(data.get('results'), list):
+        return {**data, 'results': columns(data['results'])}
+    if isinstance(data, list) and all(isinstance(row, dict) for row in data):
+        return columns(data)
+    return compact_value(None, data)
+
+
+class CompactJSONRenderer(JSONRenderer):
+    """Columnar JSON; ask with ``Accept: application/vnd.simplechat.compact+json`` or ``?format=compact``."""
+
+    media_type = 'application/vnd.simplechat.compact+json'
+    format = 'compact'
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        return super().render(compact(data), accepted_media_type, renderer_context)
+
+
+class MessagePackRenderer(BaseRenderer):
+    """The compact layout encoded as MessagePack."""
+
+    media_type = 'application/msgpack'
+    format = 'msgpack'
+    charset = None
+    render_style = 'binary'
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return b''
+        return msgpack.packb(compact(data), use_bin_type=True)
+
+
+# Renderers of the chat viewsets: the defaults first, so plain clients keep JSON.
+CHAT_RENDERERS = [
+    *api_settings.DEFAULT_RENDERER_CLASSES,
+    CompactJSONRenderer,
+    MessagePackRenderer,
+]
+
+
+class ResponseGZipMiddleware(GZipMiddleware):
+    """GZipMiddleware for plain responses; streams (exports, SSE) are left alone."""
+
+    def process_response(self, request, response):
+        if response.streaming:
+            return response
+        return super().process_response(request, response)
+
+
+# View decorator gzipping responses for clients that send Accept-Encoding: gzip.
+gzip_response = decorator_from_middleware(ResponseGZipMiddleware)
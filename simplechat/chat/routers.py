@@ -0,0 +1,122 @@
+import random
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS
+
+from .caching import get_cache
+
+# Alias chat reads go to in the current request; None means the primary.
+_read_alias = ContextVar('chat_read_alias', default=None)
+
+
+def get_replicas():
+    return list(getattr(settings, 'CHAT_READ_REPLICAS', ()))
+
+
+def sticky_key(user_id):
+    return f'chat:sticky:{user_id}'
+
+
+def mark_write(user_id):
+    """Pin the user's reads to the primary until replicas have caught up."""
+    get_cache().set(sticky_key(user_id), True, settings.CHAT_REPLICA_STICKY_SECONDS)
+
+
+def is_sticky(user_id):
+    return get_cache().get(sticky_key(user_id)) is not None
+
+
+def choose_replica(user_id):
+    """Return a replica alias for the user's reads, or None for the primary."""
+    replicas = get_replicas()
+    if not replicas or (user_id is not None and is_sticky(user_id)):
+        return None
+    return random.choice(replicas)
+
+
+@contextmanager
+def reading_from(alias):
+    token = _read_alias.set(alias)
+    try:
+        yield alias
+    finally:
+        _read_alias.reset(token)
+
+
+class ReplicaRouter:
+    """Send chat reads to the replica chosen for the current request.
+
+    Outside of a request marked by ReplicaReadMixin every query goes to the
+    primary. Writes always do, including saves of objects read from a replica.
+    """
+
+    def db_for_read(self, model, **hints):
+        if model._meta.app_label == 'chat':
+            return _read_alias.get()
+        return None
+
+    def db_for_write(self, model, **hints):
+        instance = hints.get('instance')
+        if instance is not None and instance._state.db in get_replicas():
+            return DEFAULT_DB_ALIAS
+        return None
+
+    def allow_relation(self, obj1, obj2, **hints):
+        databases = {DEFAULT_DB_ALIAS, *get_replicas()}
+        if obj1._state.db in databases and obj2._state.db in databases:
+            return True
+        return None
+
+
+class ArchiveRouter:
+    """Keep ArchivedMessage on ``CHAT_ARCHIVE_DATABASE`` when that is a separate alias.
+
+    The archive alias holds only that table, and no other database does.
+    """
+
+    @staticmethod
+    def archive_alias():
+        alias = settings.CHAT_ARCHIVE_DATABASE
+        return None if alias == DEFAULT_DB_ALIAS else alias
+
+    def db_for_read(self, model, **hints):
+        if model._meta.label == 'chat.ArchivedMessage':
+            return self.archive_alias()
+        return None
+
+    db_for_write = db_for_read
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        alias = self.archive_alias()
+        if alias is None or app_label != 'chat' or model_name is None:
+            return None
+        return (model_name == 'archivedmessage') == (db == alias)
+
+
+class ReplicaReadMixin:
+    """Serve safe requests from a replica, with read-your-writes stickiness.
+
+    A successful unsafe request pins the user to the primary for
+    ``CHAT_REPLICA_STICKY_SECONDS``, so they see their own writes even if
+    the replica lags.
+    """
+
+    def initial(self, request, *args, **kwargs):
+        super().initial(request, *args, **kwargs)
+        if request.method in ('GET', 'HEAD', 'OPTIONS'):
+            self._replica_token = _read_alias.set(choose_replica(request.user.id))
+
+    def get_read_alias(self):
+        return _read_alias.get()
+
+    def finalize_response(self, request, response, *args, **kwargs):
+        token = getattr(self, '_replica_token', None)
+        if token is not None:
+            _read_alias.reset(token)
+            self._replica_token = None
+        elif request.method not in ('GET', 'HEAD', 'OPTIONS') and response.status_code < 400 \
+                and request.user.is_authenticated:
+            mark_write(request.user.id)
+        return super().finalize_response(request, response, *args, **kwargs)
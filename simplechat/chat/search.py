@@ -0,0 +1,259 @@
+import re
+
+from django.db import DatabaseError, connections, router
+from django.db.models import FloatField, Value
+
+from .archive import user_thread_ids
+from .models import Message, Thread
+from .pagination import KeysetPagination
+
+MAX_TERMS = 16
+
+# Tables with a full-text index: the hot messages and their archive.
+SEARCH_TABLES = ('chat_message', 'chat_archivedmessage')
+POSTGRES_CONFIG = 'simple'
+
+
+def sqlite_triggers(table):
+    fts = f'{table}_fts'
+    return {
+        f'{fts}_insert': f"""
+            CREATE TRIGGER IF NOT EXISTS {fts}_insert AFTER INSERT ON {table} BEGIN
+                INSERT INTO {fts}(rowid, text) VALUES (new.id, new.text);
+            END""",
+        f'{fts}_delete': f"""
+            CREATE TRIGGER IF NOT EXISTS {fts}_delete AFTER DELETE ON {table} BEGIN
+                INSERT INTO {fts}({fts}, rowid, text) VALUES ('delete', old.id, old.text);
+            END""",
+        f'{fts}_update': f"""
+            CREATE TRIGGER IF NOT EXISTS {fts}_update AFTER UPDATE OF text ON {table} BEGIN
+                INSERT INTO {fts}({fts}, rowid, text) VALUES ('delete', old.id, old.text);
+                INSERT INTO {fts}(rowid, text) VALUES (new.id, new.text);
+            END""",
+    }
+
+
+def install_index(db):
+    """Create the full-text indexes for ``db`` if they are missing; return True if they exist.
+
+    Each table of SEARCH_TABLES present in ``db`` is indexed. SQLite gets an
+    external-content FTS5 table kept in sync by triggers. Rebuilding a table
+    (as SQLite migrations do when altering it) drops the triggers, so this
+    runs after every migrate and rebuilds the index when they had to be
+    recreated. Postgres gets a generated ``tsvector`` column with a GIN index.
+    """
+    tables = [table for table in SEARCH_TABLES if table in db.introspection.table_names()]
+    with db.cursor() as cursor:
+        for table in tables:
+            if db.vendor == 'sqlite':
+                triggers = sqlite_triggers(table)
+                cursor.execute(
+                    "SELECT name FROM sqlite_master WHERE type = 'trigger' AND name LIKE %s", [f'{table}_fts_%']
+                )
+                if {name for name, in cursor.fetchall()} == set(triggers):
+                    continue
+                try:
+                    cursor.execute(
+                        f"CREATE VIRTUAL TABLE IF NOT EXISTS {table}_fts USING fts5("
+                        f"text, content='{table}', content_rowid='id', tokenize='unicode61 remove_diacritics 2')"
+                    )
+                except DatabaseError:
+                    # SQLite built without FTS5; searches fall back to a scan.
+                    return False
+                for sql in triggers.values():
+                    cursor.execute(sql)
+                cursor.execute(f"INSERT INTO {table}_fts({table}_fts) VALUES ('rebuild')")
+            elif db.vendor == 'postgresql':
+                cursor.execute(
+                    f"ALTER TABLE {table} ADD COLUMN IF NOT EXISTS search_vector tsvector "
+                    f"GENERATED ALWAYS AS (to_tsvector('{POSTGRES_CONFIG}', text)) STORED"
+                )
+                cursor.execute(
+                    f"CREATE INDEX IF NOT EXISTS {table}_search_idx ON {table} USING GIN (search_vector)"
+                )
+            else:
+                return False
+    return bool(tables)
+
+
+def uninstall_index(db, tables=SEARCH_TABLES):
+    with db.cursor() as cursor:
+        for table in tables:
+            if db.vendor == 'sqlite':
+                for name in sqlite_triggers(table):
+                    cursor.execute(f"DROP TRIGGER IF EXISTS {name}")
+                cursor.execute(f"DROP TABLE IF EXISTS {table}_fts")
+            elif db.vendor == 'postgresql' and table in db.introspection.table_names():
+                cursor.execute(f"ALTER TABLE {table} DROP COLUMN IF EXISTS search_vector")
+
+
+def search_terms(query):
+    """Split user input into plain words, so no query syntax reaches the index."""
+    return re.findall(r'\w+', query.lower())[:MAX_TERMS]
+
+
+class SearchBackend:
+    """Finds the user's messages matching every term; the last term matches as a prefix.
+
+    search() returns rows of ``model`` (Message or ArchivedMessage) carrying a
+    ``rank`` attribute (lower is better) ordered by ``(rank, -id)``, starting
+    after the ``after`` position.
+    """
+
+    def __init__(self, model=Message):
+        self.model = model
+
+    def search(self, user, terms, thread_id=None, after=None, reverse=False, limit=20):
+        raise NotImplementedError
+
+
+class IndexedSearchBackend(SearchBackend):
+    """Shared SQL for the database full-text indexes."""
+
+    rank_sql = None
+    from_sql = None
+    # Holds the match parameter, unless from_sql does; either way it is the first one.
+    match_sql = None
+
+    @property
+    def table(self):
+        return self.model._meta.db_table
+
+    def match_param(self, terms):
+        raise NotImplementedError
+
+    def search(self, user, terms, thread_id=None, after=None, reverse=False, limit=20):
+        columns = ', '.join(f'm.{field.column}' for field in self.model._meta.concrete_fields)
+        where = [self.match_sql]
+        params = [self.match_param(terms)]
+        if self.model is Message:
+            participants = Thread.participants.through._meta.db_table
+            where.append(f'm.thread_id IN (SELECT thread_id FROM {participants} WHERE user_id = %s)')
+            params.append(user.pk)
+        else:
+            # The archive may be in another database than the participants.
+            thread_ids = user_thread_ids(user) or [None]
+            where.append(f"m.thread_id IN ({', '.join(['%s'] * len(thread_ids))})")
+            params += thread_ids
+        if thread_id is not None:
+            where.append('m.thread_id = %s')
+            params.append(thread_id)
+        if after is not None:
+            rank_op, id_op = ('<', '>') if reverse else ('>', '<')
+            where.append(f'({self.rank_sql} {rank_op} %s OR ({self.rank_sql} = %s AND m.id {id_op} %s))')
+            params += [after['rank'], after['rank'], after['id']]
+        order = f'{self.rank_sql} DESC, m.id ASC' if reverse else f'{self.rank_sql} ASC, m.id DESC'
+        sql = (
+            f"SELECT {columns}, {self.rank_sql} AS rank FROM {self.from_sql} "
+            f"WHERE {' AND '.join(where)} ORDER BY {order} LIMIT %s"
+        )
+        return self.model.objects.raw(sql, params + [limit])
+
+
+class SQLiteSearchBackend(IndexedSearchBackend):
+
+    @property
+    def rank_sql(self):
+        return f'{self.table}_fts.rank'
+
+    @property
+    def from_sql(self):
+        return f'{self.table}_fts JOIN {self.table} m ON m.id = {self.table}_fts.rowid'
+
+    @property
+    def match_sql(self):
+        return f'{self.table}_fts MATCH %s'
+
+    def match_param(self, terms):
+        phrases = [f'"{term}"' for term in terms]
+        phrases[-1] += '*'
+        return ' '.join(phrases)
+
+
+class PostgresSearchBackend(IndexedSearchBackend):
+    # ts_rank grows with relevance; negate it so that lower is better as with bm25.
+    rank_sql = '-ts_rank(m.search_vector, q.query)'
+    match_sql = 'm.search_vector @@ q.query'
+
+    @property
+    def from_sql(self):
+        return f"{self.table} m, to_tsquery('{POSTGRES_CONFIG}', %s) q(query)"
+
+    def match_param(self, terms):
+        return ' & '.join(terms[:-1] + [f'{terms[-1]}:*'])
+
+
+class ScanSearchBackend(SearchBackend):
+    """Unindexed fallback: a substring scan over the user's messages, newest first."""
+
+    def search(self, user, terms, thread_id=None, after=None, reverse=False, limit=20):
+        if self.model is Message:
+            queryset = Message.objects.filter(thread__participants=user)
+        else:
+            queryset = self.model.objects.filter(thread_id__in=user_thread_ids(user))
+        queryset = queryset.annotate(rank=Value(0.0, output_field=FloatField()))
+        for term in terms:
+            queryset = queryset.filter(text__icontains=term)
+        if thread_id is not None:
+            queryset = queryset.filter(thread_id=thread_id)
+        if after is not None:
+            queryset = queryset.filter(**{'id__gt' if reverse else 'id__lt': after['id']})
+        return queryset.order_by('id' if reverse else '-id')[:limit]
+
+
+_index_available = {}
+
+
+def get_backend(model=Message):
+    """Pick the backend for the database holding ``model``, checking once that its index exists."""
+    db = connections[router.db_for_read(model)]
+    key = (db.alias, model._meta.db_table)
+    if key not in _index_available:
+        if db.vendor == 'sqlite':
+            with db.cursor() as cursor:
+                cursor.execute("SELECT 1 FROM sqlite_master WHERE name = %s", [f'{key[1]}_fts'])
+                _index_available[key] = cursor.fetchone() is not None
+        else:
+            _index_available[key] = db.vendor == 'postgresql'
+    if not _index_available[key]:
+        return ScanSearchBackend(model)
+    return SQLiteSearchBackend(model) if db.vendor == 'sqlite' else PostgresSearchBackend(model)
+
+
+class SearchPagination(KeysetPagination):
+    """Keyset pages over search hits, best match first.
+
+    Hits from the hot table come first, then those from the archive: the
+    archive is only searched once the cursor runs past the last hot hit.
+    ``archived`` in the cursor tells the two apart.
+    """
+
+    ordering = ('archived', 'rank', '-id')
+
+    def paginate_search(self, backends, user, terms, request, thread_id=None):
+        """Search ``backends`` in turn (hot table first) for one page."""
+        self.request = request
+        self.fields = [(name.lstrip('-'), name.startswith('-')) for name in self.ordering]
+        self.offset_paginator = None
+        self.page_size = self.get_page_size(request)
+        self.position, self.reverse = self.decode_cursor(request, Message)
+        limit = self.page_size + 1
+
+        tiers = list(enumerate(backends))
+        if self.reverse:
+            tiers.reverse()
+        rows = []
+        for tier, backend in tiers:
+            after = None
+            if self.position is not None:
+                if tier == self.position['archived']:
+                    after = self.position
+                elif (tier < self.position['archived']) != self.reverse:
+                    continue
+            found = list(backend.search(user, terms, thread_id, after, self.reverse, limit - len(rows)))
+            for row in found:
+                row.archived = tier
+            rows += found
+            if len(rows) >= limit:
+                break
+        return self.set_page(rows)
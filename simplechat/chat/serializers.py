@@ -1,34 +1,122 @@
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.db.models import Exists, OuterRef
 from rest_framework import serializers
+from .metrics import TimedListSerializer, TimedSerializerMixin
 from .models import Thread, Message
 from django.contrib.auth import get_user_model
 
 User = get_user_model()
 
-class ThreadSerializer(serializers.ModelSerializer):
+class ThreadSerializer(TimedSerializerMixin, serializers.ModelSerializer):
     participants = serializers.PrimaryKeyRelatedField(many=True, queryset=User.objects.all())
 
     class Meta:
         model = Thread
-        fields = ['id', 'participants', 'created', 'updated']
+        fields = ['id', 'participants', 'is_group', 'name', 'created', 'updated']
+        read_only_fields = ['is_group', 'name']
+        list_serializer_class = TimedListSerializer
 
     def validate_participants(self, value):
-        if len(value) != 2:
+        if self.instance is not None and self.instance.is_group:
+            raise serializers.ValidationError("Group members change through the members and leave actions.")
+        if len(set(value)) != 2:
             raise serializers.ValidationError("A thread must have exactly 2 participants.")
         return value
 
+    def create(self, validated_data):
+        participants = validated_data.pop('participants')
+        low, high = Thread.pair_key(*(user.id for user in participants))
+        # The unique pair constraint makes a concurrent duplicate fail here.
+        with transaction.atomic():
+            thread = Thread.objects.create(user_low_id=low, user_high_id=high, **validated_data)
+            thread.participants.set(participants)
+        return thread
 
-class MessageSerializer(serializers.ModelSerializer):
-    sender = serializers.ReadOnlyField(source='sender.id')
+    def update(self, instance, validated_data):
+        participants = validated_data.pop('participants', None)
+        try:
+            with transaction.atomic():
+                instance = super().update(instance, validated_data)
+                if participants is not None:
+                    # Moving the pair key onto another thread's pair fails on the unique constraint.
+                    instance.participants.set(participants)
+        except IntegrityError:
+            raise serializers.ValidationError({'participants': ["A thread with these participants already exists."]})
+        return instance
+
+
+class GroupThreadSerializer(serializers.ModelSerializer):
+    """Creates a group; the requesting user becomes a member along with ``participants``."""
+
+    participants = serializers.PrimaryKeyRelatedField(many=True, queryset=User.objects.all())
+
+    class Meta:
+        model = Thread
+        fields = ['id', 'participants', 'name']
+
+    def validate_participants(self, value):
+        members = set(value) | {self.context['request'].user}
+        if len(members) < 2:
+            raise serializers.ValidationError("A group needs at least one other member.")
+        if len(members) > settings.CHAT_GROUP_MAX_MEMBERS:
+            raise serializers.ValidationError(
+                f"A group cannot have more than {settings.CHAT_GROUP_MAX_MEMBERS} members."
+            )
+        return list(members)
+
+    def create(self, validated_data):
+        participants = validated_data.pop('participants')
+        with transaction.atomic():
+            thread = Thread.objects.create(is_group=True, **validated_data)
+            thread.participants.set(participants)
+        return thread
+
+
+class GroupMembersSerializer(serializers.Serializer):
+    users = serializers.PrimaryKeyRelatedField(many=True, queryset=User.objects.all(), allow_empty=False)
+
+
+class MuteSerializer(serializers.Serializer):
+    muted = serializers.BooleanField()
+
+
+def with_participation(queryset, user):
+    """Annotate threads with ``is_participant`` for ``user`` in the same query."""
+    membership = Thread.participants.through.objects.filter(thread=OuterRef('pk'), user=user)
+    return queryset.annotate(is_participant=Exists(membership))
+
+
+class ParticipantThreadField(serializers.PrimaryKeyRelatedField):
+    """Thread lookup that also tells whether the requesting user participates."""
+
+    def get_queryset(self):
+        queryset = Thread.objects.all()
+        request = self.context.get('request')
+        if request and request.user and request.user.is_authenticated:
+            queryset = with_participation(queryset, request.user)
+        return queryset
+
+
+class MessageSerializer(TimedSerializerMixin, serializers.ModelSerializer):
+    sender = serializers.ReadOnlyField(source='sender_id')
+    thread = ParticipantThreadField()
 
     class Meta:
         model = Message
         fields = ['id', 'thread', 'sender', 'text', 'created', 'is_read']
+        list_serializer_class = TimedListSerializer
 
     def validate_thread(self, value):
         """Ensure the current user is a participant in the thread"""
+        if self.instance is not None and value.pk != self.instance.thread_id:
+            raise serializers.ValidationError("A message cannot be moved to another thread.")
         request = self.context.get('request')
         if request and request.user:
-            if not value.participants.filter(id=request.user.id).exists():
+            is_participant = getattr(value, 'is_participant', None)
+            if is_participant is None:
+                is_participant = value.participants.filter(id=request.user.id).exists()
+            if not is_participant:
                 raise serializers.ValidationError("You are not a participant in this thread.")
         return value
 
@@ -36,4 +124,157 @@ class MessageSerializer(serializers.ModelSerializer):
         """Ensure text is not empty"""
         if not value or not value.strip():
             raise serializers.ValidationError("Text field is required and cannot be empty.")
-        return value
\ No newline at end of file
+        return value
+
+
+class BulkMessageSerializer(serializers.Serializer):
+    """One item of a bulk send; thread membership is checked by the view."""
+
+    thread = serializers.IntegerField(min_value=1)
+    text = serializers.CharField()
+
+    validate_text = MessageSerializer.validate_text
+
+
+class ParticipantSerializer(serializers.ModelSerializer):
+
+    class Meta:
+        model = User
+        fields = ['id', 'username']
+
+
+class InboxThreadSerializer(TimedSerializerMixin, serializers.ModelSerializer):
+    """Read-only thread row for the inbox, with its newest message and unread count."""
+
+    participants = ParticipantSerializer(many=True, read_only=True)
+    last_message = MessageSerializer(read_only=True)
+    unread_count = serializers.IntegerField(read_only=True)
+
+    class Meta:
+        model = Thread
+        fields = ['id', 'participants', 'is_group', 'name', 'created', 'updated', 'last_message', 'unread_count']
+        list_serializer_class = TimedListSerializer
+
+
+class ReadWatermarkSerializer(serializers.Serializer):
+    up_to_id = serializers.IntegerField(required=False, min_value=1)
+    up_to = serializers.DateTimeField(required=False)
+
+
+class MessageIdsSerializer(serializers.Serializer):
+    ids = serializers.ListField(
+        child=serializers.IntegerField(min_value=1), allow_empty=False, max_length=1000
+    )
+
+
+class RowSerializer:
+    """Read-only serializer for rows fetched with ``queryset.values()``.
+
+    The list endpoints use these instead of ModelSerializers, which spend
+    most of a large page's CPU time in per-field machinery. ``rows()``
+    narrows a queryset to ``columns``; ``.data`` builds the same output as
+    the ModelSerializer each subclass mirrors, with plain dict lookups.
+    """
+
+    columns = ()
+    datetime_field = serializers.DateTimeField(read_only=True)
+
+    def __init__(self, instance=None, many=False, context=None):
+        self.instance = instance
+        self.many = many
+        self.context = context or {}
+
+    @classmethod
+    def rows(cls, queryset):
+        return queryset.prefetch_related(None).values(*cls.columns)
+
+    def prepare(self, rows):
+        """Load whatever the rows need from other tables, in bulk."""
+
+    def to_representation(self, row):
+        raise NotImplementedError
+
+    @property
+    def data(self):
+        rows = list(self.instance) if self.many else [self.instance]
+        self.prepare(rows)
+        data = [self.to_representation(row) for row in rows]
+        return data if self.many else data[0]
+
+
+class MessageRowSerializer(TimedSerializerMixin, RowSerializer):
+    """Fast read path of MessageSerializer; also used for archived messages."""
+
+    columns = ('id', 'thread_id', 'sender_id', 'text', 'created', 'is_read')
+
+    def to_representation(self, row):
+        return {
+            'id': row['id'],
+            'thread': row['thread_id'],
+            'sender': row['sender_id'],
+            'text': row['text'],
+            'created': self.datetime_field.to_representation(row['created']),
+            'is_read': row['is_read'],
+        }
+
+
+class ThreadRowSerializer(TimedSerializerMixin, RowSerializer):
+    """Fast read path of ThreadSerializer."""
+
+    columns = ('id', 'is_group', 'name', 'created', 'updated')
+
+    def prepare(self, rows):
+        self.participants = {}
+        members = Thread.participants.through.objects.filter(thread_id__in=[row['id'] for row in rows])
+        for thread_id, user_id in members.order_by('user_id').values_list('thread_id', 'user_id'):
+            self.participants.setdefault(thread_id, []).append(user_id)
+
+    def to_representation(self, row):
+        return {
+            'id': row['id'],
+            'participants': self.participants.get(row['id'], []),
+            'is_group': row['is_group'],
+            'name': row['name'],
+            'created': self.datetime_field.to_representation(row['created']),
+            'updated': self.datetime_field.to_representation(row['updated']),
+        }
+
+
+class InboxRowSerializer(TimedSerializerMixin, RowSerializer):
+    """Fast read path of InboxThreadSerializer, for querysets from ``thread_queryset(inbox=True)``."""
+
+    columns = (
+        'id', 'is_group', 'name', 'created', 'updated', 'unread_count', 'last_message_id',
+        'last_message__thread_id', 'last_message__sender_id', 'last_message__text', 'last_message__created',
+        'last_message__is_read',
+    )
+
+    def prepare(self, rows):
+        self.participants = {}
+        members = Thread.participants.through.objects.filter(thread_id__in=[row['id'] for row in rows])
+        for thread_id, user_id, username in members.order_by('user_id').values_list(
+            'thread_id', 'user_id', 'user__username',
+        ):
+            self.participants.setdefault(thread_id, []).append({'id': user_id, 'username': username})
+
+    def to_representation(self, row):
+        last_message = None
+        if row['last_message_id'] is not None:
+            last_message = {
+                'id': row['last_message_id'],
+                'thread': row['last_message__thread_id'],
+                'sender': row['last_message__sender_id'],
+                'text': row['last_message__text'],
+                'created': self.datetime_field.to_representation(row['last_message__created']),
+                'is_read': row['last_message__is_read'],
+            }
+        return {
+            'id': row['id'],
+            'participants': self.participants.get(row['id'], []),
+            'is_group': row['is_group'],
+            'name': row['name'],
+            'created': self.datetime_field.to_representation(row['created']),
+            'updated': self.datetime_field.to_representation(row['updated']),
+            'last_message': last_message,
+            'unread_count': row['unread_count'],
+        }
@@ -0,0 +1,103 @@
+from django.contrib.auth import get_user_model
+from django.db import connections
+from django.db.migrations.recorder import MigrationRecorder
+from django.db.models import OuterRef, Subquery
+from django.db.models.signals import m2m_changed, post_delete, post_save, pre_delete
+from django.dispatch import receiver
+
+from . import caching, events, search
+from .authentication import invalidate_cached_user
+from .models import ArchivedMessage, Message, Thread, UnreadCounter
+
+
+@receiver(m2m_changed, sender=Thread.participants.through)
+def sync_thread_participants(sender, instance, action, reverse, pk_set, **kwargs):
+    """Keep the pair key and unread counters in step with the participants."""
+    if action == 'pre_clear' and reverse:
+        # pk_set is not provided on clear, so remember the affected threads.
+        instance._cleared_thread_ids = list(instance.threads.values_list('id', flat=True))
+        return
+    if action not in ('post_add', 'post_remove', 'post_clear'):
+        return
+
+    if not reverse:
+        threads = [instance]
+    elif action == 'post_clear':
+        threads = Thread.objects.filter(pk__in=getattr(instance, '_cleared_thread_ids', []))
+    else:
+        threads = Thread.objects.filter(pk__in=pk_set or [])
+
+    # Removed participants are no longer found through the threads.
+    resync_threads(threads, removed_user_ids=[instance.pk] if reverse else pk_set or [])
+
+
+def resync_threads(threads, removed_user_ids=()):
+    """Bring pair keys, unread counters and page caches in line with the threads' members."""
+    thread_ids = []
+    for thread in threads:
+        thread.sync_pair_key()
+        thread_ids.append(thread.pk)
+    UnreadCounter.objects.rebuild(thread_ids=thread_ids)
+
+    caching.invalidate_threads(thread_ids)
+    caching.invalidate_users(removed_user_ids)
+
+
+@receiver(post_save, sender=Message)
+def sync_loaded_message(sender, instance, raw, **kwargs):
+    """Fixture loading bypasses Message.save(); refresh the derived thread state."""
+    if not raw:
+        return
+    UnreadCounter.objects.rebuild(thread_ids=[instance.thread_id])
+    latest = Message.objects.filter(thread=OuterRef('pk')).order_by('-created', '-id')
+    Thread.objects.filter(pk=instance.thread_id).update(last_message=Subquery(latest.values('pk')[:1]))
+
+
+@receiver(post_save, sender=Message)
+def publish_new_message(sender, instance, created, raw, **kwargs):
+    if created and not raw:
+        events.messages_created([instance])
+
+
+@receiver(post_save, sender=get_user_model())
+@receiver(post_delete, sender=get_user_model())
+def drop_cached_user(sender, instance, **kwargs):
+    """Deactivation or a password change must not be served from the auth cache."""
+    invalidate_cached_user(instance.pk)
+    if kwargs.get('created'):
+        # Ids can be reused, so a new user never inherits cached pages.
+        caching.invalidate_users([instance.pk])
+
+
+@receiver(post_save, sender=Message)
+def invalidate_message_pages(sender, instance, **kwargs):
+    if Message.thread.is_cached(instance):
+        caching.invalidate_thread(instance.thread)
+    else:
+        caching.invalidate_threads([instance.thread_id])
+    moved_from = instance.__dict__.pop('_moved_from_thread_id', None)
+    if moved_from is not None:
+        caching.invalidate_threads([moved_from])
+
+
+@receiver(post_save, sender=Thread)
+@receiver(pre_delete, sender=Thread)
+def invalidate_thread_pages(sender, instance, **kwargs):
+    # pre_delete, because the participant rows are gone after deletion.
+    caching.invalidate_threads([instance.pk])
+
+
+@receiver(post_delete, sender=Thread)
+@receiver(post_delete, sender=get_user_model())
+def drop_archived_messages(sender, instance, **kwargs):
+    """Archive rows have no foreign key constraints; delete them with their thread or sender."""
+    field = 'thread_id' if sender is Thread else 'sender_id'
+    ArchivedMessage.objects.filter(**{field: instance.pk}).delete()
+
+
+def ensure_search_index(using, **kwargs):
+    """Connected to post_migrate: recreate search triggers dropped by a table rebuild."""
+    db = connections[using]
+    applied = MigrationRecorder(db).applied_migrations()
+    if ('chat', '0007_message_search_index') in applied:
+        search.install_index(db)
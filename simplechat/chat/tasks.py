@@ -0,0 +1,106 @@
+import logging
+import traceback
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F, Q
+from django.utils import timezone
+
+from .models import Task
+
+logger = logging.getLogger('chat.tasks')
+
+_handlers = {}
+
+
+def handler(event):
+    """Register a function run for ``event``; it receives a list of payloads.
+
+    Handlers must tolerate seeing a payload twice: a task whose worker dies
+    mid-batch is run again once its lease expires.
+    """
+    def register(function):
+        _handlers.setdefault(event, []).append(function)
+        return function
+    return register
+
+
+def dispatch(event, payload, key=None):
+    """Run the handlers of ``event`` after the current transaction commits.
+
+    With ``CHAT_TASKS_MODE = 'queue'`` only a Task row is written, in the
+    caller's transaction, and ``chat_worker`` runs the handlers later. With
+    ``'inline'`` they run in-process on commit.
+    """
+    if settings.CHAT_TASKS_MODE == 'queue':
+        Task.objects.bulk_create([Task(event=event, payload=payload, key=key)], ignore_conflicts=key is not None)
+    else:
+        transaction.on_commit(lambda: run_handlers(event, [payload]))
+
+
+def run_handlers(event, payloads):
+    for function in _handlers.get(event, ()):
+        function(payloads)
+
+
+def claim(batch_size):
+    """Lease up to ``batch_size`` due tasks, oldest first."""
+    now = timezone.now()
+    due = Q(status=Task.PENDING, run_after__lte=now) | Q(status=Task.RUNNING, locked_until__lt=now)
+    with transaction.atomic():
+        ids = list(
+            Task.objects.select_for_update(skip_locked=True).filter(due).order_by('id')
+            .values_list('id', flat=True)[:batch_size]
+        )
+        Task.objects.filter(id__in=ids).update(
+            status=Task.RUNNING, attempts=F('attempts') + 1,
+            locked_until=now + timedelta(seconds=settings.CHAT_TASKS_LEASE_SECONDS),
+        )
+    return list(Task.objects.filter(id__in=ids).order_by('id'))
+
+
+def run_batch(batch_size=100):
+    """Claim and run one batch of tasks; return how many were claimed.
+
+    Tasks of the same event go to their handlers together. If that fails,
+    they are run one at a time so that only the failing ones are retried,
+    with exponential backoff, up to ``CHAT_TASKS_MAX_ATTEMPTS`` attempts.
+    """
+    tasks = claim(batch_size)
+    per_event = {}
+    for task in tasks:
+        per_event.setdefault(task.event, []).append(task)
+
+    done, failed = [], []
+    for event, event_tasks in per_event.items():
+        try:
+            run_handlers(event, [task.payload for task in event_tasks])
+            done += event_tasks
+        except Exception:
+            if len(event_tasks) == 1:
+                failed.append((event_tasks[0], traceback.format_exc()))
+                continue
+            for task in event_tasks:
+                try:
+                    run_handlers(event, [task.payload])
+                    done.append(task)
+                except Exception:
+                    failed.append((task, traceback.format_exc()))
+
+    now = timezone.now()
+    Task.objects.filter(id__in=[task.id for task in done]).update(status=Task.DONE, finished=now, locked_until=None)
+    for task, error in failed:
+        logger.warning("Task %s (%s) failed on attempt %s:\n%s", task.id, task.event, task.attempts, error)
+        if task.attempts >= settings.CHAT_TASKS_MAX_ATTEMPTS:
+            values = {'status': Task.FAILED, 'finished': now}
+        else:
+            values = {'status': Task.PENDING, 'run_after': now + timedelta(seconds=2 ** task.attempts)}
+        Task.objects.filter(id=task.id).update(last_error=error, locked_until=None, **values)
+    return len(tasks)
+
+
+def prune(older_than):
+    """Delete finished tasks older than ``older_than``; their keys can then be reused."""
+    cutoff = timezone.now() - older_than
+    return Task.objects.filter(status=Task.DONE, finished__lt=cutoff).delete()[0]
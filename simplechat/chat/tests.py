@@ -1,11 +1,62 @@
+import gzip
+import json
+import os
+import tempfile
+from datetime import timedelta
+from io import StringIO
+from unittest import mock
+
+from asgiref.sync import async_to_sync, sync_to_async
+from asgiref.testing import ApplicationCommunicator
+import msgpack
 from django.contrib.auth import get_user_model
+from django.conf import settings
+from django.core.management import CommandError, call_command
+from django.db import IntegrityError, connection, connections, transaction
+from django.http import HttpResponse
+from django.test import RequestFactory, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
 from rest_framework.test import APITestCase, APIClient
-from .models import Thread, Message
+from .archive import HORIZON_KEY
+from .async_views import MessageStreamView, decode_since, encode_since
+from .broker import InProcessBroker
+from .caching import get_cache, get_generation
+from .checks import check_task_broker
+from .export import encode_lines, export_lines
+from .metrics import REGISTRY
+from .renderers import epoch_ms
+from .models import ArchivedMessage, Membership, Task, Thread, Message, UnreadCounter
+from .routers import ReplicaRouter, is_sticky, reading_from
+from .tasks import dispatch, run_batch
+from .throttling import CacheBucketStore, ConcurrencyLimitMiddleware, LocalBucketStore
+from .serializers import (
+    InboxRowSerializer, InboxThreadSerializer, MessageRowSerializer, MessageSerializer, ThreadRowSerializer,
+    ThreadSerializer,
+)
+from .search import ScanSearchBackend, SQLiteSearchBackend, get_backend
+from .views import message_queryset, thread_queryset
+from .websocket import CLOSE_UNAUTHORIZED, ChatSocket
 from rest_framework import status
 from rest_framework_simplejwt.tokens import RefreshToken
 
 User = get_user_model()
 
+
+class QueryBudgetMixin:
+    """Assertions that keep per-endpoint query counts from regressing."""
+
+    def assertQueryBudget(self, budget, client, method, url, data=None):
+        with CaptureQueriesContext(connection) as queries:
+            response = getattr(client, method)(url, data, format='json')
+        sql = '\n'.join(query['sql'] for query in queries.captured_queries)
+        self.assertLessEqual(
+            len(queries), budget,
+            f"{method.upper()} {url} ran {len(queries)} queries (budget {budget}):\n{sql}"
+        )
+        return response
+
+
 class ChatAPITest(APITestCase):
     def setUp(self):
         self.alice = User.objects.create_user(username='alice', password='test1234')
@@ -42,6 +93,52 @@ class ChatAPITest(APITestCase):
         response = self.client_alice.post('/chat/threads/', {"participants": [self.alice.id]})
         self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
 
+    def test_update_onto_an_existing_pair_is_rejected(self):
+        carol = User.objects.create_user(username='carol', password='test1234')
+        other = Thread.objects.create()
+        other.participants.set([self.alice, carol])
+        res = self.client_alice.put(f'/chat/threads/{other.id}/', {"participants": [self.alice.id, self.bob.id]}, format='json')
+        self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn('participants', res.data)
+        other.refresh_from_db()
+        self.assertEqual((other.user_low_id, other.user_high_id), Thread.pair_key(self.alice.id, carol.id))
+        self.assertEqual(set(other.participants.values_list('id', flat=True)), {self.alice.id, carol.id})
+
+    def test_message_cannot_move_to_another_thread(self):
+        carol = User.objects.create_user(username='carol', password='test1234')
+        other = Thread.objects.create()
+        other.participants.set([self.alice, carol])
+        res = self.client_alice.put(
+            f'/chat/messages/{self.message.id}/', {"thread": other.id, "text": "куди?"}, format='json'
+        )
+        self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(Message.objects.get(pk=self.message.id).thread_id, self.thread.id)
+
+    def test_moving_a_message_moves_its_unread_count(self):
+        carol = User.objects.create_user(username='carol', password='test1234')
+        other = Thread.objects.create()
+        other.participants.set([self.alice, carol])
+        message = Message.objects.get(pk=self.message.id)
+        message.thread = other
+        message.save()
+        self.assertEqual(UnreadCounter.objects.total_for(self.bob), 0)
+        self.assertEqual(UnreadCounter.objects.total_for(carol), 1)
+        self.assertEqual(UnreadCounter.objects.rebuild(), 0)
+
+    def test_moving_a_message_repoints_last_messages(self):
+        carol = User.objects.create_user(username='carol', password='test1234')
+        other = Thread.objects.create()
+        other.participants.set([self.alice, carol])
+        earlier = Message.objects.create(thread=self.thread, sender=self.bob, text="раніше")
+        Message.objects.filter(pk=earlier.pk).update(created=self.message.created - timedelta(minutes=1))
+        message = Message.objects.get(pk=self.message.id)
+        message.thread = other
+        message.save()
+        self.thread.refresh_from_db()
+        other.refresh_from_db()
+        self.assertEqual(self.thread.last_message_id, earlier.id)
+        self.assertEqual(other.last_message_id, message.id)
+
     def test_create_message(self):
         response = self.client_alice.post('/chat/messages/', {
             "thread": self.thread.id,
@@ -92,7 +189,7 @@ class ChatAPITest(APITestCase):
 
         res = client_charlie.get('/chat/messages/')
         self.assertEqual(res.status_code, status.HTTP_200_OK)
-        self.assertEqual(res.data['count'], 0)
+        self.assertEqual(res.data['results'], [])
         res = client_charlie.post('/chat/messages/', {
             "thread": self.thread.id,
             "text": "Привіт від чужака"
@@ -127,3 +224,1270 @@ class ChatAPITest(APITestCase):
         })
         self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
 
+    def test_pair_key_synced_from_participants(self):
+        self.thread.refresh_from_db()
+        self.assertEqual(
+            (self.thread.user_low_id, self.thread.user_high_id),
+            Thread.pair_key(self.alice.id, self.bob.id)
+        )
+
+    def test_create_thread_returns_existing_pair(self):
+        res = self.client_alice.post(
+            '/chat/threads/', {"participants": [self.bob.id, self.alice.id]}, format='json'
+        )
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual(res.data['id'], self.thread.id)
+        self.assertEqual(Thread.objects.count(), 1)
+
+    def test_create_thread_new_pair(self):
+        charlie = User.objects.create_user(username='charlie', password='test1234')
+        res = self.client_alice.post(
+            '/chat/threads/', {"participants": [charlie.id, self.alice.id]}, format='json'
+        )
+        self.assertEqual(res.status_code, status.HTTP_201_CREATED)
+        thread = Thread.objects.get(id=res.data['id'])
+        self.assertEqual((thread.user_low_id, thread.user_high_id), (self.alice.id, charlie.id))
+
+    def test_duplicate_pair_rejected_by_constraint(self):
+        with self.assertRaises(IntegrityError), transaction.atomic():
+            Thread.objects.create(user_low=self.alice, user_high=self.bob)
+
+    def test_unread_counter_tracks_messages(self):
+        counter = UnreadCounter.objects.get(user=self.bob, thread=self.thread)
+        self.assertEqual(counter.count, 1)
+        self.assertFalse(UnreadCounter.objects.get(user=self.alice, thread=self.thread).count)
+
+        self.client_bob.post(f'/chat/messages/{self.message.id}/mark_as_read/')
+        counter.refresh_from_db()
+        self.assertEqual(counter.count, 0)
+
+        Message.objects.create(thread=self.thread, sender=self.alice, text="ще")
+        self.assertEqual(UnreadCounter.objects.total_for(self.bob), 1)
+        Message.objects.filter(thread=self.thread, is_read=False).get().delete()
+        self.assertEqual(UnreadCounter.objects.total_for(self.bob), 0)
+
+    def test_unread_count_single_query(self):
+        # One query for the JWT user lookup, one for the counter sum.
+        with self.assertNumQueries(2):
+            response = self.client_bob.get('/chat/messages/unread/')
+        self.assertEqual(response.data['unread_count'], 1)
+
+    def test_rebuild_unread_counters_command(self):
+        UnreadCounter.objects.filter(user=self.bob).update(count=7)
+        UnreadCounter.objects.filter(user=self.alice).delete()
+        out = StringIO()
+        call_command('rebuild_unread_counters', stdout=out)
+        self.assertIn('Repaired 2', out.getvalue())
+        self.assertEqual(UnreadCounter.objects.get(user=self.bob).count, 1)
+        self.assertEqual(UnreadCounter.objects.get(user=self.alice).count, 0)
+
+    def test_thread_read_watermark(self):
+        later = [
+            Message.objects.create(thread=self.thread, sender=self.alice, text=f"msg {i}")
+            for i in range(3)
+        ]
+        res = self.client_bob.post(
+            f'/chat/threads/{self.thread.id}/read/', {"up_to_id": later[1].id}, format='json'
+        )
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual(res.data['updated'], 3)
+        counter = UnreadCounter.objects.get(user=self.bob, thread=self.thread)
+        self.assertEqual(counter.count, 1)
+        self.assertFalse(Message.objects.get(id=later[2].id).is_read)
+
+        res = self.client_bob.post(f'/chat/threads/{self.thread.id}/read/', {}, format='json')
+        self.assertEqual(res.data['updated'], 1)
+        self.assertEqual(UnreadCounter.objects.total_for(self.bob), 0)
+
+    def test_thread_read_skips_own_messages(self):
+        res = self.client_alice.post(f'/chat/threads/{self.thread.id}/read/', {}, format='json')
+        self.assertEqual(res.data['updated'], 0)
+        self.assertFalse(Message.objects.get(id=self.message.id).is_read)
+
+    def test_bulk_mark_as_read(self):
+        extra = Message.objects.create(thread=self.thread, sender=self.alice, text="ще одне")
+        own = Message.objects.create(thread=self.thread, sender=self.bob, text="моє")
+        res = self.client_bob.post(
+            '/chat/messages/read/', {"ids": [self.message.id, extra.id, own.id, 999]}, format='json'
+        )
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual(res.data['updated'], 2)
+        self.assertEqual(UnreadCounter.objects.total_for(self.bob), 0)
+        self.assertEqual(UnreadCounter.objects.total_for(self.alice), 1)
+
+    def test_bulk_mark_as_read_requires_ids(self):
+        res = self.client_bob.post('/chat/messages/read/', {"ids": []}, format='json')
+        self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_non_ascii_digit_thread_filter(self):
+        for url in ('/chat/messages/?thread=²', '/chat/async/messages/?thread=٣'):
+            with self.subTest(url=url):
+                res = self.client_alice.get(url)
+                self.assertEqual(res.status_code, status.HTTP_200_OK)
+                self.assertEqual(res.json()['results'], [])
+        res = self.client_alice.get('/chat/messages/search/?q=hi&thread=²')
+        self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_cursor_pagination_on_messages(self):
+        for i in range(4):
+            Message.objects.create(thread=self.thread, sender=self.bob, text=f"test msg {i}")
+        expected = list(Message.objects.order_by('-created', '-id').values_list('id', flat=True))
+
+        with CaptureQueriesContext(connection) as queries:
+            res = self.client_alice.get(f'/chat/messages/?thread={self.thread.id}&limit=2')
+        self.assertNotIn('count', res.data)
+        self.assertFalse(any('COUNT(' in query['sql'] for query in queries.captured_queries))
+        self.assertIsNone(res.data['previous'])
+        seen = [message['id'] for message in res.data['results']]
+
+        while res.data['next']:
+            res = self.client_alice.get(res.data['next'])
+            seen += [message['id'] for message in res.data['results']]
+        self.assertEqual(seen, expected)
+
+        res = self.client_alice.get(res.data['previous'])
+        self.assertEqual([message['id'] for message in res.data['results']], expected[2:4])
+
+    def test_invalid_cursor(self):
+        res = self.client_alice.get('/chat/messages/?cursor=not-a-cursor')
+        self.assertEqual(res.status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_offset_pagination_flag(self):
+        res = self.client_alice.get('/chat/messages/?offset=0')
+        self.assertEqual(res.data['count'], 1)
+
+    def test_inbox_lists_last_message_and_unread(self):
+        charlie = User.objects.create_user(username='charlie', password='test1234')
+        other = Thread.objects.create()
+        other.participants.set([self.bob, charlie])
+        latest = Message.objects.create(thread=other, sender=charlie, text="новий тред")
+
+        res = self.client_bob.get('/chat/threads/?view=inbox')
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        rows = res.data['results']
+        self.assertEqual([row['id'] for row in rows], [other.id, self.thread.id])
+        self.assertEqual(rows[0]['last_message']['id'], latest.id)
+        self.assertEqual(rows[0]['unread_count'], 1)
+        self.assertEqual(
+            sorted(p['username'] for p in rows[1]['participants']), ['alice', 'bob']
+        )
+        self.assertEqual(rows[1]['last_message']['text'], self.message.text)
+
+    def test_inbox_query_count_is_constant(self):
+        self.client_bob.get('/chat/messages/unread/')  # warm the auth cache
+        with CaptureQueriesContext(connection) as single:
+            self.client_bob.get('/chat/threads/?view=inbox')
+        for i in range(3):
+            user = User.objects.create_user(username=f'user{i}', password='test1234')
+            thread = Thread.objects.create()
+            thread.participants.set([self.bob, user])
+            Message.objects.create(thread=thread, sender=user, text="hi")
+        with CaptureQueriesContext(connection) as many:
+            res = self.client_bob.get('/chat/threads/?view=inbox')
+        self.assertEqual(len(res.data['results']), 4)
+        self.assertEqual(len(single), len(many))
+
+    def test_deleting_last_message_moves_pointer(self):
+        newer = Message.objects.create(thread=self.thread, sender=self.bob, text="остання")
+        self.thread.refresh_from_db()
+        self.assertEqual(self.thread.last_message_id, newer.id)
+        newer.delete()
+        self.thread.refresh_from_db()
+        self.assertEqual(self.thread.last_message_id, self.message.id)
+
+    def test_bulk_send_reports_each_item(self):
+        charlie = User.objects.create_user(username='charlie', password='test1234')
+        foreign = Thread.objects.create()
+        foreign.participants.set([self.bob, charlie])
+        payload = [
+            {"thread": self.thread.id, "text": "перше"},
+            {"thread": foreign.id, "text": "not mine"},
+            {"thread": self.thread.id, "text": "   "},
+            {"thread": 999999, "text": "nowhere"},
+            {"thread": self.thread.id, "text": "друге"},
+        ]
+        res = self.client_alice.post('/chat/messages/bulk/', payload, format='json')
+        self.assertEqual(res.status_code, status.HTTP_207_MULTI_STATUS)
+        self.assertEqual((res.data['created'], res.data['failed']), (2, 3))
+        self.assertEqual([item['status'] for item in res.data['results']], [201, 400, 400, 400, 201])
+        self.assertIn('thread', res.data['results'][1]['errors'])
+        self.assertIn('text', res.data['results'][2]['errors'])
+
+        last = res.data['results'][4]['message']
+        self.thread.refresh_from_db()
+        self.assertEqual(self.thread.last_message_id, last['id'])
+        self.assertEqual(last['sender'], self.alice.id)
+        self.assertEqual(UnreadCounter.objects.get(user=self.bob, thread=self.thread).count, 3)
+        self.assertFalse(Message.objects.filter(thread=foreign).exists())
+
+    def test_export_streams_json_lines_and_resumes(self):
+        for i in range(3):
+            Message.objects.create(thread=self.thread, sender=self.bob, text=f"export {i}")
+        res = self.client_alice.get(f'/chat/threads/{self.thread.id}/export/')
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertTrue(res.streaming)
+        lines = [json.loads(line) for line in b''.join(res.streaming_content).decode().splitlines()]
+        self.assertEqual([line['text'] for line in lines], [self.message.text] + [f"export {i}" for i in range(3)])
+
+        res = self.client_alice.get(f'/chat/threads/{self.thread.id}/export/?gzip=1&after={lines[1]["cursor"]}')
+        self.assertEqual(res['Content-Type'], 'application/gzip')
+        resumed = gzip.decompress(b''.join(res.streaming_content)).decode().splitlines()
+        self.assertEqual([json.loads(line)['id'] for line in resumed], [line['id'] for line in lines[2:]])
+
+    async def test_export_streams_incrementally_under_asgi(self):
+        await sync_to_async(Message.objects.bulk_create)(
+            Message(thread=self.thread, sender=self.bob, text=f"export {i}") for i in range(50)
+        )
+        produced = []
+
+        def lines(*args, **kwargs):
+            for line in export_lines(*args, **kwargs):
+                produced.append(line)
+                yield line
+
+        token = await sync_to_async(lambda: str(RefreshToken.for_user(self.alice).access_token))()
+        with mock.patch('chat.views.export_lines', lines), \
+                mock.patch('chat.views.encode_lines', lambda lines, compress: encode_lines(lines, compress, buffer_size=1)):
+            res = await self.async_client.get(
+                f'/chat/threads/{self.thread.id}/export/', headers={'Authorization': f'Bearer {token}'}
+            )
+            self.assertTrue(res.is_async)
+            chunks = res.streaming_content
+            first = await chunks.__anext__()
+            self.assertEqual(len(produced), 1)
+            rest = [chunk async for chunk in chunks]
+        self.assertEqual(json.loads(first)['text'], self.message.text)
+        self.assertEqual(len(rest), 50)
+
+    def test_export_is_limited_to_participants(self):
+        charlie = User.objects.create_user(username='charlie', password='test1234')
+        client = APIClient()
+        client.force_authenticate(charlie)
+        res = client.get(f'/chat/threads/{self.thread.id}/export/')
+        self.assertEqual(res.status_code, status.HTTP_404_NOT_FOUND)
+        res = self.client_alice.get(f'/chat/threads/{self.thread.id}/export/?after=bogus')
+        self.assertEqual(res.status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_export_chat_command(self):
+        out = StringIO()
+        call_command('export_chat', str(self.thread.id), stdout=out, stderr=StringIO())
+        exported = [json.loads(line) for line in out.getvalue().splitlines()]
+        self.assertEqual([line['id'] for line in exported], [self.message.id])
+        self.assertEqual(exported[0]['sender'], self.alice.id)
+
+    def test_bulk_send_rejects_malformed_body(self):
+        res = self.client_alice.post('/chat/messages/bulk/', {"messages": "hi"}, format='json')
+        self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+        res = self.client_alice.post(
+            '/chat/messages/bulk/', {"messages": [{"thread": self.thread.id, "text": "hi"}] * 1001}, format='json'
+        )
+        self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+
+
+class QueryBudgetTest(QueryBudgetMixin, APITestCase):
+    # Budgets include the JWT user lookup and any savepoints.
+    BUDGETS = {
+        ('get', '/chat/threads/'): 3,
+        ('get', '/chat/threads/?view=inbox'): 3,
+        ('get', '/chat/messages/'): 2,
+        ('get', '/chat/messages/unread/'): 2,
+    }
+
+    def setUp(self):
+        self.alice = User.objects.create_user(username='alice', password='test1234')
+        for i in range(5):
+            friend = User.objects.create_user(username=f'friend{i}', password='test1234')
+            thread = Thread.objects.create()
+            thread.participants.set([self.alice, friend])
+            for j in range(3):
+                Message.objects.create(thread=thread, sender=friend, text=f"msg {j}")
+        self.thread = thread
+        self.client_alice = APIClient()
+        self.client_alice.credentials(
+            HTTP_AUTHORIZATION='Bearer ' + str(RefreshToken.for_user(self.alice).access_token)
+        )
+
+    def test_list_endpoints_within_budget(self):
+        for (method, url), budget in self.BUDGETS.items():
+            with self.subTest(url=url):
+                response = self.assertQueryBudget(budget, self.client_alice, method, url)
+                self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+    def test_create_message_within_budget(self):
+        # auth, thread + membership, savepoint, insert, thread bump, counters, release
+        response = self.assertQueryBudget(
+            7, self.client_alice, 'post', '/chat/messages/', {"thread": self.thread.id, "text": "hi"}
+        )
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+
+    def test_bulk_send_query_count_is_per_thread(self):
+        # auth, membership, savepoint, insert, thread bump, counters, release
+        payload = {"messages": [{"thread": self.thread.id, "text": f"bulk {i}"} for i in range(50)]}
+        response = self.assertQueryBudget(7, self.client_alice, 'post', '/chat/messages/bulk/', payload)
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(response.data['created'], 50)
+
+
+class ChatSocketTest(TestCase):
+    def setUp(self):
+        self.alice = User.objects.create_user(username='alice', password='test1234')
+        self.bob = User.objects.create_user(username='bob', password='test1234')
+        self.thread = Thread.objects.create()
+        self.thread.participants.set([self.alice, self.bob])
+        self.bob_token = str(RefreshToken.for_user(self.bob).access_token)
+
+    def send_message(self, text):
+        with self.captureOnCommitCallbacks(execute=True):
+            return Message.objects.create(thread=self.thread, sender=self.alice, text=text)
+
+    async def connect(self, query_string):
+        communicator = ApplicationCommunicator(
+            ChatSocket(broker=InProcessBroker()),
+            {'type': 'websocket', 'path': '/ws/chat/', 'query_string': query_string, 'headers': []},
+        )
+        await communicator.send_input({'type': 'websocket.connect'})
+        return communicator, await communicator.receive_output(timeout=5)
+
+    async def test_pushes_new_messages(self):
+        communicator, accepted = await self.connect(f'token={self.bob_token}'.encode())
+        self.assertEqual(accepted['type'], 'websocket.accept')
+        broker = communicator.application.broker
+
+        with mock.patch('chat.events.get_broker', return_value=broker):
+            message = await sync_to_async(self.send_message)("привіт")
+        created = json.loads((await communicator.receive_output(timeout=5))['text'])
+        self.assertEqual(created['type'], 'message.created')
+        self.assertEqual(created['message']['id'], message.id)
+        unread = json.loads((await communicator.receive_output(timeout=5))['text'])
+        self.assertEqual(unread, {'type': 'unread.changed', 'unread_count': 1})
+
+        await communicator.send_input({'type': 'websocket.disconnect', 'code': 1000})
+        await communicator.wait(timeout=5)
+        self.assertFalse(broker._subscriptions)
+
+    async def test_rejects_invalid_token(self):
+        communicator, closed = await self.connect(b'token=garbage')
+        self.assertEqual(closed, {'type': 'websocket.close', 'code': CLOSE_UNAUTHORIZED})
+
+
+class MessageStreamTest(APITestCase):
+    def setUp(self):
+        self.alice = User.objects.create_user(username='alice', password='test1234')
+        self.bob = User.objects.create_user(username='bob', password='test1234')
+        self.thread = Thread.objects.create()
+        self.thread.participants.set([self.alice, self.bob])
+        self.first = Message.objects.create(thread=self.thread, sender=self.alice, text="перше")
+        self.client.credentials(
+            HTTP_AUTHORIZATION='Bearer ' + str(RefreshToken.for_user(self.bob).access_token)
+        )
+
+    def test_returns_messages_since_cursor(self):
+        res = self.client.get('/chat/messages/stream/?timeout=0')
+        self.assertEqual(res.json()['results'], [])
+        cursor = res.json()['next']
+
+        second = Message.objects.create(thread=self.thread, sender=self.alice, text="друге")
+        res = self.client.get(f'/chat/messages/stream/?since={cursor}')
+        body = res.json()
+        self.assertEqual([message['id'] for message in body['results']], [second.id])
+        self.assertEqual(decode_since(body['next']), second.id)
+
+    def test_times_out_with_empty_batch(self):
+        res = self.client.get(f'/chat/messages/stream/?since={encode_since(self.first.id)}&timeout=0.05')
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual(res.json(), {'results': [], 'next': encode_since(self.first.id)})
+
+    def test_non_finite_timeout_falls_back_to_default(self):
+        waits = []
+
+        async def wait_for_messages(view, user, since, timeout):
+            waits.append(timeout)
+            return [], since
+
+        with mock.patch.object(MessageStreamView, 'wait_for_messages', wait_for_messages):
+            for value in ('nan', 'inf', '-inf'):
+                res = self.client.get(f'/chat/messages/stream/?since={encode_since(self.first.id)}&timeout={value}')
+                self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual(waits, [MessageStreamView.default_timeout] * 3)
+
+    async def read_stream(self, response):
+        return b''.join([chunk async for chunk in response.streaming_content])
+
+    def test_server_sent_events(self):
+        with mock.patch.object(MessageStreamView, 'max_stream_seconds', 0):
+            res = self.client.get(
+                '/chat/messages/stream/', HTTP_ACCEPT='text/event-stream', HTTP_LAST_EVENT_ID=encode_since(0)
+            )
+            body = async_to_sync(self.read_stream)(res).decode()
+        self.assertEqual(res['Content-Type'], 'text/event-stream')
+        self.assertIn(f'id: {encode_since(self.first.id)}\nevent: messages\n', body)
+
+    def test_requires_authentication(self):
+        self.client.credentials()
+        res = self.client.get('/chat/messages/stream/')
+        self.assertEqual(res.status_code, status.HTTP_401_UNAUTHORIZED)
+
+
+class AsyncViewsTest(APITestCase):
+    def setUp(self):
+        self.alice = User.objects.create_user(username='alice', password='test1234')
+        self.bob = User.objects.create_user(username='bob', password='test1234')
+        self.thread = Thread.objects.create()
+        self.thread.participants.set([self.alice, self.bob])
+        for i in range(3):
+            Message.objects.create(thread=self.thread, sender=self.alice, text=f"msg {i}")
+        self.client.credentials(
+            HTTP_AUTHORIZATION='Bearer ' + str(RefreshToken.for_user(self.bob).access_token)
+        )
+
+    def test_matches_sync_endpoints(self):
+        for sync_url, async_url in [
+            ('/chat/threads/', '/chat/async/threads/'),
+            ('/chat/threads/?view=inbox', '/chat/async/threads/?view=inbox'),
+            ('/chat/messages/?limit=2', '/chat/async/messages/?limit=2'),
+            ('/chat/messages/?offset=1', '/chat/async/messages/?offset=1'),
+            ('/chat/messages/unread/', '/chat/async/messages/unread/'),
+        ]:
+            with self.subTest(url=async_url):
+                expected = self.client.get(sync_url).json()
+                actual = self.client.get(async_url).json()
+                for key in ('next', 'previous'):
+                    if expected.get(key):
+                        expected[key] = expected[key].replace(sync_url.split('?')[0], async_url.split('?')[0])
+                self.assertEqual(actual, expected)
+
+    def test_bad_cursor_is_not_found(self):
+        for url in ('/chat/messages/?cursor=zzz', '/chat/async/messages/?cursor=zzz', '/chat/async/threads/?cursor=abc'):
+            with self.subTest(url=url):
+                res = self.client.get(url)
+                self.assertEqual(res.status_code, status.HTTP_404_NOT_FOUND)
+                self.assertEqual(res.json(), {'detail': 'Invalid cursor'})
+
+    def test_requires_authentication(self):
+        self.client.credentials()
+        for url in ('/chat/async/threads/', '/chat/async/messages/', '/chat/async/messages/unread/'):
+            self.assertEqual(self.client.get(url).status_code, status.HTTP_401_UNAUTHORIZED)
+
+
+class CachedAuthenticationTest(APITestCase):
+    def setUp(self):
+        self.bob = User.objects.create_user(username='bob', password='test1234')
+        self.client.credentials(
+            HTTP_AUTHORIZATION='Bearer ' + str(RefreshToken.for_user(self.bob).access_token)
+        )
+
+    def test_user_lookup_is_cached(self):
+        with self.assertNumQueries(2):
+            self.client.get('/chat/messages/unread/')
+        with self.assertNumQueries(1):
+            res = self.client.get('/chat/messages/unread/')
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+
+    def test_deactivation_invalidates_cache(self):
+        self.client.get('/chat/messages/unread/')
+        self.bob.is_active = False
+        self.bob.save()
+        res = self.client.get('/chat/messages/unread/')
+        self.assertEqual(res.status_code, status.HTTP_401_UNAUTHORIZED)
+
+
+class PageCacheTest(APITestCase):
+    def setUp(self):
+        self.alice = User.objects.create_user(username='alice', password='test1234')
+        self.bob = User.objects.create_user(username='bob', password='test1234')
+        self.carol = User.objects.create_user(username='carol', password='test1234')
+        self.thread = Thread.objects.create()
+        self.thread.participants.set([self.alice, self.bob])
+        Message.objects.create(thread=self.thread, sender=self.alice, text="привіт")
+        self.client_bob = APIClient()
+        self.client_bob.credentials(
+            HTTP_AUTHORIZATION='Bearer ' + str(RefreshToken.for_user(self.bob).access_token)
+        )
+
+    def test_repeated_page_is_served_from_cache(self):
+        first = self.client_bob.get('/chat/messages/')
+        with self.assertNumQueries(0):
+            second = self.client_bob.get('/chat/messages/')
+        self.assertEqual(first.json(), second.json())
+        self.assertEqual(first['ETag'], second['ETag'])
+
+    def test_if_none_match_returns_304(self):
+        etag = self.client_bob.get('/chat/threads/')['ETag']
+        res = self.client_bob.get('/chat/threads/', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(res.status_code, status.HTTP_304_NOT_MODIFIED)
+
+    def test_new_message_invalidates_participants_only(self):
+        etag = self.client_bob.get('/chat/messages/')['ETag']
+        carol_generation = get_generation(self.carol.id)
+
+        Message.objects.create(thread=self.thread, sender=self.alice, text="ще одне")
+        res = self.client_bob.get('/chat/messages/', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual(len(res.json()['results']), 2)
+        self.assertEqual(get_generation(self.carol.id), carol_generation)
+
+    def test_bulk_read_invalidates_inbox(self):
+        self.assertEqual(self.client_bob.get('/chat/threads/?view=inbox').json()['results'][0]['unread_count'], 1)
+        self.client_bob.post(f'/chat/threads/{self.thread.id}/read/', {}, format='json')
+        self.assertEqual(self.client_bob.get('/chat/threads/?view=inbox').json()['results'][0]['unread_count'], 0)
+
+
+class ImportChatTest(TestCase):
+    def write(self, directory, name, content):
+        path = os.path.join(directory, name)
+        with open(path, 'w', encoding='utf-8') as handle:
+            handle.write(content)
+        return path
+
+    def test_import_fixture_derives_thread_state(self):
+        out = StringIO()
+        call_command('import_chat', os.path.join(settings.BASE_DIR, 'fixtures', 'all_data.json'), stdout=out)
+        self.assertIn('Imported 2 user(s), 1 thread(s) and 2 message(s)', out.getvalue())
+
+        thread = Thread.objects.get(pk=1)
+        self.assertEqual((thread.user_low_id, thread.user_high_id), (1, 2))
+        self.assertEqual(thread.last_message_id, 2)
+        self.assertEqual(thread.updated.isoformat(), '2025-06-01T12:02:00+00:00')
+        self.assertEqual(Message.objects.get(pk=1).created.isoformat(), '2025-06-01T12:01:00+00:00')
+        self.assertEqual(UnreadCounter.objects.get(user_id=1).count, 1)
+        self.assertTrue(User.objects.get(pk=1).check_password('test1234'))
+
+    def test_import_csv_and_jsonl(self):
+        with tempfile.TemporaryDirectory() as directory:
+            users = self.write(directory, 'users.csv', 'id,username,password\n1,alice,x\n2,bob,x\n')
+            threads = self.write(directory, 'threads.csv', 'id,participants,created\n7,1 2,2025-06-01T12:00:00Z\n')
+            messages = self.write(directory, 'messages.jsonl', ''.join(
+                json.dumps({"model": "chat.message", "fields": {"thread": 7, "sender": 1, "text": f"m{i}"}}) + '\n'
+                for i in range(5)
+            ))
+            call_command('import_chat', users, threads, messages, '--batch-size', '2', stdout=StringIO())
+        self.assertEqual(Message.objects.filter(thread_id=7).count(), 5)
+        self.assertEqual(UnreadCounter.objects.get(user_id=2, thread_id=7).count, 5)
+
+    def test_dumped_group_thread_round_trips(self):
+        alice, bob, carol = (User.objects.create_user(username=name, password='x') for name in ('alice', 'bob', 'carol'))
+        group = Thread.objects.create(is_group=True, name="Друзі")
+        group.participants.set([alice, bob, carol])
+        Message.objects.create(thread=group, sender=alice, text="привіт")
+        read = Message.objects.create(thread=group, sender=bob, text="як справи")
+        Membership.objects.mark_read(carol.id, group.id, read.id)
+        Message.objects.create(thread=group, sender=alice, text="добре")
+
+        with tempfile.TemporaryDirectory() as directory:
+            dump = os.path.join(directory, 'dump.jsonl')
+            call_command('dumpdata', 'auth.user', 'chat.thread', 'chat.membership', 'chat.message',
+                         format='jsonl', output=dump, verbosity=0)
+            Thread.objects.all().delete()
+            User.objects.all().delete()
+            call_command('import_chat', dump, stdout=StringIO())
+
+        group = Thread.objects.get()
+        self.assertEqual((group.is_group, group.name, group.user_low_id), (True, "Друзі", None))
+        self.assertEqual(group.participants.count(), 3)
+        self.assertEqual(group.last_message.text, "добре")
+        self.assertEqual(UnreadCounter.objects.total_for(User.objects.get(username='carol')), 1)
+        self.assertEqual(UnreadCounter.objects.total_for(User.objects.get(username='bob')), 2)
+
+    def test_import_resets_primary_key_sequences(self):
+        with mock.patch.object(connection.ops, 'sequence_reset_sql', return_value=['SELECT 1']) as reset:
+            call_command('import_chat', os.path.join(settings.BASE_DIR, 'fixtures', 'all_data.json'), stdout=StringIO())
+        self.assertEqual(set(reset.call_args.args[1]), {User, Thread, Message})
+
+    def test_invalid_thread_rolls_back_import(self):
+        with tempfile.TemporaryDirectory() as directory:
+            users = self.write(directory, 'users.csv', 'id,username\n1,alice\n2,bob\n3,carol\n')
+            threads = self.write(directory, 'threads.csv', 'id,participants\n1,1 2 3\n')
+            with self.assertRaisesMessage(CommandError, 'do not have exactly 2 participants: 1'):
+                call_command('import_chat', users, threads, stdout=StringIO())
+        self.assertFalse(User.objects.exists())
+        self.assertFalse(Thread.objects.exists())
+
+
+class MessageSearchTest(APITestCase):
+    def setUp(self):
+        self.alice = User.objects.create_user(username='alice', password='test1234')
+        self.bob = User.objects.create_user(username='bob', password='test1234')
+        self.carol = User.objects.create_user(username='carol', password='test1234')
+        self.thread = Thread.objects.create()
+        self.thread.participants.set([self.alice, self.bob])
+        self.other = Thread.objects.create()
+        self.other.participants.set([self.bob, self.carol])
+        self.client_alice = APIClient()
+        self.client_alice.force_authenticate(self.alice)
+
+    def search(self, query):
+        res = self.client_alice.get('/chat/messages/search/', {'q': query})
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        return [message['id'] for message in res.data['results']]
+
+    def test_index_follows_create_update_and_delete(self):
+        self.assertIsInstance(get_backend(), SQLiteSearchBackend)
+        message = Message.objects.create(thread=self.thread, sender=self.bob, text="Зустрінемось завтра о дев'ятій")
+        Message.objects.create(thread=self.other, sender=self.carol, text="завтра буде дощ")
+        self.assertEqual(self.search('ЗАВТРА'), [message.id])
+        self.assertEqual(self.search('зустр'), [message.id])
+
+        message.text = "Перенесемо на четвер"
+        message.save()
+        self.assertEqual(self.search('завтра'), [])
+        self.assertEqual(self.search('четвер'), [message.id])
+
+        Message.objects.filter(pk=message.pk).delete()
+        self.assertEqual(self.search('четвер'), [])
+
+    def test_ranked_keyset_pages(self):
+        relevant = Message.objects.create(thread=self.thread, sender=self.bob, text="deploy deploy deploy")
+        others = [
+            Message.objects.create(thread=self.thread, sender=self.bob, text=f"deploy note {i} " + "filler " * 20)
+            for i in range(4)
+        ]
+        res = self.client_alice.get('/chat/messages/search/', {'q': 'deploy', 'limit': 2})
+        seen = [message['id'] for message in res.data['results']]
+        self.assertEqual(seen[0], relevant.id)
+        while res.data['next']:
+            res = self.client_alice.get(res.data['next'])
+            seen += [message['id'] for message in res.data['results']]
+        self.assertEqual(sorted(seen), sorted([relevant.id] + [message.id for message in others]))
+        self.assertEqual(len(seen), len(set(seen)))
+
+    def test_query_syntax_is_not_passed_through(self):
+        Message.objects.create(thread=self.thread, sender=self.bob, text='say "hi" AND bye')
+        self.assertEqual(len(self.search('"hi" AND (')), 1)
+        res = self.client_alice.get('/chat/messages/search/', {'q': '  '})
+        self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_scan_backend_matches_the_index(self):
+        Message.objects.create(thread=self.thread, sender=self.bob, text="lunch at noon")
+        Message.objects.create(thread=self.thread, sender=self.bob, text="no lunch today")
+        with mock.patch('chat.views.get_backend', ScanSearchBackend):
+            scanned = self.search('lunch')
+        self.assertEqual(sorted(scanned), sorted(self.search('lunch')))
+
+
+class DatabaseProfileTest(TestCase):
+    def open(self, directory):
+        settings_dict = {**connection.settings_dict, 'NAME': os.path.join(directory, 'profile.sqlite3')}
+        return type(connections['default'])(settings_dict, alias='profile')
+
+    def test_sqlite_pragmas_applied_on_connect(self):
+        with tempfile.TemporaryDirectory() as directory:
+            db = self.open(directory)
+            try:
+                with db.cursor() as cursor:
+                    pragmas = {}
+                    for name in ('journal_mode', 'synchronous', 'busy_timeout'):
+                        cursor.execute(f'PRAGMA {name}')
+                        pragmas[name] = cursor.fetchone()[0]
+            finally:
+                db.close()
+        self.assertEqual(pragmas, {'journal_mode': 'wal', 'synchronous': 1, 'busy_timeout': 5000})
+
+    @override_settings(CHAT_SQLITE_PRAGMAS={'journal_mode': 'wal; DROP TABLE chat_message'})
+    def test_invalid_pragma_is_rejected(self):
+        with tempfile.TemporaryDirectory() as directory:
+            db = self.open(directory)
+            try:
+                with self.assertRaises(ValueError):
+                    db.ensure_connection()
+            finally:
+                db.close()
+
+
+class ReplicaRoutingTest(APITestCase):
+    """A second SQLite file stands in for a replica that has not caught up."""
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        # Added after the test case has guarded its databases, and outside its
+        # transaction, like a real replica.
+        cls.replica_dir = tempfile.TemporaryDirectory()
+        connections.settings['stale_replica'] = {
+            **connections.settings['default'],
+            'NAME': os.path.join(cls.replica_dir.name, 'replica.sqlite3'),
+        }
+        call_command('migrate', database='stale_replica', verbosity=0)
+        replicas = override_settings(CHAT_READ_REPLICAS=['stale_replica'])
+        replicas.enable()
+        cls.addClassCleanup(replicas.disable)
+
+    @classmethod
+    def tearDownClass(cls):
+        connections['stale_replica'].close()
+        del connections['stale_replica']
+        del connections.settings['stale_replica']
+        cls.replica_dir.cleanup()
+        super().tearDownClass()
+
+    def setUp(self):
+        get_cache().clear()  # drop stickiness left by other tests' writes
+        self.alice = User.objects.create_user(username='alice', password='test1234')
+        self.bob = User.objects.create_user(username='bob', password='test1234')
+        self.thread = Thread.objects.create()
+        self.thread.participants.set([self.alice, self.bob])
+        Message.objects.create(thread=self.thread, sender=self.bob, text="на основній базі")
+        self.client_alice = APIClient()
+        self.client_alice.force_authenticate(self.alice)
+
+    def test_reads_go_to_replica(self):
+        self.assertEqual(self.client_alice.get('/chat/messages/').data['results'], [])
+        self.assertEqual(self.client_alice.get('/chat/threads/?view=inbox').data['results'], [])
+        self.assertEqual(self.client_alice.get('/chat/messages/unread/').data['unread_count'], 0)
+
+    def test_writes_pin_reads_to_primary(self):
+        res = self.client_alice.post('/chat/messages/', {"thread": self.thread.id, "text": "моя"}, format='json')
+        self.assertEqual(res.status_code, status.HTTP_201_CREATED)
+        self.assertTrue(is_sticky(self.alice.id))
+        self.assertEqual(len(self.client_alice.get('/chat/messages/').data['results']), 2)
+        self.assertFalse(is_sticky(self.bob.id))
+
+    def test_replica_pages_are_not_revalidated_or_reused_on_primary(self):
+        res = self.client_alice.get('/chat/messages/')
+        self.assertEqual(res.data['results'], [])
+        self.assertNotIn('ETag', res)
+        with override_settings(CHAT_READ_REPLICAS=[]):
+            res = self.client_alice.get('/chat/messages/')
+        self.assertEqual(len(res.data['results']), 1)
+        self.assertIn('ETag', res)
+
+    def test_objects_read_from_replica_are_saved_on_primary(self):
+        self.assertIsNone(ReplicaRouter().db_for_read(Message))
+        with reading_from('stale_replica'):
+            self.assertEqual(ReplicaRouter().db_for_read(Message), 'stale_replica')
+            self.assertIsNone(ReplicaRouter().db_for_read(User))
+        message = Message(thread=self.thread, sender=self.bob, text="x")
+        message._state.db = 'stale_replica'
+        self.assertEqual(ReplicaRouter().db_for_write(Message, instance=message), 'default')
+
+
+class MessageArchiveTest(APITestCase):
+    def setUp(self):
+        self.alice = User.objects.create_user(username='alice', password='test1234')
+        self.bob = User.objects.create_user(username='bob', password='test1234')
+        self.thread = Thread.objects.create()
+        self.thread.participants.set([self.alice, self.bob])
+        old = timezone.now() - timedelta(days=settings.CHAT_ARCHIVE_AFTER_DAYS + 10)
+        self.old = []
+        for i in range(5):
+            message = Message.objects.create(thread=self.thread, sender=self.bob, text=f"old report {i}")
+            Message.objects.filter(pk=message.pk).update(created=old + timedelta(minutes=i))
+            self.old.append(message.id)
+        self.new = [
+            Message.objects.create(thread=self.thread, sender=self.bob, text=f"new report {i}").id
+            for i in range(3)
+        ]
+        self.client_alice = APIClient()
+        self.client_alice.force_authenticate(self.alice)
+        self.addCleanup(get_cache().delete, HORIZON_KEY)
+
+    def archive(self):
+        call_command('archive_messages', batch_size=2, stdout=StringIO())
+
+    def test_command_moves_old_messages_in_batches(self):
+        self.archive()
+        self.assertEqual(sorted(ArchivedMessage.objects.values_list('id', flat=True)), self.old)
+        self.assertEqual(sorted(Message.objects.values_list('id', flat=True)), self.new)
+        self.assertEqual(UnreadCounter.objects.total_for(self.alice), 3)
+        self.archive()  # nothing left to move
+        self.assertEqual(ArchivedMessage.objects.count(), 5)
+
+    def test_batches_advance_the_horizon_without_aggregating(self):
+        with CaptureQueriesContext(connection) as queries:
+            self.archive()
+        aggregates = [query['sql'] for query in queries.captured_queries if 'MAX("chat_archivedmessage"' in query['sql']]
+        self.assertLessEqual(len(aggregates), 1)  # only the first lookup misses the cache
+        newest = ArchivedMessage.objects.order_by('-created').values_list('created', flat=True)[0]
+        self.assertEqual(get_cache().get(HORIZON_KEY), newest)
+
+    def test_list_falls_through_to_archive(self):
+        self.archive()
+        expected = list(reversed(self.old + self.new))
+        with CaptureQueriesContext(connection) as queries:
+            res = self.client_alice.get(f'/chat/messages/?thread={self.thread.id}&limit=2')
+        self.assertNotIn('chat_archivedmessage', ' '.join(query['sql'] for query in queries.captured_queries))
+
+        seen = [message['id'] for message in res.data['results']]
+        while res.data['next']:
+            res = self.client_alice.get(res.data['next'])
+            seen += [message['id'] for message in res.data['results']]
+        self.assertEqual(seen, expected)
+        previous = self.client_alice.get(res.data['previous'])
+        self.assertEqual([message['id'] for message in previous.data['results']], expected[4:6])
+
+        client = APIClient()
+        client.credentials(HTTP_AUTHORIZATION='Bearer ' + str(RefreshToken.for_user(self.alice).access_token))
+        res = client.get(f'/chat/async/messages/?thread={self.thread.id}&limit=10')
+        self.assertEqual([message['id'] for message in res.json()['results']], expected)
+
+    def test_export_and_search_include_archive(self):
+        self.archive()
+        lines = [json.loads(line) for line in export_lines([self.thread.id])]
+        self.assertEqual([line['id'] for line in lines], self.old + self.new)
+
+        res = self.client_alice.get('/chat/messages/search/', {'q': 'report', 'limit': 3})
+        seen = [message['id'] for message in res.data['results']]
+        while res.data['next']:
+            res = self.client_alice.get(res.data['next'])
+            seen += [message['id'] for message in res.data['results']]
+        self.assertEqual(sorted(seen[:3]), self.new)
+        self.assertEqual(sorted(seen[3:]), self.old)
+
+
+class MetricsTest(APITestCase):
+    def setUp(self):
+        REGISTRY.clear()
+        self.alice = User.objects.create_user(username='alice', password='test1234')
+        self.bob = User.objects.create_user(username='bob', password='test1234')
+        self.thread = Thread.objects.create()
+        self.thread.participants.set([self.alice, self.bob])
+        Message.objects.create(thread=self.thread, sender=self.bob, text="привіт")
+        self.client_alice = APIClient()
+        self.client_alice.force_authenticate(self.alice)
+
+    def test_records_per_route_metrics(self):
+        self.client_alice.get('/chat/messages/')
+        self.client_alice.get('/chat/messages/')
+        self.client_alice.get('/chat/nowhere/')
+        self.client.force_login(User.objects.create_user(username='ops', password='test1234', is_staff=True))
+        res = self.client.get('/metrics')
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertTrue(res['Content-Type'].startswith('text/plain; version=0.0.4'))
+        text = res.content.decode()
+        self.assertIn('chat_http_requests_total{method="GET",route="message-list",status="200"} 2', text)
+        self.assertIn('chat_http_requests_total{method="GET",route="unmatched",status="404"} 1', text)
+        self.assertIn('chat_http_request_duration_seconds_bucket{method="GET",route="message-list",le="+Inf"} 2', text)
+        self.assertIn('chat_serializer_duration_seconds_count{method="GET",route="message-list"} 2', text)
+        # The second page comes from the page cache without touching the database.
+        self.assertIn('chat_db_queries_per_request_bucket{method="GET",route="message-list",le="0"} 1', text)
+
+    def test_slow_requests_are_logged_with_sql(self):
+        with override_settings(CHAT_SLOW_REQUEST_MS=0.001):
+            client = APIClient()
+            client.force_authenticate(self.alice)
+            with self.assertLogs('chat.slow_requests', 'WARNING') as logs:
+                client.get('/chat/messages/')
+        self.assertIn('(message-list)', logs.output[0])
+        self.assertIn('FROM "chat_message"', logs.output[0])
+
+    def test_metrics_are_private_by_default(self):
+        self.assertEqual(self.client.get('/metrics').status_code, status.HTTP_403_FORBIDDEN)
+        self.client.force_login(self.alice)
+        self.assertEqual(self.client.get('/metrics').status_code, status.HTTP_403_FORBIDDEN)
+        with override_settings(DEBUG=True):
+            self.assertEqual(self.client.get('/metrics').status_code, status.HTTP_200_OK)
+
+    @override_settings(CHAT_METRICS_TOKEN='s3cret')
+    def test_metrics_token(self):
+        self.assertEqual(self.client.get('/metrics').status_code, status.HTTP_403_FORBIDDEN)
+        res = self.client.get('/metrics', HTTP_AUTHORIZATION='Bearer s3cret')
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+
+
+class TaskQueueTest(APITestCase):
+    def setUp(self):
+        self.alice = User.objects.create_user(username='alice', password='test1234')
+        self.bob = User.objects.create_user(username='bob', password='test1234')
+        self.thread = Thread.objects.create()
+        self.thread.participants.set([self.alice, self.bob])
+        self.client_alice = APIClient()
+        self.client_alice.force_authenticate(self.alice)
+
+    def test_queue_mode_requires_a_shared_broker(self):
+        self.assertEqual(check_task_broker(None), [])
+        with override_settings(CHAT_TASKS_MODE='queue'):
+            self.assertEqual([error.id for error in check_task_broker(None)], ['chat.E001'])
+        with override_settings(CHAT_TASKS_MODE='queue', CHAT_BROKER='chat.broker.BaseBroker'):
+            self.assertEqual(check_task_broker(None), [])
+
+    @override_settings(CHAT_TASKS_MODE='queue')
+    def test_queue_mode_defers_side_effects_to_the_worker(self):
+        broker = mock.Mock()
+        with mock.patch('chat.events.get_broker', return_value=broker):
+            with self.captureOnCommitCallbacks(execute=True):
+                res = self.client_alice.post('/chat/messages/', {"thread": self.thread.id, "text": "пізніше"}, format='json')
+                client_bob = APIClient()
+                client_bob.force_authenticate(self.bob)
+                client_bob.post(f'/chat/threads/{self.thread.id}/read/', {}, format='json')
+            broker.publish.assert_not_called()
+            self.assertEqual(list(Task.objects.values_list('event', 'status')),
+                             [('message.created', Task.PENDING), ('thread.read', Task.PENDING)])
+
+            call_command('chat_worker', once=True, stdout=StringIO())
+        events = [call.args[1]['type'] for call in broker.publish.call_args_list]
+        self.assertEqual(events, ['message.created', 'unread.changed', 'message.read', 'unread.changed', 'unread.changed'])
+        self.assertEqual(broker.publish.call_args_list[0].args[1]['message']['id'], res.data['id'])
+        self.assertFalse(Task.objects.exclude(status=Task.DONE).exists())
+
+    @override_settings(CHAT_TASKS_MODE='queue')
+    def test_idempotency_key_enqueues_once(self):
+        dispatch('message.created', {'messages': []}, key='message.created:1')
+        dispatch('message.created', {'messages': []}, key='message.created:1')
+        self.assertEqual(Task.objects.count(), 1)
+
+    @override_settings(CHAT_TASKS_MODE='queue', CHAT_TASKS_MAX_ATTEMPTS=2)
+    def test_failing_task_is_retried_then_given_up(self):
+        def flaky(payloads):
+            if any(not payload['ok'] for payload in payloads):
+                raise RuntimeError('boom')
+
+        with mock.patch.dict('chat.tasks._handlers', {'test.flaky': [flaky]}):
+            dispatch('test.flaky', {'ok': True})
+            dispatch('test.flaky', {'ok': False})
+            with self.assertLogs('chat.tasks', 'WARNING'):
+                self.assertEqual(run_batch(), 2)
+            good, bad = Task.objects.order_by('id')
+            self.assertEqual(good.status, Task.DONE)
+            self.assertEqual((bad.status, bad.attempts), (Task.PENDING, 1))
+            self.assertIn('boom', bad.last_error)
+            self.assertGreater(bad.run_after, timezone.now())
+
+            self.assertEqual(run_batch(), 0)  # backing off
+            Task.objects.filter(pk=bad.pk).update(run_after=timezone.now())
+            with self.assertLogs('chat.tasks', 'WARNING'):
+                run_batch()
+            bad.refresh_from_db()
+            self.assertEqual((bad.status, bad.attempts), (Task.FAILED, 2))
+
+
+THROTTLE_RATES = {'read': '100/min', 'write': '100/min', 'send': '2/min', 'unread': '1/min'}
+
+
+@override_settings(
+    REST_FRAMEWORK={
+        **settings.REST_FRAMEWORK,
+        'DEFAULT_THROTTLE_CLASSES': ('chat.throttling.TokenBucketThrottle',),
+        'DEFAULT_THROTTLE_RATES': THROTTLE_RATES,
+    },
+    CHAT_THROTTLE_STORE='chat.throttling.LocalBucketStore',
+)
+class ThrottlingTest(APITestCase):
+    def setUp(self):
+        self.alice = User.objects.create_user(username='alice', password='test1234')
+        self.bob = User.objects.create_user(username='bob', password='test1234')
+        self.thread = Thread.objects.create()
+        self.thread.participants.set([self.alice, self.bob])
+        self.client_alice = APIClient()
+        self.client_alice.force_authenticate(self.alice)
+
+    def test_send_bucket_is_per_user_and_per_class(self):
+        for _ in range(2):
+            res = self.client_alice.post('/chat/messages/', {"thread": self.thread.id, "text": "раз"}, format='json')
+            self.assertEqual(res.status_code, status.HTTP_201_CREATED)
+        res = self.client_alice.post('/chat/messages/', {"thread": self.thread.id, "text": "три"}, format='json')
+        self.assertEqual(res.status_code, status.HTTP_429_TOO_MANY_REQUESTS)
+        self.assertTrue(1 <= int(res['Retry-After']) <= 30)
+
+        # Other classes and other users have their own buckets.
+        self.assertEqual(self.client_alice.get('/chat/messages/').status_code, status.HTTP_200_OK)
+        client_bob = APIClient()
+        client_bob.force_authenticate(self.bob)
+        res = client_bob.post('/chat/messages/', {"thread": self.thread.id, "text": "ok"}, format='json')
+        self.assertEqual(res.status_code, status.HTTP_201_CREATED)
+
+    def test_unread_polling_is_throttled_on_sync_and_async_views(self):
+        token = str(RefreshToken.for_user(self.alice).access_token)
+        self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {token}')
+        self.assertEqual(self.client.get('/chat/messages/unread/').status_code, status.HTTP_200_OK)
+        res = self.client.get('/chat/async/messages/unread/')
+        self.assertEqual(res.status_code, status.HTTP_429_TOO_MANY_REQUESTS)
+        self.assertEqual(res['Retry-After'], '60')
+        self.assertIn('throttled', res.json()['detail'])
+
+    def test_cache_store_refills_over_time(self):
+        store = CacheBucketStore()
+        store.clear()
+        with mock.patch('chat.throttling.time.time', return_value=1000.0):
+            self.assertEqual(store.consume('k', 1.0, 2), (True, 0.0))
+            self.assertEqual(store.consume('k', 1.0, 2), (True, 0.0))
+            self.assertEqual(store.consume('k', 1.0, 2), (False, 1.0))
+        with mock.patch('chat.throttling.time.time', return_value=1001.5):
+            self.assertEqual(store.consume('k', 1.0, 2)[0], True)
+
+
+    def test_local_store_sweeps_each_bucket_at_its_own_rate(self):
+        store = LocalBucketStore()
+        store.max_keys = 1
+        with mock.patch('chat.throttling.time.monotonic', return_value=1000.0):
+            store.consume('slow', 1 / 60, 1)
+        with mock.patch('chat.throttling.time.monotonic', return_value=1010.0):
+            # A fast scope's bucket triggers the sweep; the slow one is far from full.
+            store.consume('fast', 10.0, 5)
+            self.assertIn('slow', store.buckets)
+            self.assertEqual(store.consume('slow', 1 / 60, 1)[0], False)
+        with mock.patch('chat.throttling.time.monotonic', return_value=1200.0):
+            store.consume('other', 10.0, 5)
+            self.assertNotIn('slow', store.buckets)
+
+class ConcurrencyLimitTest(TestCase):
+    @override_settings(CHAT_MAX_CONCURRENT_REQUESTS=1)
+    def test_sheds_load_beyond_the_limit(self):
+        def get_response(request):
+            if request.path != '/chat/threads/':
+                return HttpResponse('served')
+            # Another request arrives while this one is in flight.
+            return middleware(RequestFactory().get(nested_path))
+
+        middleware = ConcurrencyLimitMiddleware(get_response)
+        nested_path = '/chat/threads/'
+        response = middleware(RequestFactory().get('/chat/threads/'))
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(response['Retry-After'], '1')
+        self.assertEqual(middleware.active, 0)
+
+        nested_path = '/metrics'
+        self.assertEqual(middleware(RequestFactory().get('/chat/threads/')).content, b'served')
+
+
+class ResponseFormatTest(APITestCase):
+    def setUp(self):
+        self.alice = User.objects.create_user(username='alice', password='test1234')
+        self.bob = User.objects.create_user(username='bob', password='test1234')
+        self.thread = Thread.objects.create()
+        self.thread.participants.set([self.alice, self.bob])
+        for index in range(5):
+            Message.objects.create(thread=self.thread, sender=self.bob, text=f"повідомлення {index}")
+        self.client_alice = APIClient()
+        self.client_alice.force_authenticate(self.alice)
+
+    def test_compact_json_sends_columns_and_epoch_timestamps(self):
+        plain = self.client_alice.get('/chat/messages/').json()
+        res = self.client_alice.get('/chat/messages/', HTTP_ACCEPT='application/vnd.simplechat.compact+json')
+        self.assertEqual(res['Content-Type'], 'application/vnd.simplechat.compact+json')
+        self.assertIn('Accept', res['Vary'])
+        data = res.json()
+        self.assertEqual(data['next'], plain['next'])
+        self.assertEqual(data['results']['fields'], ['id', 'thread', 'sender', 'text', 'created', 'is_read'])
+        first = dict(zip(data['results']['fields'], data['results']['rows'][0]))
+        self.assertEqual(first, {**plain['results'][0], 'created': epoch_ms(plain['results'][0]['created'])})
+        self.assertLess(len(res.content), len(json.dumps(plain, ensure_ascii=False).encode()))
+
+        inbox = self.client_alice.get('/chat/threads/?view=inbox&format=compact').json()['results']
+        row = dict(zip(inbox['fields'], inbox['rows'][0]))
+        self.assertIsInstance(row['last_message']['created'], int)
+
+    def test_epoch_ms_accepts_drf_timestamps(self):
+        self.assertEqual(epoch_ms('1970-01-01T00:00:01.500000Z'), 1500)
+        self.assertEqual(epoch_ms('1970-01-01T02:00:00+02:00'), 0)
+
+    def test_formats_have_their_own_etags(self):
+        plain = self.client_alice.get('/chat/messages/')
+        compact = self.client_alice.get('/chat/messages/?format=compact')
+        self.assertNotEqual(plain['ETag'], compact['ETag'])
+        res = self.client_alice.get('/chat/messages/', HTTP_IF_NONE_MATCH=plain['ETag'], HTTP_ACCEPT='application/vnd.simplechat.compact+json')
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+
+    def test_gzip_is_negotiated(self):
+        res = self.client_alice.get('/chat/messages/', HTTP_ACCEPT_ENCODING='gzip, br')
+        self.assertEqual(res['Content-Encoding'], 'gzip')
+        self.assertIn('Accept-Encoding', res['Vary'])
+        self.assertEqual(len(json.loads(gzip.decompress(res.content))['results']), 5)
+        self.assertFalse(self.client_alice.get('/chat/messages/').has_header('Content-Encoding'))
+
+    def test_msgpack(self):
+        res = self.client_alice.get('/chat/messages/', HTTP_ACCEPT='application/msgpack')
+        self.assertEqual(res['Content-Type'], 'application/msgpack')
+        data = msgpack.unpackb(res.content)
+        self.assertEqual(len(data['results']['rows']), 5)
+
+
+class RowSerializerParityTest(TestCase):
+    def setUp(self):
+        self.alice = User.objects.create_user(username='alice', password='test1234')
+        self.bob = User.objects.create_user(username='bob', password='test1234')
+        self.carol = User.objects.create_user(username='carol', password='test1234')
+        self.thread = Thread.objects.create()
+        self.thread.participants.set([self.alice, self.bob])
+        self.empty = Thread.objects.create()
+        self.empty.participants.set([self.carol, self.alice])
+        for index in range(3):
+            Message.objects.create(thread=self.thread, sender=self.bob, text=f"рядок {index}")
+        Message.objects.create(thread=self.thread, sender=self.alice, text="відповідь", is_read=True)
+
+    def assertParity(self, serializer_class, row_serializer_class, queryset):
+        expected = json.loads(json.dumps(serializer_class(queryset, many=True).data))
+        self.assertTrue(expected)
+        with self.assertNumQueries(1 if row_serializer_class is MessageRowSerializer else 2):
+            actual = row_serializer_class(row_serializer_class.rows(queryset), many=True).data
+        self.assertEqual(actual, expected)
+        self.assertEqual(row_serializer_class(row_serializer_class.rows(queryset)[0]).data, expected[0])
+
+    def test_messages(self):
+        self.assertParity(MessageSerializer, MessageRowSerializer, message_queryset(self.alice).order_by('-id'))
+
+    def test_threads(self):
+        self.assertParity(ThreadSerializer, ThreadRowSerializer, thread_queryset(self.alice).order_by('id'))
+
+    def test_inbox(self):
+        queryset = thread_queryset(self.alice, inbox=True).order_by('-updated', '-id')
+        self.assertParity(InboxThreadSerializer, InboxRowSerializer, queryset)
+
+
+class GroupThreadTest(QueryBudgetMixin, APITestCase):
+    def setUp(self):
+        self.alice, self.bob, self.carol, self.dave = (
+            User.objects.create_user(username=name, password='test1234') for name in ('alice', 'bob', 'carol', 'dave')
+        )
+        self.clients = {}
+        for user in (self.alice, self.bob, self.carol, self.dave):
+            client = APIClient()
+            client.credentials(HTTP_AUTHORIZATION='Bearer ' + str(RefreshToken.for_user(user).access_token))
+            self.clients[user.username] = client
+        res = self.clients['alice'].post(
+            '/chat/threads/', {"group": True, "name": "Друзі", "participants": [self.bob.id, self.carol.id]}, format='json'
+        )
+        self.assertEqual(res.status_code, status.HTTP_201_CREATED)
+        self.group = Thread.objects.get(pk=res.data['id'])
+
+    def send(self, user, text):
+        res = self.clients[user].post('/chat/messages/', {"thread": self.group.id, "text": text}, format='json')
+        self.assertEqual(res.status_code, status.HTTP_201_CREATED)
+        return res.data['id']
+
+    def unread(self, user):
+        return self.clients[user].get('/chat/messages/unread/').data['unread_count']
+
+    def test_create_group(self):
+        self.assertTrue(self.group.is_group)
+        self.assertEqual(self.group.name, "Друзі")
+        self.assertEqual(sorted(self.group.participants.values_list('id', flat=True)),
+                         [self.alice.id, self.bob.id, self.carol.id])
+        self.assertIsNone(self.group.user_low_id)
+        self.group.save()  # more than two participants are allowed in groups
+
+        res = self.clients['alice'].post('/chat/threads/', {"group": True, "participants": []}, format='json')
+        self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+        with override_settings(CHAT_GROUP_MAX_MEMBERS=3):
+            res = self.clients['alice'].post(f'/chat/threads/{self.group.id}/members/', {"users": [self.dave.id]}, format='json')
+        self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_send_writes_nothing_per_member(self):
+        self.send('alice', "перше")
+        # as a direct send, plus the member ids whose page caches are invalidated
+        response = self.assertQueryBudget(
+            8, self.clients['bob'], 'post', '/chat/messages/', {"thread": self.group.id, "text": "друге"}
+        )
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertFalse(UnreadCounter.objects.filter(thread=self.group).exists())
+        self.assertEqual(set(Membership.objects.filter(thread=self.group).values_list('last_read_id', flat=True)), {0})
+
+        self.assertEqual(self.unread('alice'), 1)
+        self.assertEqual(self.unread('bob'), 1)
+        self.assertEqual(self.unread('carol'), 2)
+        self.assertEqual(self.clients['dave'].post(
+            '/chat/messages/', {"thread": self.group.id, "text": "чужий"}, format='json'
+        ).status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_read_watermark_mute_and_inbox(self):
+        first = self.send('alice', "1")
+        self.send('bob', "2")
+        self.send('alice', "3")
+        res = self.clients['carol'].post(f'/chat/threads/{self.group.id}/read/', {"up_to_id": first}, format='json')
+        self.assertEqual(res.data, {'updated': 1})
+        self.assertEqual(self.unread('carol'), 2)
+
+        inbox = self.clients['carol'].get('/chat/threads/?view=inbox').data['results']
+        self.assertEqual((inbox[0]['is_group'], inbox[0]['name'], inbox[0]['unread_count']), (True, "Друзі", 2))
+        self.assertEqual(len(inbox[0]['participants']), 3)
+
+        res = self.clients['carol'].post(f'/chat/threads/{self.group.id}/mute/', {"muted": True}, format='json')
+        self.assertEqual(res.data, {'muted': True})
+        self.assertEqual(self.unread('carol'), 0)
+        self.clients['carol'].post(f'/chat/threads/{self.group.id}/mute/', {"muted": False}, format='json')
+
+        latest = Message.objects.filter(thread=self.group).latest('id')
+        res = self.clients['carol'].post('/chat/messages/read/', {"ids": [latest.id]}, format='json')
+        self.assertEqual(res.data, {'updated': 2})
+        self.assertEqual(self.unread('carol'), 0)
+        self.assertFalse(Message.objects.filter(thread=self.group, is_read=True).exists())
+
+    def test_group_members_cannot_be_replaced_by_update(self):
+        res = self.clients['alice'].patch(
+            f'/chat/threads/{self.group.id}/', {"participants": [self.alice.id, self.carol.id]}, format='json'
+        )
+        self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(self.group.participants.count(), 3)
+
+    def test_members_join_with_nothing_unread_and_can_leave(self):
+        self.send('alice', "до тебе")
+        res = self.clients['bob'].post(f'/chat/threads/{self.group.id}/members/', {"users": [self.dave.id]}, format='json')
+        self.assertEqual(res.data, {'added': 1})
+        self.assertEqual(self.unread('dave'), 0)
+        self.send('carol', "привіт, Дейве")
+        self.assertEqual(self.unread('dave'), 1)
+
+        res = self.clients['dave'].post(f'/chat/threads/{self.group.id}/leave/')
+        self.assertEqual(res.status_code, status.HTTP_204_NO_CONTENT)
+        self.assertEqual(self.unread('dave'), 0)
+        self.assertEqual(self.clients['dave'].get(f'/chat/messages/?thread={self.group.id}').data['results'], [])
+
+    def test_unread_total_is_one_query_with_groups(self):
+        self.send('alice', "раз")
+        direct = Thread.objects.create()
+        direct.participants.set([self.alice, self.bob])
+        Message.objects.create(thread=direct, sender=self.alice, text="два")
+        with self.assertNumQueries(1):
+            self.assertEqual(UnreadCounter.objects.total_for(self.bob), 2)
+        self.assertEqual(UnreadCounter.objects.totals([self.alice.id, self.bob.id, self.carol.id]),
+                         {self.alice.id: 0, self.bob.id: 2, self.carol.id: 1})
+
+
+class ChatAdminTest(TestCase):
+    def setUp(self):
+        self.admin = User.objects.create_superuser(username='admin', password='test1234')
+        self.alice, self.bob, self.carol = (
+            User.objects.create_user(username=name, password='test1234') for name in ('alice', 'bob', 'carol')
+        )
+        self.thread = Thread.objects.create()
+        self.thread.participants.set([self.alice, self.bob])
+        Message.objects.create(thread=self.thread, sender=self.alice, text="привіт")
+        self.client.force_login(self.admin)
+
+    def post_members(self, users, delete=(), is_group=False):
+        memberships = list(Membership.objects.filter(thread=self.thread).order_by('id'))
+        data = {
+            'name': '', 'memberships-TOTAL_FORMS': len(memberships) + len(users),
+            'memberships-INITIAL_FORMS': len(memberships), 'memberships-MIN_NUM_FORMS': 0,
+            'memberships-MAX_NUM_FORMS': 1000,
+        }
+        if is_group:
+            data['is_group'] = 'on'
+        forms = [(m.id, m.user_id, m.user_id in delete) for m in memberships] + [('', user.id, False) for user in users]
+        for index, (pk, user_id, deleted) in enumerate(forms):
+            data.update({
+                f'memberships-{index}-id': pk, f'memberships-{index}-thread': self.thread.id,
+                f'memberships-{index}-user': user_id, f'memberships-{index}-joined_at_0': '2026-01-01',
+                f'memberships-{index}-joined_at_1': '00:00:00', f'memberships-{index}-last_read_id': 0,
+            })
+            if deleted:
+                data[f'memberships-{index}-DELETE'] = 'on'
+        return self.client.post(f'/admin/chat/thread/{self.thread.id}/change/', data)
+
+    def test_direct_thread_rejects_a_third_member(self):
+        res = self.post_members([self.carol])
+        self.assertEqual(res.status_code, 200)
+        self.assertContains(res, "cannot have more than 2 participants")
+        self.assertEqual(self.thread.participants.count(), 2)
+
+    def test_member_changes_resync_pair_key_and_counters(self):
+        res = self.post_members([self.carol], delete=[self.bob.id])
+        self.assertEqual(res.status_code, 302)
+        self.thread.refresh_from_db()
+        self.assertEqual((self.thread.user_low_id, self.thread.user_high_id), (self.alice.id, self.carol.id))
+        self.assertEqual(UnreadCounter.objects.total_for(self.carol), 1)
+        self.assertEqual(UnreadCounter.objects.total_for(self.bob), 0)
+
+        res = self.post_members([self.bob], is_group=True)
+        self.assertEqual(res.status_code, 302)
+        self.thread.refresh_from_db()
+        self.assertEqual((self.thread.user_low_id, self.thread.user_high_id), (None, None))
+        self.assertEqual(self.thread.participants.count(), 3)
+
+    def test_bulk_message_delete_recomputes_thread_state(self):
+        newer = Message.objects.create(thread=self.thread, sender=self.alice, text="ще одне")
+        res = self.client.post('/admin/chat/message/', {
+            'action': 'delete_selected', '_selected_action': [newer.id], 'post': 'yes',
+        })
+        self.assertEqual(res.status_code, 302)
+        self.thread.refresh_from_db()
+        self.assertEqual(self.thread.last_message.text, "привіт")
+        self.assertEqual(UnreadCounter.objects.total_for(self.bob), 1)
@@ -0,0 +1,213 @@
+import threading
+import time
+from functools import lru_cache
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.core.cache import caches
+from django.core.signals import setting_changed
+from django.dispatch import receiver
+from django.http import JsonResponse
+from django.utils.module_loading import import_string
+from rest_framework.settings import api_settings
+from rest_framework.throttling import BaseThrottle
+
+PERIODS = {'s': 1, 'm': 60, 'h': 3600, 'd': 86400}
+SAFE_METHODS = ('GET', 'HEAD', 'OPTIONS')
+
+
+@lru_cache(maxsize=None)
+def parse_rate(rate):
+    """Turn ``"120/min"`` into ``(tokens per second, burst size)``."""
+    count, period = rate.split('/')
+    count = int(count)
+    return count / PERIODS[period[0]], count
+
+
+class LocalBucketStore:
+    """Token buckets in this process's memory.
+
+    Each check is O(1). Buckets that have refilled completely hold no
+    information, so they are dropped once the store grows past ``max_keys``.
+    """
+
+    max_keys = 100000
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.buckets = {}
+
+    def consume(self, key, rate, capacity):
+        """Take a token; return ``(allowed, seconds until one is available)``."""
+        now = time.monotonic()
+        with self.lock:
+            tokens, stamp, _ = self.buckets.get(key, (capacity, now, now))
+            allowed, tokens, wait = take(tokens + (now - stamp) * rate, rate, capacity)
+            # Buckets of different scopes refill at different rates, so each
+            # remembers when it will be full again.
+            self.buckets[key] = (tokens, now, now + (capacity - tokens) / rate)
+            if len(self.buckets) > self.max_keys:
+                self.sweep(now)
+        return allowed, wait
+
+    def sweep(self, now):
+        full = [key for key, (_, _, full_at) in self.buckets.items() if full_at <= now]
+        for key in full:
+            del self.buckets[key]
+
+    def clear(self):
+        with self.lock:
+            self.buckets.clear()
+
+
+class CacheBucketStore:
+    """Token buckets in a Django cache, shared by every process using it.
+
+    The read-modify-write is not atomic, so concurrent requests of one user
+    on different processes may occasionally both get the last token. Entries
+    expire once the bucket would be full again.
+    """
+
+    def __init__(self):
+        self.cache = caches[getattr(settings, 'CHAT_THROTTLE_CACHE', 'default')]
+
+    def consume(self, key, rate, capacity):
+        now = time.time()
+        tokens, stamp = self.cache.get(key) or (capacity, now)
+        allowed, tokens, wait = take(tokens + (now - stamp) * rate, rate, capacity)
+        self.cache.set(key, (tokens, now), int(capacity / rate) + 1)
+        return allowed, wait
+
+    def clear(self):
+        self.cache.clear()
+
+
+def take(tokens, rate, capacity):
+    tokens = min(tokens, capacity)
+    if tokens >= 1:
+        return True, tokens - 1, 0.0
+    return False, tokens, (1 - tokens) / rate
+
+
+_store = None
+_store_lock = threading.Lock()
+
+
+def get_store():
+    """Return the process-wide store configured by ``settings.CHAT_THROTTLE_STORE``."""
+    global _store
+    if _store is None:
+        with _store_lock:
+            if _store is None:
+                _store = import_string(settings.CHAT_THROTTLE_STORE)()
+    return _store
+
+
+@receiver(setting_changed)
+def reset_store(setting, **kwargs):
+    global _store
+    if setting == 'CHAT_THROTTLE_STORE':
+        _store = None
+
+
+class TokenBucketThrottle(BaseThrottle):
+    """Per-user token buckets, one per endpoint class.
+
+    The class (scope) of a request is the view's ``throttle_scopes`` entry
+    for its action, or its ``throttle_scope``, else ``read`` for safe
+    methods and ``write`` otherwise.
+    Rates come from ``DEFAULT_THROTTLE_RATES`` as ``"<count>/<period>"``; a
+    user can burst up to ``count`` requests, then is refilled at the average
+    rate. Rejected requests get a 429 with ``Retry-After``.
+    """
+
+    def __init__(self):
+        self.wait_seconds = None
+
+    def get_scope(self, request, view):
+        scope = getattr(view, 'throttle_scopes', {}).get(getattr(view, 'action', None))
+        return scope or getattr(view, 'throttle_scope', None) or ('read' if request.method in SAFE_METHODS else 'write')
+
+    def allow_request(self, request, view):
+        self.wait_seconds = self.check(self.get_ident_key(request), self.get_scope(request, view))
+        return self.wait_seconds is None
+
+    def get_ident_key(self, request):
+        user = getattr(request, 'user', None)
+        if user is not None and user.is_authenticated:
+            return f'user:{user.pk}'
+        return f'ip:{self.get_ident(request)}'
+
+    @staticmethod
+    def check(ident, scope):
+        """Consume a token for ``ident`` in ``scope``; return None if allowed, else seconds to wait."""
+        rate = api_settings.DEFAULT_THROTTLE_RATES.get(scope)
+        if rate is None:
+            return None
+        per_second, capacity = parse_rate(rate)
+        allowed, wait = get_store().consume(f'chat:throttle:{scope}:{ident}', per_second, capacity)
+        return None if allowed else wait
+
+    def wait(self):
+        return self.wait_seconds
+
+
+class ConcurrencyLimitMiddleware:
+    """Shed load with 503 once ``CHAT_MAX_CONCURRENT_REQUESTS`` are in flight in this process.
+
+    Rejecting at once keeps latency bounded for the requests that are
+    admitted, instead of letting every request queue until it times out.
+    Paths starting with one of ``CHAT_CONCURRENCY_EXEMPT_PATHS`` (long
+    polls, metrics) are not counted. 0 disables the limit.
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.lock = threading.Lock()
+        self.active = 0
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def admit(self, request):
+        limit = settings.CHAT_MAX_CONCURRENT_REQUESTS
+        if not limit or request.path.startswith(tuple(settings.CHAT_CONCURRENCY_EXEMPT_PATHS)):
+            return None
+        with self.lock:
+            if self.active >= limit:
+                return False
+            self.active += 1
+        return True
+
+    def release(self):
+        with self.lock:
+            self.active -= 1
+
+    def busy(self):
+        response = JsonResponse({'detail': 'Server is busy, retry shortly.'}, status=503)
+        response['Retry-After'] = str(settings.CHAT_SHED_RETRY_AFTER)
+        return response
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        admitted = self.admit(request)
+        if admitted is False:
+            return self.busy()
+        try:
+            return self.get_response(request)
+        finally:
+            if admitted:
+                self.release()
+
+    async def __acall__(self, request):
+        admitted = self.admit(request)
+        if admitted is False:
+            return self.busy()
+        try:
+            return await self.get_response(request)
+        finally:
+            if admitted:
+                self.release()
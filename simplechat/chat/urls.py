@@ -1,5 +1,8 @@
 from django.urls import path, include
 from rest_framework.routers import DefaultRouter
+from .async_views import (
+    AsyncMessageListView, AsyncThreadListView, AsyncUnreadCountView, MessageStreamView,
+)
 from .views import ThreadViewSet, MessageViewSet, UnreadCountView
 
 router = DefaultRouter()
@@ -7,6 +10,11 @@ router.register(r'threads', ThreadViewSet, basename='thread')
 router.register(r'messages', MessageViewSet, basename='message')
 
 urlpatterns = [
+    # Must precede the router, whose detail route would match "stream" as a pk.
+    path('messages/stream/', MessageStreamView.as_view(), name='message-stream'),
     path('', include(router.urls)),
+    path('async/threads/', AsyncThreadListView.as_view(), name='async-thread-list'),
+    path('async/messages/', AsyncMessageListView.as_view(), name='async-message-list'),
+    path('async/messages/unread/', AsyncUnreadCountView.as_view(), name='async-unread-count'),
     path('messages/unread/', UnreadCountView.as_view(), name='unread-count'),
-]
\ No newline at end of file
+]
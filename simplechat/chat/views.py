@@ -1,24 +1,114 @@
 from rest_framework import viewsets, generics, permissions, status
 from rest_framework.response import Response
 from rest_framework.decorators import action
-from django.db.models import Q, Count
+from rest_framework.exceptions import NotFound, ValidationError
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.handlers.asgi import ASGIRequest
+from django.db import IntegrityError, transaction
+from django.db.models import Case, IntegerField, OuterRef, Prefetch, Q, Count, Subquery, When
+from django.db.models.functions import Coalesce
+from django.http import StreamingHttpResponse
+from django.utils.decorators import method_decorator
 
-from .models import Thread, Message
-from .serializers import ThreadSerializer, MessageSerializer
+from . import caching, events
+from .caching import CachedListMixin
+from .archive import archive_horizon, user_thread_ids
+from .routers import ReplicaReadMixin
+from .export import aiterate, decode_cursor, encode_lines, export_lines
+from .search import SearchPagination, get_backend, search_terms
+from .models import ArchivedMessage, Membership, Thread, Message, UnreadCounter, group_unread_count
+from .renderers import CHAT_RENDERERS, gzip_response
+from .serializers import (
+    ThreadSerializer, MessageSerializer, ReadWatermarkSerializer, MessageIdsSerializer,
+    BulkMessageSerializer, GroupMembersSerializer, GroupThreadSerializer, MuteSerializer,
+    InboxRowSerializer, MessageRowSerializer, ThreadRowSerializer, with_participation,
+)
 
+User = get_user_model()
 
-class ThreadViewSet(viewsets.ModelViewSet):
+
+def thread_queryset(user, inbox=False):
+    """Threads of ``user``; the inbox variant adds last message and unread count."""
+    queryset = Thread.objects.filter(participants=user)
+    if inbox:
+        counter = UnreadCounter.objects.filter(thread=OuterRef('pk'), user=user)
+        membership = Membership.objects.filter(thread=OuterRef('pk'), user=user)
+        return queryset.select_related('last_message').prefetch_related(
+            Prefetch('participants', queryset=User.objects.only('id', 'username'))
+        ).annotate(unread_count=Case(
+            When(is_group=True, then=Subquery(membership.annotate(unread=group_unread_count()).values('unread')[:1])),
+            default=Coalesce(Subquery(counter.values('count')[:1]), 0),
+            output_field=IntegerField(),
+        ))
+    return queryset.prefetch_related(
+        Prefetch('participants', queryset=User.objects.only('id'))
+    )
+
+
+def parse_id(value):
+    """Return the integer in a query parameter, or None unless it is plain ASCII digits."""
+    return int(value) if value.isascii() and value.isdecimal() else None
+
+
+def message_queryset(user, thread_id=None):
+    """Messages in the threads of ``user``, optionally limited to one thread."""
+    queryset = Message.objects.filter(thread__participants=user)
+    if thread_id is not None:
+        queryset = queryset.filter(thread_id=parse_id(thread_id))
+    return queryset
+
+
+def archived_message_queryset(user, thread_id=None):
+    """The archive counterpart of message_queryset()."""
+    if thread_id is None:
+        thread_ids = user_thread_ids(user)
+    elif parse_id(thread_id) is not None and Membership.objects.filter(thread_id=thread_id, user=user).exists():
+        thread_ids = [int(thread_id)]
+    else:
+        thread_ids = []
+    return ArchivedMessage.objects.filter(thread_id__in=thread_ids)
+
+
+@method_decorator(gzip_response, name='dispatch')
+class ThreadViewSet(ReplicaReadMixin, CachedListMixin, viewsets.ModelViewSet):
     """ViewSet for managing threads (conversations)."""
 
     serializer_class = ThreadSerializer
     permission_classes = [permissions.IsAuthenticated]
+    renderer_classes = CHAT_RENDERERS
+    # Actions that only need the thread row, not its (possibly many) participants.
+    member_actions = ('read', 'export', 'members', 'leave', 'mute')
+
+    @property
+    def is_inbox(self):
+        return self.action == 'list' and self.request.query_params.get('view') == 'inbox'
+
+    @property
+    def keyset_ordering(self):
+        """Order the inbox by last activity instead of creation time."""
+        return ('-updated', '-id') if self.is_inbox else None
+
+    def get_serializer_class(self):
+        if self.is_inbox:
+            return InboxRowSerializer
+        if self.action == 'list':
+            return ThreadRowSerializer
+        return super().get_serializer_class()
 
     def get_queryset(self):
         """Get threads for the current user."""
-        return Thread.objects.filter(participants=self.request.user)
+        if self.action in self.member_actions:
+            return Thread.objects.filter(participants=self.request.user)
+        queryset = thread_queryset(self.request.user, inbox=self.is_inbox)
+        if self.action == 'list':
+            return self.get_serializer_class().rows(queryset)
+        return queryset
 
     def create(self, request, *args, **kwargs):
-        """Create a new thread or return existing one."""
+        """Create a new thread or return existing one; ``"group": true`` creates a group."""
+        if request.data.get('group'):
+            return self.create_group(request)
         participants = request.data.get('participants', [])
 
         # Basic validation of participant count
@@ -28,27 +118,32 @@ class ThreadViewSet(viewsets.ModelViewSet):
                 status=status.HTTP_400_BAD_REQUEST
             )
 
-        for participant_id in participants:
-            try:
-                threads = Thread.objects.filter(participants=participant_id)
-                for thread in threads:
-                    thread_participants = list(
-                        thread.participants.values_list('id', flat=True)
-                    )
-                    if (len(thread_participants) == 2 and
-                            set(thread_participants) == set(participants)):
-                        # Found duplicate - return existing thread
-                        serializer = self.get_serializer(thread)
-                        return Response(
-                            serializer.data,
-                            status=status.HTTP_200_OK
-                        )
-            except Exception:
-                continue
+        try:
+            if not isinstance(participants, (list, tuple)):
+                raise TypeError
+            low, high = Thread.pair_key(*(int(user_id) for user_id in participants))
+        except (TypeError, ValueError):
+            # Malformed ids are reported by the serializer below.
+            pass
+        else:
+            thread = Thread.objects.filter(user_low=low, user_high=high).first()
+            if thread is not None:
+                # Found duplicate - return existing thread
+                serializer = self.get_serializer(thread)
+                return Response(serializer.data, status=status.HTTP_200_OK)
 
         serializer = self.get_serializer(data=request.data)
         if serializer.is_valid():
-            thread = serializer.save()
+            try:
+                thread = serializer.save()
+            except IntegrityError:
+                # A concurrent request created the same pair first
+                low, high = Thread.pair_key(
+                    *(user.id for user in serializer.validated_data['participants'])
+                )
+                thread = Thread.objects.get(user_low=low, user_high=high)
+                serializer = self.get_serializer(thread)
+                return Response(serializer.data, status=status.HTTP_200_OK)
             return Response(serializer.data, status=status.HTTP_201_CREATED)
         else:
             return Response(
@@ -56,55 +151,298 @@ class ThreadViewSet(viewsets.ModelViewSet):
                 status=status.HTTP_400_BAD_REQUEST
             )
 
+    def create_group(self, request):
+        """Create a group of the requesting user and ``participants``, named ``name``."""
+        serializer = GroupThreadSerializer(data=request.data, context=self.get_serializer_context())
+        serializer.is_valid(raise_exception=True)
+        thread = serializer.save()
+        return Response(ThreadSerializer(thread).data, status=status.HTTP_201_CREATED)
+
+    def get_group(self):
+        thread = self.get_object()
+        if not thread.is_group:
+            raise ValidationError({'detail': 'Only group threads have members to manage.'})
+        return thread
+
+    @action(detail=True, methods=['post'])
+    def members(self, request, pk=None):
+        """Add ``users`` to a group; they start with nothing unread."""
+        thread = self.get_group()
+        serializer = GroupMembersSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        users = serializer.validated_data['users']
+        with transaction.atomic():
+            member_ids = set(Membership.objects.filter(thread=thread).values_list('user_id', flat=True))
+            new = [user for user in set(users) if user.pk not in member_ids]
+            if len(member_ids) + len(new) > settings.CHAT_GROUP_MAX_MEMBERS:
+                raise ValidationError(
+                    {'users': f'A group cannot have more than {settings.CHAT_GROUP_MAX_MEMBERS} members.'}
+                )
+            thread.participants.add(*new, through_defaults={'last_read_id': thread.last_message_id or 0})
+        return Response({'added': len(new)})
+
+    @action(detail=True, methods=['post'])
+    def leave(self, request, pk=None):
+        """Leave a group."""
+        thread = self.get_group()
+        thread.participants.remove(request.user)
+        return Response(status=status.HTTP_204_NO_CONTENT)
+
+    @action(detail=True, methods=['post'])
+    def mute(self, request, pk=None):
+        """Set ``muted``; muted threads do not count towards the unread total."""
+        thread = self.get_object()
+        serializer = MuteSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        muted = serializer.validated_data['muted']
+        Membership.objects.filter(thread=thread, user=request.user).update(muted=muted)
+        caching.invalidate_users([request.user.id])
+        return Response({'muted': muted})
+
+
+    @action(detail=True, methods=['post'])
+    def read(self, request, pk=None):
+        """Mark every message up to a watermark (id or timestamp) as read."""
+        thread = self.get_object()
+        serializer = ReadWatermarkSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        up_to_id = serializer.validated_data.get('up_to_id')
+        up_to = serializer.validated_data.get('up_to')
+
+        if thread.is_group:
+            # Groups keep one watermark per member instead of a flag per message.
+            with transaction.atomic():
+                updated, watermark = Membership.objects.mark_read(request.user.id, thread.id, up_to_id, up_to)
+                if updated:
+                    caching.invalidate_users([request.user.id])
+                    events.messages_read(thread.id, up_to_id=watermark, reader_id=request.user.id)
+            return Response({'updated': updated})
 
-class MessageViewSet(viewsets.ModelViewSet):
+        messages = Message.objects.filter(thread=thread, is_read=False).exclude(sender=request.user)
+        if up_to_id is not None:
+            messages = messages.filter(id__lte=up_to_id)
+        if up_to is not None:
+            messages = messages.filter(created__lte=up_to)
+
+        with transaction.atomic():
+            updated = messages.update(is_read=True)
+            UnreadCounter.objects.mark_read(request.user.id, thread.id, updated)
+            if updated:
+                caching.invalidate_threads([thread.id])
+                events.messages_read(thread.id, up_to_id=up_to_id, reader_id=request.user.id)
+        return Response({'updated': updated})
+
+    @action(detail=True, methods=['get'])
+    def export(self, request, pk=None):
+        """Stream every message of the thread as JSON Lines, oldest first.
+
+        ``?after=<cursor>`` resumes after a previously exported line and
+        ``?gzip=1`` compresses the stream.
+        """
+        thread = self.get_object()
+        after = request.query_params.get('after')
+        if after:
+            try:
+                after = decode_cursor(after)
+            except ValueError:
+                raise NotFound('Invalid cursor')
+        compress = request.query_params.get('gzip') in ('1', 'true')
+
+        chunks = encode_lines(export_lines([thread.id], after=after or None), compress=compress)
+        if isinstance(request._request, ASGIRequest):
+            chunks = aiterate(chunks)
+        response = StreamingHttpResponse(
+            chunks,
+            content_type='application/gzip' if compress else 'application/x-ndjson',
+        )
+        filename = f'thread-{thread.id}.jsonl' + ('.gz' if compress else '')
+        response['Content-Disposition'] = f'attachment; filename="{filename}"'
+        return response
+
+
+@method_decorator(gzip_response, name='dispatch')
+class MessageViewSet(ReplicaReadMixin, CachedListMixin, viewsets.ModelViewSet):
     """ViewSet for managing messages."""
 
     serializer_class = MessageSerializer
     permission_classes = [permissions.IsAuthenticated]
+    renderer_classes = CHAT_RENDERERS
+    bulk_max_size = 1000
+    throttle_scopes = {'create': 'send', 'bulk': 'send', 'unread_count': 'unread'}
+
+    def get_serializer_class(self):
+        if self.action == 'list':
+            return MessageRowSerializer
+        return super().get_serializer_class()
 
     def get_queryset(self):
         """Get messages from threads where current user is a participant."""
-        return Message.objects.filter(thread__participants=self.request.user)
+        if self.action == 'list':
+            queryset = message_queryset(self.request.user, self.request.query_params.get('thread'))
+            return MessageRowSerializer.rows(queryset)
+        return message_queryset(self.request.user)
+
+    def get_archive_queryset(self):
+        """Archived messages, merged into list pages that reach past the hot table."""
+        queryset = archived_message_queryset(self.request.user, self.request.query_params.get('thread'))
+        return MessageRowSerializer.rows(queryset)
 
     def perform_create(self, serializer):
         """Save message with current user as sender."""
         serializer.save(sender=self.request.user)
 
+    def perform_destroy(self, instance):
+        # Message deletes are not signalled, so thread deletes keep cascading
+        # without loading every message.
+        instance.delete()
+        caching.invalidate_threads([instance.thread_id])
+
     @action(detail=True, methods=['post'])
     def mark_as_read(self, request, pk=None):
         """Mark a message as read."""
+        # get_queryset() already limits this to the user's threads.
         msg = self.get_object()
-        if msg.thread.participants.filter(id=request.user.id).exists():
+        if msg.thread.is_group:
+            # In groups, reading a message reads everything before it too.
+            updated, watermark = Membership.objects.mark_read(request.user.id, msg.thread_id, msg.id)
+            if updated:
+                caching.invalidate_users([request.user.id])
+                events.messages_read(msg.thread_id, up_to_id=watermark, reader_id=request.user.id)
+        elif not msg.is_read:
             msg.is_read = True
-            msg.save()
-            return Response({'status': 'marked as read'})
+            msg.save(update_fields=['is_read'])
+            events.messages_read(msg.thread_id, message_ids=[msg.id], reader_id=request.user.id)
+        return Response({'status': 'marked as read'})
+
+    @action(detail=False, methods=['post'], url_path='read')
+    def mark_many_as_read(self, request):
+        """Mark a list of messages as read in a single update.
+
+        In group threads the reader's watermark moves up to the newest listed message.
+        """
+        serializer = MessageIdsSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+
+        with transaction.atomic():
+            unread = (
+                Message.objects.select_for_update(of=('self',))
+                .filter(id__in=serializer.validated_data['ids'], thread__participants=request.user, is_read=False)
+                .exclude(sender=request.user)
+            )
+            per_thread, per_group = {}, {}
+            for message_id, thread_id, is_group in unread.values_list('id', 'thread_id', 'thread__is_group'):
+                if is_group:
+                    per_group[thread_id] = max(per_group.get(thread_id, 0), message_id)
+                else:
+                    per_thread.setdefault(thread_id, []).append(message_id)
+
+            ids = [message_id for message_ids in per_thread.values() for message_id in message_ids]
+            updated = Message.objects.filter(id__in=ids, is_read=False).update(is_read=True) if ids else 0
+            for thread_id, message_ids in per_thread.items():
+                UnreadCounter.objects.mark_read(request.user.id, thread_id, len(message_ids))
+                events.messages_read(thread_id, message_ids=message_ids, reader_id=request.user.id)
+            caching.invalidate_threads(per_thread)
+            for thread_id, up_to_id in per_group.items():
+                read, watermark = Membership.objects.mark_read(request.user.id, thread_id, up_to_id)
+                if read:
+                    updated += read
+                    events.messages_read(thread_id, up_to_id=watermark, reader_id=request.user.id)
+            if per_group:
+                caching.invalidate_users([request.user.id])
+        return Response({'updated': updated})
+
+    @action(detail=False, methods=['post'])
+    def bulk(self, request):
+        """Send many messages at once, reporting the outcome of each item.
+
+        Membership is checked once per distinct thread and all valid items are
+        inserted in one transaction; invalid items do not abort the batch.
+        """
+        items = request.data if isinstance(request.data, list) else request.data.get('messages')
+        if not isinstance(items, list) or not items:
+            return Response({'detail': 'Expected a non-empty list of messages.'}, status=status.HTTP_400_BAD_REQUEST)
+        if len(items) > self.bulk_max_size:
+            return Response({'detail': f'At most {self.bulk_max_size} messages per request.'},
+                            status=status.HTTP_400_BAD_REQUEST)
+
+        results = [None] * len(items)
+        valid = []
+        for index, item in enumerate(items):
+            serializer = BulkMessageSerializer(data=item)
+            if serializer.is_valid():
+                valid.append((index, serializer.validated_data))
+            else:
+                results[index] = {'index': index, 'status': 400, 'errors': serializer.errors}
+
+        thread_ids = {data['thread'] for _, data in valid}
+        threads = {
+            thread.pk: thread
+            for thread in with_participation(Thread.objects.filter(pk__in=thread_ids), request.user)
+        }
+        accepted = []
+        for index, data in valid:
+            thread = threads.get(data['thread'])
+            if thread is None:
+                errors = {'thread': [f'Invalid pk "{data["thread"]}" - object does not exist.']}
+            elif not thread.is_participant:
+                errors = {'thread': ['You are not a participant in this thread.']}
+            else:
+                accepted.append((index, data))
+                continue
+            results[index] = {'index': index, 'status': 400, 'errors': errors}
+
+        messages = Message.objects.bulk_send(request.user.id, [(data['thread'], data['text']) for _, data in accepted])
+        for (index, _), message in zip(accepted, messages):
+            results[index] = {'index': index, 'status': 201, 'message': MessageSerializer(message).data}
+        for thread_id in {message.thread_id for message in messages}:
+            caching.invalidate_thread(threads[thread_id])
+        events.messages_created(messages)
+
+        created = len(messages)
         return Response(
-            {'error': 'Not allowed'},
-            status=status.HTTP_403_FORBIDDEN
+            {'created': created, 'failed': len(items) - created, 'results': results},
+            status=status.HTTP_201_CREATED if created == len(items) else status.HTTP_207_MULTI_STATUS,
         )
 
+    @action(detail=False, methods=['get'])
+    def search(self, request):
+        """Full-text search over the user's messages, best matches first.
+
+        ``?q=`` holds the words to find (the last one also matches as a
+        prefix); ``?thread=<id>`` limits the search to one thread.
+        """
+        terms = search_terms(request.query_params.get('q', ''))
+        if not terms:
+            return Response({'q': ['This field is required.']}, status=status.HTTP_400_BAD_REQUEST)
+        thread_id = request.query_params.get('thread')
+        if thread_id is not None:
+            thread_id = parse_id(thread_id)
+            if thread_id is None:
+                return Response({'thread': ['A valid integer is required.']}, status=status.HTTP_400_BAD_REQUEST)
+
+        backends = [get_backend(Message)]
+        if archive_horizon() is not None:
+            backends.append(get_backend(ArchivedMessage))
+        paginator = SearchPagination()
+        page = paginator.paginate_search(backends, request.user, terms, request, thread_id)
+        return paginator.get_paginated_response(self.get_serializer(page, many=True).data)
+
     @action(detail=False, methods=['get'], url_path='unread')
     def unread_count(self, request):
         """Get count of unread messages."""
-        count = Message.objects.filter(
-            thread__participants=request.user,
-            is_read=False
-        ).exclude(sender=request.user).count()
+        count = UnreadCounter.objects.total_for(request.user)
 
         return Response({'unread_count': count})
 
 
-class UnreadCountView(generics.GenericAPIView):
+class UnreadCountView(ReplicaReadMixin, generics.GenericAPIView):
     """View for getting unread message count."""
 
     permission_classes = [permissions.IsAuthenticated]
+    throttle_scope = 'unread'
 
     def get(self, request):
         """Get count of unread messages for current user."""
-        count = Message.objects.filter(
-            thread__participants=request.user,
-            is_read=False
-        ).exclude(sender=request.user).count()
+        count = UnreadCounter.objects.total_for(request.user)
 
         return Response({'unread_count': count})
\ No newline at end of file
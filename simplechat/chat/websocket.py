@@ -0,0 +1,88 @@
+import asyncio
+import json
+from urllib.parse import parse_qs
+
+from asgiref.sync import sync_to_async
+from rest_framework.exceptions import AuthenticationFailed
+from rest_framework_simplejwt.exceptions import InvalidToken
+
+from .authentication import CachedJWTAuthentication
+from .broker import get_broker
+
+# Close codes in the application range (4000-4999).
+CLOSE_UNAUTHORIZED = 4401
+CLOSE_NOT_FOUND = 4404
+
+
+class ChatSocket:
+    """ASGI application pushing chat events to one authenticated user.
+
+    Clients connect to ``path`` with the same access token used for the REST
+    API, either as ``?token=<jwt>`` or in an ``Authorization: Bearer`` header,
+    and receive JSON events (``message.created``, ``message.read`` and
+    ``unread.changed``) for their threads.
+    """
+
+    path = '/ws/chat/'
+
+    def __init__(self, broker=None):
+        self.broker = broker
+        self.authentication = CachedJWTAuthentication()
+
+    async def __call__(self, scope, receive, send):
+        event = await receive()
+        if event['type'] != 'websocket.connect':
+            return
+        if scope['path'] != self.path:
+            await send({'type': 'websocket.close', 'code': CLOSE_NOT_FOUND})
+            return
+
+        user = await self.authenticate(scope)
+        if user is None:
+            await send({'type': 'websocket.close', 'code': CLOSE_UNAUTHORIZED})
+            return
+        await send({'type': 'websocket.accept'})
+
+        subscription = (self.broker or get_broker()).subscribe(user.id)
+        try:
+            await self.pump(subscription, receive, send)
+        finally:
+            subscription.close()
+
+    async def pump(self, subscription, receive, send):
+        """Forward broker events until the client disconnects."""
+        incoming = asyncio.ensure_future(receive())
+        outgoing = asyncio.ensure_future(subscription.get())
+        try:
+            while True:
+                done, _ = await asyncio.wait({incoming, outgoing}, return_when=asyncio.FIRST_COMPLETED)
+                if outgoing in done:
+                    await send({'type': 'websocket.send', 'text': json.dumps(outgoing.result())})
+                    outgoing = asyncio.ensure_future(subscription.get())
+                if incoming in done:
+                    if incoming.result()['type'] == 'websocket.disconnect':
+                        return
+                    # The socket is push-only; client frames are ignored.
+                    incoming = asyncio.ensure_future(receive())
+        finally:
+            incoming.cancel()
+            outgoing.cancel()
+
+    async def authenticate(self, scope):
+        raw_token = self.get_raw_token(scope)
+        if raw_token is None:
+            return None
+        try:
+            token = self.authentication.get_validated_token(raw_token)
+            return await sync_to_async(self.authentication.get_user)(token)
+        except (InvalidToken, AuthenticationFailed):
+            return None
+
+    def get_raw_token(self, scope):
+        tokens = parse_qs(scope.get('query_string', b'').decode('latin-1')).get('token')
+        if tokens:
+            return tokens[0].encode()
+        for name, value in scope.get('headers', []):
+            if name == b'authorization':
+                return self.authentication.get_raw_token(value)
+        return None
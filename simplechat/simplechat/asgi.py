@@ -2,6 +2,7 @@
 ASGI config for simplechat project.
 
 It exposes the ASGI callable as a module-level variable named ``application``.
+HTTP requests go to Django; WebSocket connections go to the chat event socket.
 
 For more information on this file, see
 https://docs.djangoproject.com/en/4.2/howto/deployment/asgi/
@@ -13,4 +14,15 @@ from django.core.asgi import get_asgi_application
 
 os.environ.setdefault("DJANGO_SETTINGS_MODULE", "simplechat.settings")
 
-application = get_asgi_application()
+django_application = get_asgi_application()
+
+# Imported after setup so the chat app and its models are ready.
+from chat.websocket import ChatSocket  # noqa: E402
+
+websocket_application = ChatSocket()
+
+
+async def application(scope, receive, send):
+    if scope['type'] == 'websocket':
+        return await websocket_application(scope, receive, send)
+    return await django_application(scope, receive, send)
@@ -10,6 +10,7 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/4.2/ref/settings/
 """
 
+import os
 from pathlib import Path
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
@@ -51,6 +52,21 @@ MIDDLEWARE = [
     "django.contrib.messages.middleware.MessageMiddleware",
     "django.middleware.clickjacking.XFrameOptionsMiddleware",
 ]
+# Per-route latency, query and serializer metrics, served at /metrics in the
+# Prometheus text format. Set METRICS=0 to turn them off.
+if os.environ.get("METRICS", "1") == "1":
+    MIDDLEWARE.insert(0, "chat.metrics.MetricsMiddleware")
+# Bearer token required to read /metrics; when empty, only staff sessions
+# (or anyone, with DEBUG on) can read it.
+CHAT_METRICS_TOKEN = os.environ.get("METRICS_TOKEN", "")
+# Log requests slower than this (ms) with their SQL to "chat.slow_requests"; 0 disables.
+CHAT_SLOW_REQUEST_MS = int(os.environ.get("SLOW_REQUEST_MS", 0))
+# Requests served at once by each process before new ones get a 503 with
+# Retry-After; 0 disables the limit. Long polls and /metrics do not count.
+MIDDLEWARE.insert(MIDDLEWARE.index("django.middleware.security.SecurityMiddleware"), "chat.throttling.ConcurrencyLimitMiddleware")
+CHAT_MAX_CONCURRENT_REQUESTS = int(os.environ.get("MAX_CONCURRENT_REQUESTS", 100))
+CHAT_CONCURRENCY_EXEMPT_PATHS = ["/chat/messages/stream/", "/metrics"]
+CHAT_SHED_RETRY_AFTER = 1
 
 ROOT_URLCONF = "simplechat.urls"
 
@@ -76,22 +92,129 @@ WSGI_APPLICATION = "simplechat.wsgi.application"
 # Database
 # https://docs.djangoproject.com/en/4.2/ref/settings/#databases
 
+# SQLite by default. Set DB_ENGINE (e.g. "postgresql") and DB_NAME, DB_USER,
+# DB_PASSWORD, DB_HOST, DB_PORT to use a server database instead.
+DB_ENGINE = os.environ.get("DB_ENGINE", "sqlite3")
 DATABASES = {
     "default": {
-        "ENGINE": "django.db.backends.sqlite3",
-        "NAME": BASE_DIR / "db.sqlite3",
+        "ENGINE": f"django.db.backends.{DB_ENGINE}",
+        "NAME": os.environ.get("DB_NAME", BASE_DIR / "db.sqlite3"),
+        # Keep connections open between requests (seconds; 0 closes them after
+        # each request) and check them before reuse.
+        "CONN_MAX_AGE": int(os.environ.get("DB_CONN_MAX_AGE", 60)),
+        "CONN_HEALTH_CHECKS": os.environ.get("DB_CONN_HEALTH_CHECKS", "1") == "1",
     }
 }
+if DB_ENGINE != "sqlite3":
+    DATABASES["default"].update({
+        "USER": os.environ.get("DB_USER", ""),
+        "PASSWORD": os.environ.get("DB_PASSWORD", ""),
+        "HOST": os.environ.get("DB_HOST", ""),
+        "PORT": os.environ.get("DB_PORT", ""),
+    })
+
+# Read replicas for the chat list and unread endpoints: a comma-separated list
+# of SQLite files, or of hosts when DB_ENGINE is a server database. Tests run
+# them as mirrors of the default database.
+for index, replica in enumerate(filter(None, os.environ.get("DB_REPLICAS", "").split(",")), 1):
+    DATABASES[f"replica{index}"] = {
+        **DATABASES["default"],
+        ("NAME" if DB_ENGINE == "sqlite3" else "HOST"): replica.strip(),
+        "TEST": {"MIRROR": "default"},
+    }
+CHAT_READ_REPLICAS = [alias for alias in DATABASES if alias != "default"]
+
+# Messages older than CHAT_ARCHIVE_AFTER_DAYS are moved to the archive table by
+# "manage.py archive_messages". It stays in the default database unless
+# ARCHIVE_DB_NAME names a separate SQLite file (or database on DB_HOST).
+CHAT_ARCHIVE_AFTER_DAYS = int(os.environ.get("CHAT_ARCHIVE_AFTER_DAYS", 180))
+CHAT_ARCHIVE_DATABASE = "default"
+if os.environ.get("ARCHIVE_DB_NAME"):
+    DATABASES["archive"] = {**DATABASES["default"], "NAME": os.environ["ARCHIVE_DB_NAME"]}
+    CHAT_ARCHIVE_DATABASE = "archive"
+
+DATABASE_ROUTERS = ["chat.routers.ArchiveRouter", "chat.routers.ReplicaRouter"]
+# Seconds a user's reads stay on the primary after they write.
+CHAT_REPLICA_STICKY_SECONDS = int(os.environ.get("DB_REPLICA_STICKY_SECONDS", 5))
+
+# PRAGMAs run on every new SQLite connection. WAL lets readers proceed while
+# a message is written, synchronous=NORMAL is durable in WAL mode up to the
+# last checkpoint, and busy_timeout (ms) makes writers wait instead of failing.
+CHAT_SQLITE_PRAGMAS = {
+    "journal_mode": os.environ.get("SQLITE_JOURNAL_MODE", "wal"),
+    "synchronous": os.environ.get("SQLITE_SYNCHRONOUS", "normal"),
+    "busy_timeout": int(os.environ.get("SQLITE_BUSY_TIMEOUT", 5000)),
+}
+# How atomic blocks begin on SQLite. IMMEDIATE makes concurrent writers queue
+# on busy_timeout rather than fail with "database is locked".
+CHAT_SQLITE_TRANSACTION_MODE = os.environ.get("SQLITE_TRANSACTION_MODE", "IMMEDIATE")
 
 
 
 REST_FRAMEWORK = {
     'DEFAULT_AUTHENTICATION_CLASSES': (
-        'rest_framework_simplejwt.authentication.JWTAuthentication',
+        'chat.authentication.CachedJWTAuthentication',
     ),
-    'DEFAULT_PAGINATION_CLASS': 'rest_framework.pagination.LimitOffsetPagination',
+    'DEFAULT_PAGINATION_CLASS': 'chat.pagination.KeysetPagination',
     'PAGE_SIZE': 10,
 }
+# Per-user token buckets: a user may burst up to <count> requests of a class,
+# refilled at <count> per period. Views map their actions to a class with
+# throttle_scope / throttle_scopes; otherwise reads are "read" and writes
+# "write". Set THROTTLE=0 to turn throttling off (e.g. for load tests).
+if os.environ.get("THROTTLE", "1") == "1":
+    REST_FRAMEWORK.update({
+        'DEFAULT_THROTTLE_CLASSES': ('chat.throttling.TokenBucketThrottle',),
+        'DEFAULT_THROTTLE_RATES': {
+            'read': '600/min',
+            'write': '120/min',
+            'send': '60/min',
+            'unread': '120/min',
+        },
+    })
+# Where buckets live: per process (LocalBucketStore) or in a cache shared by
+# every process (CacheBucketStore, using CHAT_THROTTLE_CACHE).
+CHAT_THROTTLE_STORE = 'chat.throttling.LocalBucketStore'
+CHAT_THROTTLE_CACHE = "default"
+
+# Per-process memory by default; set REDIS_URL to share the cache (and its
+# invalidations) between processes in production.
+CACHES = {
+    "default": {
+        "BACKEND": "django.core.cache.backends.locmem.LocMemCache",
+    }
+}
+if os.environ.get("REDIS_URL"):
+    CACHES["default"] = {
+        "BACKEND": "django.core.cache.backends.redis.RedisCache",
+        "LOCATION": os.environ["REDIS_URL"],
+    }
+
+# Cache alias and lifetime (seconds) for serialized thread/message pages.
+CHAT_PAGE_CACHE = "default"
+CHAT_PAGE_CACHE_TTL = 300
+
+# Cache alias and lifetime (seconds) for users loaded by CachedJWTAuthentication.
+CHAT_AUTH_CACHE = "default"
+CHAT_AUTH_CACHE_TTL = 60
+
+# Fan-out for real-time events on /ws/chat/. The in-process broker only
+# reaches sockets served by the same process; point this at a subclass of
+# chat.broker.BaseBroker backed by a shared pub/sub service to scale out.
+CHAT_BROKER = 'chat.broker.InProcessBroker'
+
+# Side effects of sends and reads (real-time events, unread pushes) run
+# "inline" after commit, or are written to the task table in "queue" mode and
+# run by "manage.py chat_worker". Queue mode needs a CHAT_BROKER shared
+# between processes, since the worker publishes the events; the system
+# checks reject it with the in-process broker.
+CHAT_TASKS_MODE = os.environ.get("TASKS_MODE", "inline")
+CHAT_TASKS_MAX_ATTEMPTS = 5
+# Seconds a worker may hold a claimed task before another worker retries it.
+CHAT_TASKS_LEASE_SECONDS = 60
+
+# Largest group thread, counting its creator.
+CHAT_GROUP_MAX_MEMBERS = int(os.environ.get("CHAT_GROUP_MAX_MEMBERS", 1000))
 
 # Password validation
 # https://docs.djangoproject.com/en/4.2/ref/settings/#auth-password-validators